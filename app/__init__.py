@@ -1,4 +1,6 @@
+import os
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from config import config
 from app.extensions import db, migrate, login_manager
 
@@ -8,12 +10,46 @@ def create_app(config_name='default'):
     # Chargement de la config
     app.config.from_object(config[config_name])
 
+    # Journalisation structurée en file (avant tout message de démarrage)
+    from app import logs
+    logs.init_app(app)
+
+    # Méthode de hachage invalide : erreur au démarrage plutôt qu'à la première connexion
+    from app.passwords import normalize_method
+    normalize_method(app.config.get('PASSWORD_HASH_METHOD'))
+
+    # Cache de bytecode des templates (doit être configuré avant la création de jinja_env)
+    if app.config.get('JINJA_BYTECODE_CACHE'):
+        cache_dir = app.config['JINJA_BYTECODE_CACHE_DIR']
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(cache_dir)}
+
+    # Cache de fragments ({% cache %} dans les templates)
+    from app import fragment_cache
+    fragment_cache.init_app(app)
+
+    # Réplique en lecture optionnelle (doit précéder db.init_app, qui lit SQLALCHEMY_BINDS)
+    from app import replica
+    replica.init_app(app)
+
+    # Limitation de débit et délestage (réponses 429 / 503)
+    from app import ratelimit
+    ratelimit.init_app(app)
+
+    # Métriques Prometheus (/metrics), agrégées entre les workers gunicorn
+    from app import metrics
+    metrics.init_app(app)
+
     # Initialisation des extensions
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
 
     from app import models
+    from app import search  # noqa: F401 (maintien de l'index de recherche à chaque flush)
+    from app import archival  # noqa: F401 (suppression des archives avec leur appartement / locataire)
+    from app import sync  # noqa: F401 (numéros de changement et tombstones de la synchronisation)
+    from app import access  # noqa: F401 (accès des équipes aux nouveaux immeubles)
 
     # Enregistrement des Blueprints (Modules)
 
@@ -30,4 +66,8 @@ def create_app(config_name='default'):
     from app.blueprints.finances import finances_bp
     app.register_blueprint(finances_bp, url_prefix='/finances')
 
+    # Commandes CLI (flask warmup, flask bench ...)
+    from app.commands import register_commands
+    register_commands(app)
+
     return app
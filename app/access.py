@@ -0,0 +1,138 @@
+"""
+Accès des équipes aux immeubles d'un propriétaire (Premium, `multi_users`).
+
+Un propriétaire invite un compte existant comme gestionnaire ou gardien, sur
+tous ses immeubles ou sur certains (`team_members`). Les droits sont dépliés
+dans `property_access`, une ligne par membre et par immeuble (clé primaire
+(member_id, property_id)) :
+  - un immeuble créé par le propriétaire est ajouté, dans le même flush, aux
+    membres invités sur « tous les immeubles » ;
+  - supprimer un immeuble ou un compte supprime ses lignes (ON DELETE CASCADE).
+
+Les immeubles partagés avec l'utilisateur connecté sont lus une fois par
+requête (une lecture de la clé primaire) et gardés dans `g` : chaque contrôle
+d'autorisation (`OwnedMixin.get_accessible_or_404`) devient
+`owner_id = ? OR property_id IN (...)`, sans remonter les objets en Python.
+Quand l'abonnement Premium du propriétaire expire, ses immeubles ne sont plus
+partagés (les lignes restent, pour un renouvellement).
+
+Le tableau de bord, les exports, les relances, la recherche et /sync restent
+propres au propriétaire.
+"""
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import PLAN_FEATURES, Property, PropertyAccess, TeamMember, User
+
+MANAGER = 'manager'
+SHARING_PLANS = [plan for plan, features in PLAN_FEATURES.items() if 'multi_users' in features]
+
+
+# ====== LECTURE (une requête par requête HTTP) ======
+
+def shared_access(user):
+    """Immeubles partagés avec l'utilisateur, {property_id: rôle}."""
+    cache = g.setdefault('shared_access', {}) if has_request_context() else {}
+    if user.id not in cache:
+        rows = db.session.execute(
+            db.select(PropertyAccess.property_id, PropertyAccess.role)
+            .join(User, User.id == PropertyAccess.owner_id)
+            .where(PropertyAccess.member_id == user.id, User.effective_plan.in_(SHARING_PLANS))).all()
+        cache[user.id] = dict(rows)
+    return cache[user.id]
+
+
+def shared_property_ids(user, manage=False):
+    """Id des immeubles partagés (seulement ceux où l'utilisateur est gestionnaire si `manage`)."""
+    return [property_id for property_id, role in shared_access(user).items() if not manage or role == MANAGER]
+
+
+def can_manage(user, property):
+    """Le propriétaire ou un gestionnaire de l'immeuble (appartements, locataires, suppressions)."""
+    return property.owner_id == user.id or shared_access(user).get(property.id) == MANAGER
+
+
+def invalidate(member_id):
+    if has_request_context():
+        g.get('shared_access', {}).pop(member_id, None)
+
+
+# ====== ÉCRITURE ======
+
+def _rebuild(connection, membership, property_ids=()):
+    """Réécrit les lignes d'accès d'un membre chez ce propriétaire."""
+    access, properties = PropertyAccess.__table__, Property.__table__
+    connection.execute(access.delete().where(access.c.member_id == membership.member_id,
+                                             access.c.owner_id == membership.owner_id))
+    granted = db.select(db.literal(membership.member_id), properties.c.id, properties.c.owner_id,
+                        db.literal(membership.role)).where(properties.c.owner_id == membership.owner_id)
+    if not membership.all_properties:
+        granted = granted.where(properties.c.id.in_(list(property_ids)))
+    connection.execute(access.insert().from_select(['member_id', 'property_id', 'owner_id', 'role'], granted))
+    invalidate(membership.member_id)
+
+
+def grant(owner, member, role, property_ids=None):
+    """
+    Invite (ou met à jour) un membre de l'équipe du propriétaire.
+
+    Args:
+        property_ids: Immeubles partagés, None = tous (y compris les futurs)
+
+    Raises:
+        ValueError: Rôle inconnu, ou le propriétaire lui-même
+
+    Returns:
+        TeamMember
+    """
+    if role not in TeamMember.ROLES:
+        raise ValueError(f"Rôle inconnu : {role}")
+    if member.id == owner.id:
+        raise ValueError("Vous ne pouvez pas vous inviter vous-même.")
+
+    membership = TeamMember.query.filter_by(owner_id=owner.id, member_id=member.id).first()
+    if membership is None:
+        membership = TeamMember(owner_id=owner.id, member_id=member.id)
+        db.session.add(membership)
+    membership.role = role
+    membership.all_properties = property_ids is None
+    db.session.flush()
+    _rebuild(db.session.connection(), membership, property_ids or ())
+    return membership
+
+
+def revoke(membership):
+    """Retire un membre de l'équipe et tous ses accès chez ce propriétaire."""
+    access = PropertyAccess.__table__
+    db.session.connection().execute(access.delete().where(access.c.member_id == membership.member_id,
+                                                          access.c.owner_id == membership.owner_id))
+    db.session.delete(membership)
+    invalidate(membership.member_id)
+
+
+def member_property_ids(membership):
+    """Immeubles actuellement partagés avec un membre (affichage de l'équipe)."""
+    return set(db.session.scalars(db.select(PropertyAccess.property_id)
+                                  .where(PropertyAccess.member_id == membership.member_id,
+                                         PropertyAccess.owner_id == membership.owner_id)))
+
+
+@event.listens_for(Session, 'after_flush')
+def _share_new_properties(session, flush_context):
+    """Immeuble créé (ou transféré) : accès des membres invités sur tous les immeubles du propriétaire."""
+    properties = [obj for obj in session.new if isinstance(obj, Property)]
+    properties += [obj for obj in session.dirty if isinstance(obj, Property)
+                   and db.inspect(obj).attrs['owner_id'].history.has_changes()]
+    if not properties:
+        return
+
+    access, members = PropertyAccess.__table__, TeamMember.__table__
+    connection = session.connection()
+    for obj in properties:
+        connection.execute(access.delete().where(access.c.property_id == obj.id))
+        connection.execute(access.insert().from_select(
+            ['member_id', 'property_id', 'owner_id', 'role'],
+            db.select(members.c.member_id, db.literal(obj.id), members.c.owner_id, members.c.role)
+            .where(members.c.owner_id == obj.owner_id, members.c.all_properties.is_(True))))
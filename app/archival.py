@@ -0,0 +1,173 @@
+"""
+Archivage chaud / froid des paiements anciens et des locataires partis.
+
+`flask data archive` déplace par lots (une transaction par lot) :
+  - les paiements dont la période est plus ancienne que ARCHIVE_PAYMENTS_AFTER_MONTHS
+    vers `payments_archive` ;
+  - les locataires inactifs sans paiement récent depuis ARCHIVE_TENANTS_AFTER_MONTHS
+    vers `tenants_archive`.
+
+Les lignes gardent leur id. L'historique d'un locataire et l'export Excel lisent
+les deux tables (voir finances/services.py) ; le tableau de bord et les relances
+ne lisent que les tables chaudes. Supprimer un appartement ou un locataire
+supprime aussi ses archives.
+"""
+import logging
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import periods
+from app.extensions import db
+from app.models import (ArchivedPayment, ArchivedTenant, Payment, ReminderJob, SearchEntry, Tenant, TenantScore,
+                        Unit, User, cascaded_deletes, void_receipts)
+
+logger = logging.getLogger(__name__)
+
+# Le graphique des revenus du tableau de bord couvre 12 mois : ils restent chauds
+MIN_HORIZON_MONTHS = 12
+
+_PAYMENT_COLUMNS = [column.name for column in ArchivedPayment.__table__.columns if column.name != 'archived_at']
+_TENANT_COLUMNS = [column.name for column in ArchivedTenant.__table__.columns if column.name != 'archived_at']
+
+
+def _move(connection, model, archive_model, columns, ids):
+    """INSERT ... SELECT vers l'archive puis DELETE de la table chaude, dans la transaction courante."""
+    source, target = model.__table__, archive_model.__table__
+    connection.execute(target.insert().from_select(
+        columns, db.select(*[source.c[name] for name in columns]).where(source.c.id.in_(ids))))
+    connection.execute(source.delete().where(source.c.id.in_(ids)))
+
+
+def _bump_owners(connection, owner_ids):
+    # Les caches de fragments des propriétaires touchés sont invalidés (voir models.py, 9bis)
+    owner_ids = {owner_id for owner_id in owner_ids if owner_id is not None}
+    if owner_ids:
+        users = User.__table__
+        connection.execute(users.update().where(users.c.id.in_(owner_ids))
+                           .values(data_version=db.func.coalesce(users.c.data_version, 0) + 1))
+
+
+def archive_payments(before_index, batch_size=1000):
+    """
+    Archive les paiements de période < before_index, par lots.
+
+    Returns:
+        int: Nombre de paiements archivés
+    """
+    payments, jobs = Payment.__table__, ReminderJob.__table__
+    total = 0
+    while True:
+        rows = db.session.execute(
+            db.select(payments.c.id, payments.c.owner_id, payments.c.receipt_token)
+            .where(payments.c.period_index < before_index)
+            .order_by(payments.c.id)
+            .limit(batch_size)).all()
+        if not rows:
+            break
+
+        ids = [row.id for row in rows]
+        connection = db.session.connection()
+        # Paiements anciens sans token : il en faut un pour le lien public de la quittance archivée
+        missing = [{'payment_id': row.id, 'token': str(uuid.uuid4())} for row in rows if not row.receipt_token]
+        if missing:
+            connection.execute(payments.update().where(payments.c.id == db.bindparam('payment_id'))
+                               .values(receipt_token=db.bindparam('token')), missing)
+        # Les envois WhatsApp d'il y a des années n'ont plus d'utilité (et référencent payments)
+        connection.execute(jobs.delete().where(jobs.c.payment_id.in_(ids)))
+        _move(connection, Payment, ArchivedPayment, _PAYMENT_COLUMNS, ids)
+        _bump_owners(connection, {row.owner_id for row in rows})
+        db.session.commit()
+        total += len(ids)
+    return total
+
+
+def archive_tenants(before_index, batch_size=1000):
+    """
+    Archive les locataires inactifs sans paiement chaud ni paiement archivé
+    récent (période >= before_index), entrés avant l'horizon.
+
+    Returns:
+        int: Nombre de locataires archivés
+    """
+    tenants, payments, archived = Tenant.__table__, Payment.__table__, ArchivedPayment.__table__
+    jobs, entries, scores = ReminderJob.__table__, SearchEntry.__table__, TenantScore.__table__
+    horizon_date = periods.first_day(before_index)
+
+    candidates = (db.select(tenants.c.id, tenants.c.owner_id)
+                  .where(tenants.c.is_active.is_not(True),
+                         db.or_(tenants.c.entry_date.is_(None), tenants.c.entry_date < horizon_date),
+                         ~db.exists().where(payments.c.tenant_id == tenants.c.id),
+                         ~db.exists().where(archived.c.tenant_id == tenants.c.id,
+                                            archived.c.period_index >= before_index))
+                  .order_by(tenants.c.id)
+                  .limit(batch_size))
+
+    total = 0
+    while True:
+        rows = db.session.execute(candidates).all()
+        if not rows:
+            break
+
+        ids = [row.id for row in rows]
+        connection = db.session.connection()
+        connection.execute(jobs.delete().where(jobs.c.tenant_id.in_(ids)))
+        connection.execute(entries.delete().where(entries.c.kind == 'tenant', entries.c.object_id.in_(ids)))
+        connection.execute(scores.delete().where(scores.c.tenant_id.in_(ids)))
+        _move(connection, Tenant, ArchivedTenant, _TENANT_COLUMNS, ids)
+        _bump_owners(connection, {row.owner_id for row in rows})
+        db.session.commit()
+        total += len(ids)
+    return total
+
+
+def run_archival(payments_after_months, tenants_after_months, batch_size=1000, today=None):
+    """
+    Archive paiements puis locataires (un locataire n'est archivable qu'une fois
+    tous ses paiements archivés).
+
+    Raises:
+        ValueError: Horizon plus court que la fenêtre du tableau de bord
+
+    Returns:
+        dict: Compteurs {'payments': n, 'tenants': n}
+    """
+    if min(payments_after_months, tenants_after_months) < MIN_HORIZON_MONTHS:
+        raise ValueError(f"L'horizon d'archivage doit être d'au moins {MIN_HORIZON_MONTHS} mois.")
+
+    current = periods.current_index(today)
+    counts = {
+        'payments': archive_payments(current - payments_after_months + 1, batch_size),
+        'tenants': archive_tenants(current - tenants_after_months + 1, batch_size),
+    }
+    logger.info("Archivage terminé: %s", counts)
+    return counts
+
+
+# Suppression en cascade des archives avec leur appartement ou leur locataire
+@event.listens_for(Session, 'after_flush')
+def _delete_archives_of_deleted(session, flush_context):
+    cascaded = cascaded_deletes(session)
+    unit_ids = {obj.id for obj in session.deleted if isinstance(obj, Unit)} | cascaded['unit']
+    tenant_ids = {obj.id for obj in session.deleted if isinstance(obj, Tenant)} | cascaded['tenant']
+    if not unit_ids and not tenant_ids:
+        return
+
+    connection = session.connection()
+    archived_tenants, archived_payments = ArchivedTenant.__table__, ArchivedPayment.__table__
+    if unit_ids:
+        tenant_ids.update(connection.scalars(
+            db.select(archived_tenants.c.id).where(archived_tenants.c.unit_id.in_(unit_ids))))
+        connection.execute(archived_tenants.delete().where(archived_tenants.c.unit_id.in_(unit_ids)))
+    if not tenant_ids:
+        return
+
+    payment_filter = archived_payments.c.tenant_id.in_(tenant_ids)
+    tokens = connection.scalars(db.select(archived_payments.c.receipt_token)
+                                .where(payment_filter, archived_payments.c.receipt_token.is_not(None))).all()
+    if tokens:
+        # Fichiers PDF supprimés après le commit (voir finances/archive.py)
+        session.info.setdefault('deleted_receipt_tokens', []).extend(tokens)
+    void_receipts(connection, archived_payments, payment_filter)
+    connection.execute(archived_payments.delete().where(payment_filter))
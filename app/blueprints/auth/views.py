@@ -15,6 +15,9 @@ def login():
         user = User.query.filter_by(email=form.email.data).first()
         # Vérification du mot de passe
         if user and user.check_password(form.password.data):
+            # Hash ancien (méthode ou coût changés) : mise à niveau transparente
+            if user.rehash_password_if_needed(form.password.data):
+                db.session.commit()
             login_user(user)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('main.index'))
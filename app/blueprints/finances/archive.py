@@ -0,0 +1,324 @@
+"""
+Archive des quittances PDF.
+
+Chaque quittance est générée une seule fois, hors requête (`flask receipts
+work`, chaque paiement est mis en file à la saisie), puis stockée compressée
+(gzip) sous son `receipt_token` dans RECEIPT_ARCHIVE_DIR. Le lien public
+`/r/<receipt_token>` (envoyé au locataire par WhatsApp) sert seulement le
+fichier : ni WeasyPrint, ni l'ORM, avec Range et cache d'une heure.
+
+Une quittance archivée ne change plus (document remis au locataire) ; le
+fichier est supprimé avec son paiement (quittance annulée).
+"""
+import gzip
+import io
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+
+from flask import current_app, has_app_context, render_template, request, send_file
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import lazy, metrics
+from app.extensions import db
+from app.models import ArchivedPayment, Payment, User, cascaded_deletes
+from app.ratelimit import Overloaded, job_slot
+from app.blueprints.finances.receipts import ENGINE_NATIVE, render_receipt_pdf
+
+logger = logging.getLogger(__name__)
+
+# Le contenu d'un lien public ne change pas, mais une quittance annulée doit cesser d'être
+# servie : une copie en cache (navigateur / CDN) lui survit au plus une heure
+PUBLIC_CACHE_CONTROL = 'public, max-age=3600'
+
+# Réponse du lien public tant que `flask receipts work` n'a pas généré la quittance
+PENDING_RETRY_AFTER = 120
+
+# Un token est un UUID : rien d'autre n'atteint le système de fichiers
+TOKEN_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+class ReceiptUnavailable(Exception):
+    """Aucun moteur PDF n'a pu générer la quittance."""
+
+
+# ====== GÉNÉRATION ======
+
+def _render_receipt_weasyprint(payment, owner, logo_path, brand_color):
+    """
+    Génère la quittance via le template HTML et WeasyPrint.
+
+    Args:
+        payment: Instance de Payment
+        owner: Instance de User (propriétaire)
+        logo_path: Chemin absolu du logo ou None
+        brand_color: Couleur principale
+
+    Returns:
+        bytes: Document PDF
+    """
+    HTML = lazy.weasyprint_html()
+    rendered_html = render_template('pdf/receipt_template.html',
+                          payment=payment,
+                          property=payment.tenant.unit.property,
+                          tenant=payment.tenant,
+                          owner=owner,
+                          logo_path=logo_path,
+                          brand_color=brand_color)
+    try:
+        logger.info("Début génération PDF pour paiement %s", payment.id)
+        if logo_path:
+            logger.info("Logo path: %s", logo_path)
+
+        pdf = HTML(string=rendered_html).write_pdf()
+        logger.info("PDF généré avec succès")
+        return pdf
+    except Exception as e:
+        logger.error("Erreur WeasyPrint: %s", e)
+        # Fallback sans logo si erreur
+        if not logo_path:
+            raise e
+        logger.warning("Tentative de régénération sans logo")
+        rendered_html = render_template('pdf/receipt_template.html',
+                              payment=payment,
+                              property=payment.tenant.unit.property,
+                              tenant=payment.tenant,
+                              owner=owner,
+                              logo_path=None,
+                              brand_color=brand_color)
+        return HTML(string=rendered_html).write_pdf()
+
+
+def render_receipt(payment):
+    """
+    Génère le PDF d'une quittance avec le moteur et la charte du propriétaire.
+
+    Raises:
+        ReceiptUnavailable: Ni le moteur natif ni WeasyPrint ne sont utilisables
+    """
+    owner = db.session.get(User, payment.owner_id) if payment.owner_id else payment.tenant.unit.property.owner
+
+    # Gestion du logo et de la couleur (Premium)
+    logo_path = None
+    brand_color = '#333333' # Couleur par défaut
+
+    if owner.has_feature('custom_branding'):
+        if owner.brand_color:
+            brand_color = owner.brand_color
+
+        if owner.logo_filename:
+            # Chemin absolu pour WeasyPrint
+            logo_path = os.path.join(current_app.root_path, 'static/uploads/logos', owner.logo_filename)
+            # Vérifier si le fichier existe
+            if not os.path.exists(logo_path):
+                logo_path = None
+
+    # Moteur natif (pydyf) si choisi par le propriétaire, WeasyPrint en repli
+    if owner.receipt_engine == ENGINE_NATIVE:
+        try:
+            started_at = time.perf_counter()
+            pdf = render_receipt_pdf(payment, owner, logo_path=logo_path, brand_color=brand_color)
+            metrics.observe_pdf(ENGINE_NATIVE, time.perf_counter() - started_at, len(pdf))
+            return pdf
+        except Exception as e:
+            logger.error("Erreur moteur natif, repli sur WeasyPrint: %s", e)
+
+    # Vérifier que WeasyPrint est disponible (chargé au premier besoin)
+    if lazy.weasyprint_html() is None:
+        raise ReceiptUnavailable("Le module PDF (WeasyPrint) n'est pas installé sur le serveur.")
+    started_at = time.perf_counter()
+    pdf = _render_receipt_weasyprint(payment, owner, logo_path, brand_color)
+    metrics.observe_pdf('weasyprint', time.perf_counter() - started_at, len(pdf))
+    return pdf
+
+
+# ====== ARCHIVE ======
+
+def archive_path(token):
+    """Chemin du PDF compressé d'un token (None si le token n'est pas un UUID)."""
+    if not token or not TOKEN_PATTERN.match(token):
+        return None
+    return os.path.join(current_app.config['RECEIPT_ARCHIVE_DIR'], token[:2], f'{token}.pdf.gz')
+
+
+def store_receipt(token, pdf):
+    """Écrit le PDF compressé de façon atomique (aucun lecteur ne voit un fichier partiel)."""
+    path = archive_path(token)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(gzip.compress(pdf, compresslevel=9, mtime=0))
+    os.replace(tmp_path, path)
+    return path
+
+
+def ensure_archived(payment):
+    """
+    Retourne le chemin de la quittance archivée, en la générant au premier appel.
+
+    Raises:
+        ReceiptUnavailable: Génération impossible
+        Overloaded: Trop de PDF en cours de génération sur le serveur
+    """
+    if not payment.receipt_token:
+        # Paiements anciens sans token : on en attribue un avant d'archiver
+        payment.receipt_token = str(uuid.uuid4())
+        db.session.commit()
+
+    path = archive_path(payment.receipt_token)
+    exists = os.path.exists(path)
+    metrics.observe_cache('receipt_archive', exists)
+    if not exists:
+        # La génération compte parmi les tâches lourdes plafonnées ; servir l'archive, non
+        with job_slot():
+            store_receipt(payment.receipt_token, render_receipt(payment))
+        logger.info("Quittance archivée pour le paiement %s", payment.id)
+    return path
+
+
+def read_archived(path):
+    """Contenu PDF décompressé (clients qui n'acceptent pas gzip)."""
+    with gzip.open(path, 'rb') as f:
+        return f.read()
+
+
+def send_archived_receipt(path, download_name, public=True):
+    """
+    Sert une quittance archivée, sans la régénérer.
+
+    Le fichier gzip est envoyé tel quel (Content-Encoding: gzip) aux clients
+    qui l'acceptent, via send_file : Range, ETag/304 et X-Sendfile si
+    USE_X_SENDFILE est activé. Les autres reçoivent le PDF décompressé.
+
+    Args:
+        path: Chemin retourné par ensure_archived / archive_path
+        download_name: Nom de fichier proposé au navigateur
+        public: Cache partagé d'une heure (lien public) ou privé revalidé (espace propriétaire)
+    """
+    token = os.path.basename(path).split('.', 1)[0]
+    if 'gzip' in request.accept_encodings:
+        response = send_file(path, mimetype='application/pdf', download_name=download_name,
+                             conditional=True, etag=f'{token}-gz')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(io.BytesIO(read_archived(path)), mimetype='application/pdf',
+                             download_name=download_name, conditional=True, etag=f'{token}-pdf')
+
+    response.headers['Cache-Control'] = PUBLIC_CACHE_CONTROL if public else 'private, no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def process_receipt_queue(batch_size=50):
+    """
+    Archive les quittances mises en file (toute saisie de paiement, campagnes,
+    reprise `flask receipts backfill`), par lots, paiements archivés compris.
+
+    Le flag `receipt_queued` est retiré après chaque lot, quelle que soit
+    l'issue : une quittance non générée ici le sera au premier téléchargement
+    par le propriétaire. S'arrête si le plafond de tâches lourdes est atteint
+    (le reste attend le passage suivant).
+
+    Returns:
+        dict: Compteurs {'archived': n, 'failed': n}
+    """
+    counts = {'archived': 0, 'failed': 0}
+    for model in (Payment, ArchivedPayment):
+        if not _process_queued(model, batch_size, counts):
+            break
+
+    logger.info("File de quittances traitée: %s", counts)
+    return counts
+
+
+def _process_queued(model, batch_size, counts):
+    """File d'une table ; False si le plafond de tâches lourdes a interrompu le passage."""
+    while True:
+        payments = (model.query.filter(model.receipt_queued.is_(True))
+                    .order_by(model.id).limit(batch_size).all())
+        if not payments:
+            return True
+
+        done, overloaded = [], False
+        for payment in payments:
+            try:
+                ensure_archived(payment)
+                counts['archived'] += 1
+            except Overloaded:
+                overloaded = True
+                break
+            except Exception as e:
+                logger.error("Archivage impossible pour le paiement %s: %s", payment.id, e)
+                counts['failed'] += 1
+            done.append(payment.id)
+
+        if done:
+            db.session.query(model).filter(model.id.in_(done)) \
+                .update({'receipt_queued': False}, synchronize_session=False)
+            db.session.commit()
+        if overloaded:
+            logger.warning("Plafond de tâches lourdes atteint, archivage reporté")
+            return False
+
+
+def queue_missing_receipts(batch_size=1000):
+    """
+    Met en file les paiements (chauds et archivés) dont la quittance n'est pas
+    encore sur disque : reprise des paiements saisis avant la mise en file systématique.
+
+    Returns:
+        int: Nombre de paiements mis en file
+    """
+    total = 0
+    for table in (Payment.__table__, ArchivedPayment.__table__):
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(table.c.id, table.c.receipt_token)
+                .where(table.c.id > last_id, table.c.receipt_token.is_not(None),
+                       table.c.receipt_queued.is_not(True))
+                .order_by(table.c.id).limit(batch_size)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            missing = [row.id for row in rows if not os.path.exists(archive_path(row.receipt_token) or '')]
+            if missing:
+                db.session.execute(table.update().where(table.c.id.in_(missing)).values(receipt_queued=True))
+                db.session.commit()
+                total += len(missing)
+    return total
+
+
+def delete_archived(tokens):
+    for token in tokens:
+        path = archive_path(token)
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Suppression des fichiers une fois la suppression des paiements validée (cascades comprises)
+@event.listens_for(Session, 'after_flush')
+def _collect_deleted_receipts(session, flush_context):
+    tokens = [obj.receipt_token for obj in session.deleted if isinstance(obj, Payment) and obj.receipt_token]
+    tokens += cascaded_deletes(session)['receipt_tokens']
+    if tokens:
+        session.info.setdefault('deleted_receipt_tokens', []).extend(tokens)
+
+
+@event.listens_for(Session, 'after_commit')
+def _delete_archived_receipts(session):
+    tokens = session.info.pop('deleted_receipt_tokens', None)
+    if tokens and has_app_context():
+        delete_archived(tokens)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_deleted_receipts(session):
+    session.info.pop('deleted_receipt_tokens', None)
@@ -0,0 +1,337 @@
+"""
+Campagnes de relances WhatsApp (Premium : payment_reminders / auto_whatsapp)
+
+Une campagne calcule une seule fois l'ensemble des locataires en retard d'un
+propriétaire pour une période, génère tous les messages et liens en une passe
+et les insère en masse dans la file `reminder_jobs`. Un worker (`flask
+reminders work`) dépile ensuite la file par lots et enregistre les statuts
+d'envoi par des UPDATE ensemblistes.
+
+L'expéditeur est interchangeable (config REMINDER_SENDER) :
+  - 'manual' (défaut) : aucun envoi automatique, le propriétaire clique les liens wa.me
+  - 'stub' : expéditeur local en mémoire (développement et tests)
+  - 'whatsapp_cloud' : API WhatsApp Cloud (WHATSAPP_API_URL / WHATSAPP_API_TOKEN)
+"""
+import json
+import logging
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app, url_for
+from sqlalchemy import bindparam, case
+
+from app.extensions import db
+from app.models import Payment, ReminderCampaign, ReminderJob, Tenant, User
+from app.blueprints.finances.services import (query_late_tenants, receipt_message,
+                                              reminder_message, whatsapp_link)
+
+logger = logging.getLogger(__name__)
+
+# Un job resté 'processing' plus longtemps que ça est considéré abandonné (worker tué)
+STALE_CLAIM_AFTER = timedelta(minutes=15)
+
+
+# ====== EXPÉDITEURS ======
+
+class LocalStubSender:
+    """Expéditeur local : garde les messages en mémoire au lieu de les envoyer."""
+
+    def __init__(self):
+        self.outbox = []
+
+    def send(self, job):
+        self.outbox.append({'phone': job.phone, 'message': job.message, 'kind': job.kind})
+        logger.info("[stub] Message %s pour %s", job.kind, job.phone)
+
+
+class WhatsAppCloudSender:
+    """Expéditeur via l'API WhatsApp Cloud (messages texte)."""
+
+    def __init__(self, api_url, token, timeout=10):
+        self.api_url = api_url
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, job):
+        payload = json.dumps({
+            'messaging_product': 'whatsapp',
+            'to': job.phone,
+            'type': 'text',
+            'text': {'body': job.message},
+        }).encode('utf-8')
+        request = urllib.request.Request(self.api_url, data=payload, method='POST', headers={
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json',
+        })
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"HTTP {response.status}")
+
+
+SENDERS = {
+    'stub': lambda config: LocalStubSender(),
+    'whatsapp_cloud': lambda config: WhatsAppCloudSender(config['WHATSAPP_API_URL'],
+                                                         config['WHATSAPP_API_TOKEN']),
+}
+
+
+def get_sender():
+    """
+    Retourne l'expéditeur configuré (une instance par application), ou None en mode manuel.
+    """
+    name = current_app.config.get('REMINDER_SENDER', 'manual')
+    if name not in SENDERS:
+        return None
+    senders = current_app.extensions.setdefault('reminder_senders', {})
+    if name not in senders:
+        senders[name] = SENDERS[name](current_app.config)
+    return senders[name]
+
+
+# ====== CRÉATION DES CAMPAGNES ======
+
+def _clean_phone(phone):
+    return (phone or '').replace(' ', '').replace('+', '')
+
+
+def create_campaign(owner, period=None):
+    """
+    Crée (ou complète) la campagne du mois pour un propriétaire.
+
+    Les locataires déjà relancés pour la période sont ignorés : relancer une
+    campagne n'ajoute que les nouveaux retards.
+
+    Args:
+        owner: Instance de User
+        period: Période "YYYY-MM" (mois en cours par défaut)
+
+    Returns:
+        tuple: (ReminderCampaign, nombre de jobs ajoutés)
+    """
+    period = period or datetime.now().strftime('%Y-%m')
+
+    campaign = ReminderCampaign.query.filter_by(owner_id=owner.id, period=period).first()
+    if campaign is None:
+        campaign = ReminderCampaign(owner_id=owner.id, period=period, total_jobs=0)
+        db.session.add(campaign)
+        db.session.flush()
+
+    already_queued = {
+        (tenant_id, kind) for tenant_id, kind in db.session.query(ReminderJob.tenant_id, ReminderJob.kind)
+        .filter(ReminderJob.owner_id == owner.id, ReminderJob.period == period)
+    }
+
+    rows = []
+    now = datetime.utcnow()
+
+    # 1. Relances : ensemble des retards calculé en une seule requête
+    if owner.has_feature('payment_reminders'):
+        for tenant, unit, prop in query_late_tenants(owner, period):
+            if (tenant.id, 'reminder') in already_queued:
+                continue
+            message = reminder_message(tenant, unit.rent_amount, period)
+            rows.append({
+                'campaign_id': campaign.id, 'owner_id': owner.id, 'tenant_id': tenant.id,
+                'payment_id': None, 'kind': 'reminder', 'period': period,
+                'phone': _clean_phone(tenant.phone), 'message': message,
+                'whatsapp_url': whatsapp_link(tenant.phone, message),
+                'status': 'pending', 'attempts': 0, 'created_at': now,
+            })
+
+    # 2. Quittances non encore envoyées (envoi automatique WhatsApp)
+    if owner.has_feature('auto_whatsapp'):
+        unsent = (db.session.query(Payment, Tenant)
+                  .join(Tenant, Payment.tenant_id == Tenant.id)
+                  .filter(Payment.owner_id == owner.id,
+                          Payment.in_periods(period, period),
+                          Payment.whatsapp_sent.isnot(True))
+                  .all())
+        for payment, tenant in unsent:
+            if (tenant.id, 'receipt') in already_queued:
+                continue
+            if not payment.receipt_token:
+                # Paiements anciens sans token : pas de lien public sans token (commit plus bas)
+                payment.receipt_token = str(uuid.uuid4())
+            # Le lien public ne sert que le fichier : la quittance doit être générée avant le clic
+            payment.receipt_queued = True
+            pdf_url = url_for('main.public_receipt', token=payment.receipt_token, _external=True)
+            message = receipt_message(payment, tenant, pdf_url)
+            rows.append({
+                'campaign_id': campaign.id, 'owner_id': owner.id, 'tenant_id': tenant.id,
+                'payment_id': payment.id, 'kind': 'receipt', 'period': period,
+                'phone': _clean_phone(tenant.phone), 'message': message,
+                'whatsapp_url': whatsapp_link(tenant.phone, message),
+                'status': 'pending', 'attempts': 0, 'created_at': now,
+            })
+            already_queued.add((tenant.id, 'receipt'))
+
+    # Insertion en masse dans la file
+    if rows:
+        db.session.execute(db.insert(ReminderJob), rows)
+        campaign.total_jobs = (campaign.total_jobs or 0) + len(rows)
+    db.session.commit()
+
+    logger.info("Campagne %s propriétaire %s: %s envois ajoutés", period, owner.id, len(rows))
+    return campaign, len(rows)
+
+
+# ====== TRAITEMENT DE LA FILE ======
+
+def _claim_jobs(batch_size, campaign_id=None):
+    """
+    Réserve un lot de jobs 'pending' pour ce worker.
+
+    La réservation passe par un jeton unique : même sans SELECT ... FOR UPDATE
+    (SQLite), deux workers ne peuvent pas réserver le même job.
+    """
+    token = uuid.uuid4().hex
+    candidates = db.session.query(ReminderJob.id).filter(ReminderJob.status == 'pending')
+    if campaign_id is not None:
+        candidates = candidates.filter(ReminderJob.campaign_id == campaign_id)
+    ids = [row.id for row in candidates.order_by(ReminderJob.id).limit(batch_size)
+           .with_for_update(skip_locked=True)]
+    if not ids:
+        db.session.commit()
+        return []
+
+    db.session.query(ReminderJob).filter(
+        ReminderJob.id.in_(ids), ReminderJob.status == 'pending'
+    ).update({'status': 'processing', 'claim_token': token, 'claimed_at': datetime.utcnow()},
+             synchronize_session=False)
+    db.session.commit()
+
+    return ReminderJob.query.filter_by(claim_token=token, status='processing').all()
+
+
+def release_stale_jobs():
+    """Remet en file les jobs réservés par un worker disparu."""
+    count = db.session.query(ReminderJob).filter(
+        ReminderJob.status == 'processing',
+        ReminderJob.claimed_at < datetime.utcnow() - STALE_CLAIM_AFTER
+    ).update({'status': 'pending', 'claim_token': None}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def process_jobs(sender=None, batch_size=100, max_attempts=3, campaign_id=None):
+    """
+    Dépile la file et envoie les messages par lots.
+
+    Args:
+        sender: Expéditeur (par défaut celui de la configuration)
+        batch_size: Taille des lots réservés
+        max_attempts: Nombre d'essais avant l'état 'failed'
+        campaign_id: Limiter le traitement à une campagne
+
+    Returns:
+        dict: Compteurs {'sent': n, 'failed': n}
+    """
+    sender = sender or get_sender()
+    counts = {'sent': 0, 'failed': 0}
+    if sender is None:
+        return counts
+
+    release_stale_jobs()
+    jobs_table = ReminderJob.__table__
+
+    while True:
+        jobs = _claim_jobs(batch_size, campaign_id)
+        if not jobs:
+            break
+
+        sent_ids, sent_payment_ids, failures = [], [], []
+        for job in jobs:
+            try:
+                sender.send(job)
+                sent_ids.append(job.id)
+                if job.payment_id:
+                    sent_payment_ids.append(job.payment_id)
+            except Exception as e:
+                failures.append({'b_id': job.id, 'b_error': str(e)[:255]})
+
+        # Statuts enregistrés par UPDATE ensemblistes (un par lot, pas un par job)
+        if sent_ids:
+            db.session.execute(jobs_table.update()
+                               .where(jobs_table.c.id.in_(sent_ids))
+                               .values(status='sent', sent_at=datetime.utcnow(), claim_token=None))
+        if sent_payment_ids:
+            db.session.query(Payment).filter(Payment.id.in_(sent_payment_ids)) \
+                .update({'whatsapp_sent': True}, synchronize_session=False)
+        if failures:
+            db.session.execute(
+                jobs_table.update()
+                .where(jobs_table.c.id == bindparam('b_id'))
+                .values(attempts=jobs_table.c.attempts + 1,
+                        last_error=bindparam('b_error'),
+                        claim_token=None,
+                        status=case((jobs_table.c.attempts + 1 >= max_attempts, 'failed'), else_='pending')),
+                failures)
+        db.session.commit()
+        db.session.expire_all()
+
+        counts['sent'] += len(sent_ids)
+        counts['failed'] += len(failures)
+
+    sync_payment_flags()
+    logger.info("File de relances traitée: %s", counts)
+    return counts
+
+
+def sync_payment_flags():
+    """
+    Marque `reminder_sent` sur les paiements dont le locataire a été relancé
+    pour la même période, en un seul UPDATE.
+
+    Returns:
+        int: Nombre de paiements mis à jour
+    """
+    reminded = db.session.query(ReminderJob.id).filter(
+        ReminderJob.kind == 'reminder',
+        ReminderJob.status.in_(('sent', 'manual')),
+        ReminderJob.tenant_id == Payment.tenant_id,
+        ReminderJob.period == Payment.period,
+    ).exists()
+
+    count = db.session.query(Payment).filter(Payment.reminder_sent.isnot(True), reminded) \
+        .update({'reminder_sent': True}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def mark_manual_sent(tenant_id, period):
+    """Enregistre l'envoi manuel (clic wa.me) d'une relance."""
+    db.session.query(ReminderJob).filter(
+        ReminderJob.tenant_id == tenant_id,
+        ReminderJob.period == period,
+        ReminderJob.kind == 'reminder',
+        ReminderJob.status.in_(('pending', 'failed')),
+    ).update({'status': 'manual', 'sent_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+
+# ====== PLANIFICATION ======
+
+def run_scheduled_campaigns(today=None):
+    """
+    Lance la campagne du mois pour chaque propriétaire Premium, à partir du
+    jour configuré (REMINDER_CAMPAIGN_DAY). Idempotent : peut tourner chaque jour.
+
+    Returns:
+        list: Tuples (propriétaire, nombre de jobs ajoutés)
+    """
+    today = today or datetime.now()
+    if today.day < current_app.config.get('REMINDER_CAMPAIGN_DAY', 5):
+        return []
+
+    period = today.strftime('%Y-%m')
+    already_done = db.session.query(ReminderCampaign.owner_id).filter(ReminderCampaign.period == period)
+
+    results = []
+    owners = User.query.filter(User.effective_plan == 'premium', ~User.id.in_(already_done)).all()
+    for owner in owners:
+        if not (owner.has_feature('payment_reminders') or owner.has_feature('auto_whatsapp')):
+            continue
+        campaign, added = create_campaign(owner, period)
+        results.append((owner, added))
+    return results
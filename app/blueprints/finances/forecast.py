@@ -0,0 +1,165 @@
+"""
+Prévision des encaissements (Premium, dashboard analytique).
+
+Pour chaque locataire actif on estime, à partir de ses paiements des 12
+derniers mois (toujours dans les tables chaudes, voir app/archival.py) :
+  - la probabilité de payer un mois dû (mois payés / mois dus depuis l'entrée) ;
+  - la répartition du retard en mois entre la période et la date de paiement
+    (même mois, +1, +2, +3 ou plus).
+Les deux estimations sont rapprochées de la moyenne du portefeuille tant que
+l'historique du locataire est court.
+
+Un loyer dû au mois t est encaissé au mois t + k avec la probabilité
+p * w[k] : l'espérance par mois est un produit matriciel (locataires x mois),
+et la bande de confiance suppose les paiements indépendants (somme des
+variances de Bernoulli). Le loyer du mois courant non encore payé est compté
+dans les mois suivants selon le même retard.
+
+Les calculs se font sur des tableaux NumPy (numpy est optionnel : absent, la
+prévision n'est pas proposée). Le résultat est mis en cache par propriétaire,
+`data_version` et mois courant.
+"""
+import json
+
+from app import lazy, periods
+from app.extensions import db
+from app.fragment_cache import get_cache
+from app.models import Payment, Tenant, Unit
+
+HISTORY_MONTHS = 12
+# Retards distingués : même mois, +1, +2, +3 mois ou plus
+LAG_MONTHS = 4
+# Poids (en mois d'historique) de la moyenne du portefeuille dans l'estimation d'un locataire
+PRIOR_MONTHS = 3
+# Bande de confiance à 90 %
+Z_SCORE = 1.645
+MIN_MONTHS, MAX_MONTHS = 3, 12
+EPOCH_INDEX = periods.to_index('1970-01')
+
+
+def available():
+    return lazy.load('numpy') is not None
+
+
+def _load_arrays(np, user, current):
+    """Locataires actifs et paiements récents du propriétaire, en tableaux NumPy."""
+    tenant_rows = db.session.execute(
+        db.select(Tenant.id, Tenant.entry_date, Unit.rent_amount)
+        .join(Unit, Tenant.unit_id == Unit.id)
+        .where(Tenant.owner_id == user.id, Tenant.is_active.is_(True))
+        .order_by(Tenant.id)).all()
+    tenants = {
+        'id': np.fromiter((row.id for row in tenant_rows), dtype=np.int64, count=len(tenant_rows)),
+        'entry': np.fromiter((periods.index_of(row.entry_date) if row.entry_date else 0 for row in tenant_rows),
+                             dtype=np.int64, count=len(tenant_rows)),
+        'rent': np.fromiter((row.rent_amount or 0.0 for row in tenant_rows),
+                            dtype=np.float64, count=len(tenant_rows)),
+    }
+
+    payment_rows = db.session.execute(
+        db.select(Payment.tenant_id, Payment.period_index, Payment.date_paid)
+        .join(Tenant, Payment.tenant_id == Tenant.id)
+        .where(Payment.owner_id == user.id, Tenant.is_active.is_(True),
+               Payment.in_periods(current - HISTORY_MONTHS, current))).all()
+    period = np.fromiter((row.period_index for row in payment_rows), dtype=np.int64, count=len(payment_rows))
+    date_paid = np.array([row.date_paid for row in payment_rows], dtype='datetime64[D]')
+    # Index de mois -> premier jour du mois, en datetime64 (index 1970-01 = EPOCH_INDEX)
+    period_start = (period - EPOCH_INDEX).astype('timedelta64[M]') + np.datetime64('1970-01', 'M')
+    payments = {
+        'tenant': np.fromiter((row.tenant_id for row in payment_rows), dtype=np.int64, count=len(payment_rows)),
+        'period': period,
+        'paid': date_paid.astype('datetime64[M]').astype(np.int64) + EPOCH_INDEX,
+        'delay_days': (date_paid - period_start.astype('datetime64[D]')).astype(np.float64),
+    }
+    return tenants, payments
+
+
+def compute_forecast(np, tenants, payments, current, months):
+    """
+    Prévision vectorisée sur `months` mois à partir du mois suivant `current`.
+
+    Returns:
+        dict: months, expected, low, high (listes), tenants, collection_probability, avg_delay_days
+    """
+    count = len(tenants['id'])
+    window_start = current - HISTORY_MONTHS
+    positions = np.searchsorted(tenants['id'], payments['tenant'])
+
+    # Mois dus observés par locataire : de max(entrée, début de fenêtre) au mois précédent
+    first_due = np.maximum(tenants['entry'], window_start)
+    observed = np.clip(current - first_due, 0, HISTORY_MONTHS)
+
+    in_window = (payments['period'] >= first_due[positions]) & (payments['period'] < current)
+    paid_keys = np.unique(positions[in_window] * (HISTORY_MONTHS + 1)
+                          + (payments['period'][in_window] - window_start))
+    paid = np.bincount(paid_keys // (HISTORY_MONTHS + 1), minlength=count).astype(np.float64)
+
+    lags = np.clip(payments['paid'] - payments['period'], 0, LAG_MONTHS - 1)
+    lag_counts = np.bincount(positions[in_window] * LAG_MONTHS + lags[in_window],
+                             minlength=count * LAG_MONTHS).reshape(count, LAG_MONTHS).astype(np.float64)
+
+    # Moyennes du portefeuille (loyer dû payé intégralement le mois même sans historique)
+    portfolio_p = paid.sum() / observed.sum() if observed.sum() else 1.0
+    portfolio_lags = lag_counts.sum(axis=0)
+    portfolio_w = portfolio_lags / portfolio_lags.sum() if portfolio_lags.sum() else np.eye(LAG_MONTHS)[0]
+
+    probability = np.clip((paid + PRIOR_MONTHS * portfolio_p) / (observed + PRIOR_MONTHS), 0.0, 1.0)
+    weights = (lag_counts + PRIOR_MONTHS * portfolio_w) / (lag_counts.sum(axis=1, keepdims=True) + PRIOR_MONTHS)
+
+    # Loyers dus : colonne 0 = mois courant (si pas encore payé), puis les `months` mois suivants
+    due = tenants['entry'][:, None] <= current + np.arange(months + 1)[None, :]
+    paid_current = np.zeros(count, dtype=bool)
+    paid_current[positions[payments['period'] == current]] = True
+    due[:, 0] &= ~paid_current
+    due = due.astype(np.float64)
+
+    expected = np.zeros(months)
+    variance = np.zeros(months)
+    for lag in range(LAG_MONTHS):
+        # Encaissé au mois j (1..months) : loyer dû au mois j - lag
+        start = max(1, lag)
+        if start > months:
+            break
+        q = probability * weights[:, lag]
+        window = due[:, start - lag:months + 1 - lag]
+        expected[start - 1:] += (tenants['rent'] * q) @ window
+        variance[start - 1:] += (tenants['rent'] ** 2 * q * (1 - q)) @ window
+
+    band = Z_SCORE * np.sqrt(variance)
+    return {
+        'months': [periods.from_index(current + offset) for offset in range(1, months + 1)],
+        'expected': np.round(expected).tolist(),
+        'low': np.round(np.maximum(expected - band, 0)).tolist(),
+        'high': np.round(expected + band).tolist(),
+        'tenants': count,
+        'collection_probability': round(float(portfolio_p), 3),
+        'avg_delay_days': round(float(payments['delay_days'][in_window].mean()), 1) if in_window.any() else None,
+    }
+
+
+def get_cash_forecast(user, months=6, today=None):
+    """
+    Prévision des encaissements des `months` prochains mois (3 à 12), mise en cache
+    par propriétaire et `data_version`.
+
+    Raises:
+        ValueError: Horizon hors de 3 à 12 mois
+        ImportError: numpy n'est pas installé
+
+    Returns:
+        dict: Voir compute_forecast
+    """
+    if not MIN_MONTHS <= months <= MAX_MONTHS:
+        raise ValueError(f"L'horizon de prévision doit être compris entre {MIN_MONTHS} et {MAX_MONTHS} mois.")
+    np = lazy.load('numpy')
+    if np is None:
+        raise ImportError("numpy n'est pas installé. Installez-le avec: pip install numpy")
+
+    current = periods.current_index(today)
+
+    def compute():
+        tenants, payments = _load_arrays(np, user, current)
+        return json.dumps(compute_forecast(np, tenants, payments, current, months))
+
+    key = f"forecast|{user.id}|{user.data_version or 0}|{current}|{months}"
+    return json.loads(get_cache().get_or_render(key, compute))
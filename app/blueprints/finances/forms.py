@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import FloatField, SelectField, SubmitField
 from wtforms.validators import DataRequired
-from datetime import datetime
+from app import periods
 
 class PaymentForm(FlaskForm):
     amount = FloatField('Montant Reçu (CFA)', validators=[DataRequired()])
@@ -13,17 +13,27 @@ class PaymentForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(PaymentForm, self).__init__(*args, **kwargs)
-        # On génère une liste dynamique : "2023-11 (Novembre)"
-        today = datetime.today()
+        # Liste dynamique du mois actuel et des 5 précédents, du plus récent au plus ancien
+        # (on pourrait mettre les noms des mois en français dans le libellé)
         months = []
-        for i in range(0, 6): # Propose les 6 derniers mois et le mois actuel
-             # Logique simplifiée pour l'exemple, à adapter selon besoins
-             year = today.year
-             month = today.month - i
-             if month <= 0:
-                 month += 12
-                 year -= 1
-             key = f"{year}-{month:02d}"
-             label = f"{key}" # On pourrait mettre les noms des mois en français ici
-             months.append((key, label))
+        for index in reversed(periods.last_months(6)):
+            key = periods.from_index(index)
+            months.append((key, key))
         self.period.choices = months
+
+
+class BulkPaymentForm(FlaskForm):
+    """Saisie groupée d'un immeuble : la période ; les montants cochés sont lus ligne par ligne."""
+    period = SelectField('Période concernée', validators=[DataRequired()], choices=[])
+
+    submit = SubmitField('Enregistrer les paiements cochés')
+
+    def __init__(self, *args, **kwargs):
+        super(BulkPaymentForm, self).__init__(*args, **kwargs)
+        self.period.choices = [(periods.from_index(index), periods.from_index(index))
+                               for index in reversed(periods.last_months(6))]
+
+
+class CampaignForm(FlaskForm):
+    """Lancement de la campagne de relances : rien à saisir, seulement le jeton CSRF."""
+    submit = SubmitField('Relancer tout le monde')
@@ -0,0 +1,369 @@
+"""
+Moteur natif de quittances PDF (pydyf)
+
+La quittance standard est une mise en page fixe d'une seule page : plutôt que
+de passer par toute la chaîne HTML/CSS de WeasyPrint, on dessine directement
+les opérateurs PDF avec pydyf (déjà installé comme dépendance de WeasyPrint).
+Les polices sont les polices standard PDF (Helvetica), jamais embarquées, et
+les logos sont décodés une seule fois puis gardés en cache.
+
+Le texte affiché est le même que celui du template `pdf/receipt_template.html`,
+WeasyPrint restant le moteur de repli.
+"""
+import io
+import os
+import unicodedata
+import zlib
+from functools import lru_cache
+
+import pydyf
+
+
+# Moteurs disponibles (valeur stockée dans User.receipt_engine)
+ENGINE_WEASYPRINT = 'weasyprint'
+ENGINE_NATIVE = 'native'
+RECEIPT_ENGINES = {
+    ENGINE_WEASYPRINT: 'Standard (WeasyPrint)',
+    ENGINE_NATIVE: 'Rapide (moteur natif)',
+}
+
+# Format A4 en points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+
+# Chasses Helvetica (unités de 1/1000 em) pour les caractères ASCII 32 à 126
+_HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+
+# Polices standard PDF : noms de ressource -> (police de base, table de chasses)
+_FONTS = {
+    'F1': ('Helvetica', _HELVETICA_WIDTHS),
+    'F2': ('Helvetica-Bold', _HELVETICA_BOLD_WIDTHS),
+    'F3': ('Helvetica-Oblique', _HELVETICA_WIDTHS),
+}
+
+PARAGRAPH_TEXT = (
+    "Je soussigné(e), déclare avoir reçu de la part du locataire la somme mentionnée "
+    "ci-dessus au titre du loyer pour la période indiquée. Cette quittance est délivrée "
+    "sous réserve de tous droits et actions."
+)
+
+
+@lru_cache(maxsize=None)
+def _char_width(font, char):
+    """Chasse d'un caractère, les lettres accentuées reprenant celle de leur lettre de base."""
+    widths = _FONTS[font][1]
+    code = ord(char)
+    if 32 <= code <= 126:
+        return widths[code - 32]
+    base = unicodedata.normalize('NFD', char)[0]
+    if base != char and 32 <= ord(base) <= 126:
+        return widths[ord(base) - 32]
+    return 556
+
+
+def text_width(text, font, size):
+    """Largeur en points d'un texte dans une police standard."""
+    return sum(_char_width(font, char) for char in text) * size / 1000
+
+
+def _encode(text):
+    """Encode un texte en WinAnsi (cp1252) sous forme de chaîne littérale PDF."""
+    raw = str(text).encode('cp1252', errors='replace')
+    escaped = raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    return b'(' + escaped + b')'
+
+
+def _wrap(text, font, size, max_width):
+    """Découpe un paragraphe en lignes tenant dans la largeur donnée."""
+    lines, current = [], ''
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if current and text_width(candidate, font, size) > max_width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _hex_to_rgb(color, default=(0.2, 0.2, 0.2)):
+    """Convertit '#RRGGBB' en triplet RGB (0-1) pour pydyf."""
+    try:
+        color = color.lstrip('#')
+        return tuple(int(color[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    except (AttributeError, ValueError, IndexError):
+        return default
+
+
+def format_amount(amount):
+    """Montant au format des quittances : '150 000'."""
+    return "{:,.0f}".format(amount).replace(',', ' ')
+
+
+@lru_cache(maxsize=32)
+def _load_logo(path, mtime):
+    """
+    Décode un logo une seule fois (clé : chemin + date de modification).
+
+    Returns:
+        tuple: (largeur, hauteur, filtre, données, espace couleur) ou None
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    with Image.open(path) as image:
+        width, height = image.size
+        if image.format == 'JPEG' and image.mode in ('RGB', 'L'):
+            # Le JPEG est embarqué tel quel (DCTDecode), sans ré-encodage
+            with open(path, 'rb') as f:
+                data = f.read()
+            color_space = '/DeviceRGB' if image.mode == 'RGB' else '/DeviceGray'
+            return width, height, '/DCTDecode', data, color_space
+
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Aplatir la transparence sur fond blanc
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            image = background
+        else:
+            image = image.convert('RGB')
+
+        data = zlib.compress(image.tobytes(), 6)
+        return width, height, '/FlateDecode', data, '/DeviceRGB'
+
+
+def _logo_xobject(logo_path):
+    """Construit l'objet image PDF du logo à partir du cache."""
+    if not logo_path:
+        return None
+    try:
+        logo = _load_logo(logo_path, os.path.getmtime(logo_path))
+    except OSError:
+        return None
+    if logo is None:
+        return None
+
+    width, height, filter_, data, color_space = logo
+    return width, height, pydyf.Stream([data], extra={
+        'Type': '/XObject',
+        'Subtype': '/Image',
+        'Width': width,
+        'Height': height,
+        'ColorSpace': color_space,
+        'BitsPerComponent': 8,
+        'Filter': filter_,
+    })
+
+
+class _Canvas:
+    """Petit utilitaire de dessin au-dessus d'un flux pydyf."""
+
+    def __init__(self):
+        self.stream = pydyf.Stream(compress=True)
+
+    def text(self, x, y, text, font='F1', size=11, color=(0.2, 0.2, 0.2), align='left'):
+        if align == 'right':
+            x -= text_width(text, font, size)
+        elif align == 'center':
+            x -= text_width(text, font, size) / 2
+        self.stream.set_color_rgb(*color)
+        self.stream.begin_text()
+        self.stream.set_font_size(font, size)
+        self.stream.set_text_matrix(1, 0, 0, 1, x, y)
+        self.stream.stream.append(_encode(text) + b' Tj')
+        self.stream.end_text()
+
+    def rect(self, x, y, width, height, stroke=None, fill=None, line_width=1):
+        self.stream.push_state()
+        self.stream.set_line_width(line_width)
+        self.stream.rectangle(x, y, width, height)
+        if fill:
+            self.stream.set_color_rgb(*fill)
+        if stroke:
+            self.stream.set_color_rgb(*stroke, stroke=True)
+        if fill and stroke:
+            self.stream.fill_and_stroke()
+        elif fill:
+            self.stream.fill()
+        else:
+            self.stream.stroke()
+        self.stream.pop_state()
+
+    def line(self, x1, y1, x2, y2, color, line_width=1):
+        self.stream.push_state()
+        self.stream.set_line_width(line_width)
+        self.stream.set_color_rgb(*color, stroke=True)
+        self.stream.move_to(x1, y1)
+        self.stream.line_to(x2, y2)
+        self.stream.stroke()
+        self.stream.pop_state()
+
+    def image(self, name, x, y, width, height):
+        self.stream.push_state()
+        self.stream.set_matrix(width, 0, 0, height, x, y)
+        self.stream.draw_x_object(name)
+        self.stream.pop_state()
+
+
+def render_receipt_pdf(payment, owner, logo_path=None, brand_color='#333333'):
+    """
+    Dessine la quittance standard directement en PDF.
+
+    Args:
+        payment: Instance de Payment
+        owner: Instance de User (propriétaire)
+        logo_path: Chemin absolu du logo (Premium) ou None
+        brand_color: Couleur principale au format '#RRGGBB'
+
+    Returns:
+        bytes: Document PDF
+    """
+    tenant = payment.tenant
+    prop = tenant.unit.property
+    brand = _hex_to_rgb(brand_color)
+    grey, light, muted = (0.2, 0.2, 0.2), (0.6, 0.6, 0.6), (0.47, 0.47, 0.47)
+
+    canvas = _Canvas()
+    left, right = MARGIN, PAGE_WIDTH - MARGIN
+    center = PAGE_WIDTH / 2
+    y = PAGE_HEIGHT - MARGIN - 25
+
+    # Cadre de la page
+    canvas.rect(left - 20, MARGIN - 10, right - left + 40, PAGE_HEIGHT - 2 * MARGIN + 20,
+                stroke=(0.87, 0.87, 0.87), line_width=2)
+
+    # En-tête : logo, titre, période, référence
+    resources_x_objects = {}
+    logo = _logo_xobject(logo_path)
+    if logo:
+        width, height, xobject = logo
+        scale = min(200 / width, 80 / height, 1)
+        draw_width, draw_height = width * scale, height * scale
+        y -= draw_height - 10
+        canvas.image('Im1', center - draw_width / 2, y, draw_width, draw_height)
+        resources_x_objects['Im1'] = xobject
+        y -= 30
+
+    canvas.text(center, y, "QUITTANCE DE LOYER", font='F2', size=24, color=brand, align='center')
+    y -= 24
+    label = "Période : "
+    value_width = text_width(payment.period, 'F2', 14)
+    start = center - (text_width(label, 'F1', 14) + value_width) / 2
+    canvas.text(start, y, label, size=14, color=grey)
+    canvas.text(start + text_width(label, 'F1', 14), y, payment.period, font='F2', size=14, color=grey)
+    y -= 20
+    reference = f"Réf Transaction : #{payment.receipt_token[:8]}"
+    if payment.receipt_label:
+        reference = f"Quittance N° {payment.receipt_label} · {reference}"
+    canvas.text(center, y, reference, size=14, color=grey, align='center')
+    y -= 14
+    canvas.line(left, y, right, y, brand, line_width=2)
+    y -= 36
+
+    # Bailleur / Locataire
+    canvas.text(left, y, "BAILLEUR (Propriétaire)", font='F2', size=12, color=grey)
+    canvas.text(right, y, "LOCATAIRE", font='F2', size=12, color=grey, align='right')
+    owner_lines = [line for line in (owner.email, owner.phone) if line]
+    tenant_lines = [line for line in (tenant.full_name, tenant.phone) if line]
+    for i in range(max(len(owner_lines), len(tenant_lines))):
+        y -= 17
+        if i < len(owner_lines):
+            canvas.text(left, y, owner_lines[i], size=12, color=grey)
+        if i < len(tenant_lines):
+            canvas.text(right, y, tenant_lines[i], size=12, color=grey, align='right')
+    y -= 36
+
+    # Désignation du bien
+    box_lines = [line for line in (prop.name, prop.address) if line]
+    box_lines.append(f"Appartement / Porte : {tenant.unit.door_number}")
+    box_height = 30 + 17 * (len(box_lines) + 1)
+    canvas.rect(left, y - box_height + 20, right - left, box_height,
+                stroke=(0.93, 0.93, 0.93), fill=(0.976, 0.976, 0.976))
+    canvas.text(left + 15, y, "Désignation du bien :", font='F2', size=12, color=grey)
+    for line in box_lines:
+        y -= 17
+        canvas.text(left + 15, y, line, size=12, color=grey)
+    y -= 55
+
+    # Montant
+    canvas.text(right, y, "Montant payé :", size=12, color=grey, align='right')
+    y -= 32
+    canvas.text(right, y, f"{format_amount(payment.amount)} FCFA", font='F2', size=28,
+                color=brand, align='right')
+    y -= 40
+
+    # Paragraphe de déclaration
+    for line in _wrap(PARAGRAPH_TEXT, 'F1', 12, right - left):
+        canvas.text(left, y, line, size=12, color=grey)
+        y -= 17
+    y -= 14
+    canvas.text(left, y, f"Fait le {payment.date_paid.strftime('%d/%m/%Y')}", size=12, color=grey)
+    y -= 45
+
+    # Cachet et pied de page
+    canvas.text(right, y, "Document généré électroniquement via ImmoGest SaaS.", font='F3',
+                size=12, color=light, align='right')
+    y -= 45
+    canvas.line(left, y, right, y, (0.93, 0.93, 0.93))
+    y -= 16
+    canvas.text(center, y, "ImmoGest SaaS - Gestion Immobilière Simplifiée", size=9,
+                color=muted, align='center')
+
+    # Assemblage du document
+    document = pydyf.PDF()
+    document.info['Title'] = pydyf.String("Quittance de Loyer")
+    document.info['Producer'] = pydyf.String("ImmoGest SaaS")
+
+    fonts = {}
+    for name, (base_font, _) in _FONTS.items():
+        font = pydyf.Dictionary({
+            'Type': '/Font',
+            'Subtype': '/Type1',
+            'BaseFont': f'/{base_font}',
+            'Encoding': '/WinAnsiEncoding',
+        })
+        document.add_object(font)
+        fonts[name] = font.reference
+
+    x_objects = {}
+    for name, xobject in resources_x_objects.items():
+        document.add_object(xobject)
+        x_objects[name] = xobject.reference
+
+    resources = {'Font': pydyf.Dictionary(fonts)}
+    if x_objects:
+        resources['XObject'] = pydyf.Dictionary(x_objects)
+
+    document.add_object(canvas.stream)
+    document.add_page(pydyf.Dictionary({
+        'Type': '/Page',
+        'Parent': document.pages.reference,
+        'MediaBox': pydyf.Array([0, 0, PAGE_WIDTH, PAGE_HEIGHT]),
+        'Contents': canvas.stream.reference,
+        'Resources': pydyf.Dictionary(resources),
+    }))
+
+    output = io.BytesIO()
+    document.write(output, compress=True)
+    return output.getvalue()
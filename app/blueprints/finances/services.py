@@ -3,28 +3,38 @@ Services Premium pour les fonctionnalités avancées
 """
 from datetime import datetime
 from flask import url_for
-from app.models import Payment, Tenant
+from app.extensions import db
+from app.models import ArchivedPayment, ArchivedTenant, Payment, Tenant, TenantScore, Unit, Property
+from app import lazy, metrics, periods
 import io
+import time
 
 
-def export_payments_to_excel(user):
+# Taille d'une page de l'historique des paiements d'un locataire
+PAYMENTS_PER_PAGE = 20
+
+
+def export_payments_to_excel(user, start=None, end=None):
     """
-    Exporte tous les paiements de l'utilisateur vers un fichier Excel.
+    Exporte les paiements de l'utilisateur vers un fichier Excel.
     Fonctionnalité réservée au plan Premium.
     
     Args:
         user: Instance de User
+        start: Première période incluse "YYYY-MM" (None = depuis le début)
+        end: Dernière période incluse "YYYY-MM" (None = jusqu'à aujourd'hui)
         
     Returns:
         BytesIO: Fichier Excel en mémoire
     """
-    try:
-        # Import conditionnel de openpyxl
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
-        from openpyxl.utils import get_column_letter
-    except ImportError:
+    started_at = time.perf_counter()
+
+    # Import paresseux de openpyxl (chargé au premier export seulement)
+    if lazy.load('openpyxl') is None:
         raise ImportError("openpyxl n'est pas installé. Installez-le avec: pip install openpyxl")
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
     
     # Créer un classeur Excel
     wb = Workbook()
@@ -46,21 +56,38 @@ def export_payments_to_excel(user):
         cell.font = header_font
         cell.alignment = Alignment(horizontal="center", vertical="center")
     
-    # Récupérer tous les paiements de l'utilisateur
-    all_payments = []
-    for property in user.properties:
-        for unit in property.units:
-            for tenant in unit.tenants:
-                for payment in tenant.payments:
-                    all_payments.append({
-                        'payment': payment,
-                        'tenant': tenant,
-                        'unit': unit,
-                        'property': property
-                    })
-    
-    # Trier par date décroissante
-    all_payments.sort(key=lambda x: x['payment'].date_paid, reverse=True)
+    # Récupérer tous les paiements chauds de l'utilisateur (une requête, triée par date décroissante)
+    rows = (db.session.query(Payment, Tenant, Unit, Property)
+            .join(Tenant, Payment.tenant_id == Tenant.id)
+            .join(Unit, Tenant.unit_id == Unit.id)
+            .join(Property, Unit.property_id == Property.id)
+            .filter(Payment.owner_id == user.id, Payment.in_periods(start, end))
+            .order_by(Payment.date_paid.desc())
+            .all())
+    all_payments = [{
+        'payment': payment,
+        'tenant': tenant,
+        'unit': unit,
+        'property': property
+    } for payment, tenant, unit, property in rows]
+
+    # Paiements archivés (app/archival.py) : locataire encore actif ou lui aussi archivé
+    unit_id = db.func.coalesce(Tenant.unit_id, ArchivedTenant.unit_id)
+    archived_rows = (db.session.query(ArchivedPayment, Tenant, ArchivedTenant, Unit, Property)
+                     .outerjoin(Tenant, ArchivedPayment.tenant_id == Tenant.id)
+                     .outerjoin(ArchivedTenant, ArchivedPayment.tenant_id == ArchivedTenant.id)
+                     .outerjoin(Unit, Unit.id == unit_id)
+                     .outerjoin(Property, Unit.property_id == Property.id)
+                     .filter(ArchivedPayment.owner_id == user.id, ArchivedPayment.in_periods(start, end))
+                     .order_by(ArchivedPayment.date_paid.desc())
+                     .all())
+    all_payments.extend({
+        'payment': payment,
+        'tenant': tenant or archived_tenant,
+        'unit': unit,
+        'property': property
+    } for payment, tenant, archived_tenant, unit, property in archived_rows)
+    all_payments.sort(key=lambda item: item['payment'].date_paid, reverse=True)
     
     # Remplir les données
     for row_num, item in enumerate(all_payments, 2):
@@ -71,10 +98,10 @@ def export_payments_to_excel(user):
         
         ws.cell(row=row_num, column=1).value = payment.date_paid.strftime('%d/%m/%Y')
         ws.cell(row=row_num, column=2).value = payment.period
-        ws.cell(row=row_num, column=3).value = tenant.full_name
-        ws.cell(row=row_num, column=4).value = tenant.phone
-        ws.cell(row=row_num, column=5).value = property.name
-        ws.cell(row=row_num, column=6).value = unit.door_number
+        ws.cell(row=row_num, column=3).value = tenant.full_name if tenant else ''
+        ws.cell(row=row_num, column=4).value = tenant.phone if tenant else ''
+        ws.cell(row=row_num, column=5).value = property.name if property else ''
+        ws.cell(row=row_num, column=6).value = unit.door_number if unit else ''
         ws.cell(row=row_num, column=7).value = payment.amount
         ws.cell(row=row_num, column=7).number_format = '#,##0'
         ws.cell(row=row_num, column=8).value = 'Oui' if payment.whatsapp_sent else 'Non'
@@ -105,10 +132,51 @@ def export_payments_to_excel(user):
     excel_file = io.BytesIO()
     wb.save(excel_file)
     excel_file.seek(0)
+    metrics.observe_export(time.perf_counter() - started_at, len(all_payments))
     
     return excel_file
 
 
+def whatsapp_link(phone, msg_text):
+    """
+    Construit un lien wa.me pré-rempli.
+
+    Args:
+        phone: Numéro du destinataire (peut être vide)
+        msg_text: Message à pré-remplir
+
+    Returns:
+        str: URL WhatsApp
+    """
+    from urllib.parse import quote
+
+    # Nettoyer le numéro de téléphone
+    phone = (phone or '').replace(' ', '').replace('+', '')
+    return f"https://wa.me/{phone}?text={quote(msg_text)}"
+
+
+def receipt_message(payment, tenant, pdf_url):
+    """Message WhatsApp d'envoi de quittance."""
+    # Formater le montant
+    amount_fmt = "{:,.0f}".format(payment.amount).replace(',', ' ')
+
+    return (f"Bonjour {tenant.full_name}, "
+            f"votre paiement de {amount_fmt} FCFA pour la période {payment.period} "
+            f"a bien été reçu. Merci ! 🏠\n\n"
+            f"Téléchargez votre quittance ici : {pdf_url}")
+
+
+def reminder_message(tenant, amount, period):
+    """Message WhatsApp de rappel de paiement, courtois mais ferme."""
+    # Formater le montant
+    amount_fmt = "{:,.0f}".format(amount).replace(',', ' ')
+
+    return (f"Bonjour {tenant.full_name}, "
+            f"sauf erreur de notre part, nous n'avons pas encore reçu votre loyer de {amount_fmt} FCFA "
+            f"pour la période {period}. "
+            f"Merci de régulariser votre situation dès que possible. 🏠")
+
+
 def send_whatsapp_receipt(payment, tenant):
     """
     Génère un lien WhatsApp pour envoyer la quittance au locataire.
@@ -121,27 +189,10 @@ def send_whatsapp_receipt(payment, tenant):
     Returns:
         str: URL WhatsApp pré-remplie
     """
-    from urllib.parse import quote
-    
     # Générer le lien vers le PDF
-    pdf_url = url_for('finances.download_receipt', payment_id=payment.id, _external=True)
-    
-    # Formater le montant
-    amount_fmt = "{:,.0f}".format(payment.amount).replace(',', ' ')
-    
-    # Message personnalisé
-    msg_text = (f"Bonjour {tenant.full_name}, "
-                f"votre paiement de {amount_fmt} FCFA pour la période {payment.period} "
-                f"a bien été reçu. Merci ! 🏠\n\n"
-                f"Téléchargez votre quittance ici : {pdf_url}")
-    
-    # Nettoyer le numéro de téléphone
-    phone = tenant.phone.replace(' ', '').replace('+', '')
-    
-    # Générer le lien WhatsApp
-    whatsapp_url = f"https://wa.me/{phone}?text={quote(msg_text)}"
-    
-    return whatsapp_url
+    pdf_url = url_for('main.public_receipt', token=payment.receipt_token, _external=True)
+
+    return whatsapp_link(tenant.phone, receipt_message(payment, tenant, pdf_url))
 
 
 def send_whatsapp_reminder(tenant, amount, period):
@@ -157,24 +208,31 @@ def send_whatsapp_reminder(tenant, amount, period):
     Returns:
         str: URL WhatsApp pré-remplie
     """
-    from urllib.parse import quote
-    
-    # Formater le montant
-    amount_fmt = "{:,.0f}".format(amount).replace(',', ' ')
-    
-    # Message de rappel courtois mais ferme
-    msg_text = (f"Bonjour {tenant.full_name}, "
-                f"sauf erreur de notre part, nous n'avons pas encore reçu votre loyer de {amount_fmt} FCFA "
-                f"pour la période {period}. "
-                f"Merci de régulariser votre situation dès que possible. 🏠")
-    
-    # Nettoyer le numéro de téléphone
-    phone = tenant.phone.replace(' ', '').replace('+', '')
-    
-    # Générer le lien WhatsApp
-    whatsapp_url = f"https://wa.me/{phone}?text={quote(msg_text)}"
-    
-    return whatsapp_url
+    return whatsapp_link(tenant.phone, reminder_message(tenant, amount, period))
+
+
+def query_late_tenants(user, period):
+    """
+    Locataires actifs de l'utilisateur sans paiement pour la période,
+    calculés en une seule requête.
+
+    Args:
+        user: Instance de User
+        period: Période "YYYY-MM"
+
+    Returns:
+        list: Tuples (Tenant, Unit, Property)
+    """
+    paid_tenants = db.session.query(Payment.tenant_id).filter(Payment.in_periods(period, period))
+
+    return (db.session.query(Tenant, Unit, Property)
+            .join(Unit, Tenant.unit_id == Unit.id)
+            .join(Property, Unit.property_id == Property.id)
+            .filter(Tenant.owner_id == user.id,
+                    Tenant.is_active.is_(True),
+                    ~Tenant.id.in_(paid_tenants))
+            .order_by(Property.name, Unit.door_number)
+            .all())
 
 
 def get_late_tenants(user):
@@ -186,37 +244,28 @@ def get_late_tenants(user):
         user: Instance de User
         
     Returns:
-        list: Liste de dictionnaires avec tenant, unit, property, amount_due
+        list: Liste de dictionnaires avec tenant, unit, property, amount_due, score,
+        du plus risqué au plus fiable (locataires sans score en dernier)
     """
-    late_tenants = []
     # Période actuelle (Mois en cours)
     current_period = datetime.now().strftime('%Y-%m')
     
     # Si on est avant le 5 du mois, on vérifie peut-être le mois précédent ?
     # Pour simplifier : on vérifie toujours le mois en cours par défaut
-    
-    for prop in user.properties:
-        for unit in prop.units:
-            # On ne vérifie que les appartements occupés
-            tenant = unit.current_tenant
-            if tenant:
-                # Vérifier s'il existe un paiement pour ce mois
-                # Note: On utilise une requête directe pour être plus efficace
-                has_paid = False
-                for payment in tenant.payments:
-                    if payment.period == current_period:
-                        has_paid = True
-                        break
-                
-                if not has_paid:
-                    late_tenants.append({
-                        'tenant': tenant,
-                        'unit': unit,
-                        'property': prop,
-                        'amount_due': unit.rent_amount,
-                        'period': current_period
-                    })
-    
+    rows = query_late_tenants(user, current_period)
+
+    # Scores calculés la nuit (flask data score-tenants) : une lecture par clé primaire
+    scores = TenantScore.for_tenants([tenant.id for tenant, _, _ in rows])
+    late_tenants = [{
+        'tenant': tenant,
+        'unit': unit,
+        'property': prop,
+        'amount_due': unit.rent_amount,
+        'period': current_period,
+        'score': scores.get(tenant.id)
+    } for tenant, unit, prop in rows]
+    # Tri stable : à score égal, l'ordre immeuble / porte est conservé
+    late_tenants.sort(key=lambda item: item['score'].score if item['score'] else 101)
     return late_tenants
 
 
@@ -231,44 +280,31 @@ def get_payment_statistics(user):
     Returns:
         dict: Statistiques diverses
     """
-    from collections import defaultdict
-    from datetime import datetime
-    from dateutil.relativedelta import relativedelta
-    
     # Initialiser les 12 derniers mois à 0
-    monthly_revenue = {}
-    today = datetime.now()
-    for i in range(11, -1, -1):
-        date = today - relativedelta(months=i)
-        key = date.strftime('%Y-%m')
-        monthly_revenue[key] = 0.0
-    
-    total_payments = 0
-    total_revenue = 0
-    
-    for property in user.properties:
-        for unit in property.units:
-            for tenant in unit.tenants:
-                for payment in tenant.payments:
-                    # Grouper par mois
-                    month_key = payment.period  # Format "2023-11"
-                    # On ne garde que si c'est dans notre fenêtre de 12 mois ou futur
-                    if month_key in monthly_revenue:
-                        monthly_revenue[month_key] += payment.amount
-                    # Ou on l'ajoute si on veut tout l'historique (mais le chart risque d'être long)
-                    # Ici on privilégie la vue "12 derniers mois" pour le dashboard
-                    
-                    total_payments += 1
-                    total_revenue += payment.amount
-    
+    months = periods.last_months(12)
+    monthly_revenue = {periods.from_index(index): 0.0 for index in months}
+
+    # Agrégats calculés en base sur la plage de mois (index owner_id + period_index)
+    for period_index, amount in (db.session.query(Payment.period_index, db.func.sum(Payment.amount))
+                                 .filter(Payment.owner_id == user.id,
+                                         Payment.in_periods(months.start, months.stop - 1))
+                                 .group_by(Payment.period_index)):
+        monthly_revenue[periods.from_index(period_index)] = amount or 0.0
+
+    total_payments, total_revenue = (db.session.query(db.func.count(Payment.id),
+                                                      db.func.coalesce(db.func.sum(Payment.amount), 0.0))
+                                     .filter(Payment.owner_id == user.id)
+                                     .one())
+
     # Trier par mois (déjà fait par la boucle d'init, mais on s'assure)
     sorted_months = sorted(monthly_revenue.items())
-    
+
     # Calculer le taux de recouvrement
     total_units = user.get_total_units()
-    occupied_units = sum(1 for prop in user.properties 
-                        for unit in prop.units if unit.current_tenant)
-    
+    occupied_units = (db.session.query(db.func.count(db.distinct(Tenant.unit_id)))
+                      .filter(Tenant.owner_id == user.id, Tenant.is_active.is_(True))
+                      .scalar())
+
     # Paiements moyens
     avg_payment = total_revenue / total_payments if total_payments > 0 else 0
     
@@ -279,3 +315,155 @@ def get_payment_statistics(user):
         'avg_payment': avg_payment,
         'collection_rate': (occupied_units / total_units * 100) if total_units > 0 else 0
     }
+
+
+def encode_payment_cursor(payment):
+    """Curseur de pagination opaque : position (date_paid, id) du dernier paiement affiché."""
+    return f"{payment.date_paid.isoformat()}~{payment.id}"
+
+
+def decode_payment_cursor(cursor):
+    """
+    Décode un curseur de pagination.
+
+    Raises:
+        ValueError: Curseur invalide
+    """
+    date_str, id_str = cursor.rsplit('~', 1)
+    return datetime.fromisoformat(date_str), int(id_str)
+
+
+def get_payment_page(tenant, cursor=None, per_page=PAYMENTS_PER_PAGE):
+    """
+    Page de l'historique d'un locataire, du plus récent au plus ancien.
+
+    Pagination par clé sur (date_paid, id) : chaque page est une lecture de
+    l'index composite à partir du curseur, quel que soit l'ancienneté du bail.
+    Les paiements archivés (app/archival.py) suivent les paiements chauds.
+
+    Args:
+        tenant: Instance de Tenant
+        cursor: Curseur renvoyé par la page précédente (None = première page)
+        per_page: Nombre de paiements par page
+
+    Returns:
+        tuple: (liste de Payment, curseur de la page suivante ou None)
+    """
+    position = decode_payment_cursor(cursor) if cursor else None
+
+    # Paiements chauds et archivés lus ensemble : une lecture d'index par table, fusion en Python
+    payments = []
+    for model in (Payment, ArchivedPayment):
+        query = model.query.filter(model.tenant_id == tenant.id)
+        if position:
+            query = query.filter(db.tuple_(model.date_paid, model.id) < position)
+        payments.extend(query.order_by(model.date_paid.desc(), model.id.desc())
+                        .limit(per_page + 1)
+                        .all())
+    payments.sort(key=lambda payment: (payment.date_paid, payment.id), reverse=True)
+    payments = payments[:per_page + 1]
+
+    next_cursor = encode_payment_cursor(payments[per_page - 1]) if len(payments) > per_page else None
+    return payments[:per_page], next_cursor
+
+
+def get_tenant_payment_summary(tenant):
+    """
+    Résumé de l'historique d'un locataire (archives comprises) en une requête d'agrégat.
+
+    Args:
+        tenant: Instance de Tenant
+
+    Returns:
+        dict: total_paid, last_payment, months_covered, payments_count
+    """
+    # Tables chaude et d'archive réunies (UNION ALL), agrégées en une requête
+    history = db.union_all(*[
+        db.select(model.amount, model.date_paid, model.period_index).where(model.tenant_id == tenant.id)
+        for model in (Payment, ArchivedPayment)
+    ]).subquery()
+    total_paid, last_payment, months_covered, payments_count = db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(history.c.amount), 0.0),
+                  db.func.max(history.c.date_paid),
+                  db.func.count(db.distinct(history.c.period_index)),
+                  db.func.count())
+        .select_from(history)).one()
+
+    return {
+        'total_paid': total_paid,
+        'last_payment': last_payment,
+        'months_covered': months_covered,
+        'payments_count': payments_count,
+    }
+
+
+def get_collection_sheet(property, period):
+    """
+    Feuille d'encaissement d'un immeuble pour une période : locataires actifs,
+    loyer à pré-remplir et paiement déjà enregistré pour le mois.
+
+    Args:
+        property: Instance de Property
+        period: Période "YYYY-MM"
+
+    Returns:
+        list: Dictionnaires tenant, unit, amount, already_paid (triés par porte)
+    """
+    paid_tenants = {tenant_id for (tenant_id,) in
+                    db.session.query(Payment.tenant_id)
+                    .join(Tenant, Payment.tenant_id == Tenant.id)
+                    .join(Unit, Tenant.unit_id == Unit.id)
+                    .filter(Unit.property_id == property.id, Payment.in_periods(period, period))}
+
+    rows = (db.session.query(Tenant, Unit)
+            .join(Unit, Tenant.unit_id == Unit.id)
+            .filter(Unit.property_id == property.id, Tenant.is_active.is_(True))
+            .order_by(Unit.door_number)
+            .all())
+    return [{
+        'tenant': tenant,
+        'unit': unit,
+        'amount': unit.rent_amount,
+        'already_paid': tenant.id in paid_tenants,
+    } for tenant, unit in rows]
+
+
+def record_bulk_payments(property, period, amounts):
+    """
+    Enregistre en une transaction les paiements cochés d'un immeuble.
+
+    Idempotent : un locataire qui a déjà un paiement pour la période est
+    ignoré (double soumission du formulaire, saisie individuelle entre-temps),
+    y compris pour deux soumissions simultanées (verrou de l'immeuble).
+    Les quittances sont mises en file (`flask receipts work`), pas générées ici.
+
+    Args:
+        property: Instance de Property (déjà vérifiée pour le propriétaire)
+        period: Période "YYYY-MM"
+        amounts: {tenant_id: montant}
+
+    Returns:
+        tuple: (liste des Payment créés, nombre de locataires ignorés)
+
+    Raises:
+        ValueError: Locataire hors de l'immeuble ou inactif
+    """
+    # Verrou de l'immeuble avant de relire les paiements du mois : deux soumissions
+    # simultanées (double clic traité par deux workers) se suivent, et la seconde voit
+    # les paiements de la première. UPDATE neutre : verrou de ligne sous PostgreSQL,
+    # verrou d'écriture de la base sous SQLite.
+    properties = Property.__table__
+    db.session.execute(properties.update().where(properties.c.id == property.id)
+                       .values(id=properties.c.id))
+
+    sheet = {row['tenant'].id: row for row in get_collection_sheet(property, period)}
+    unknown = set(amounts) - set(sheet)
+    if unknown:
+        raise ValueError(f"Locataires invalides pour cet immeuble : {sorted(unknown)}")
+
+    payments = [Payment(amount=amount, period=period, tenant=sheet[tenant_id]['tenant'],
+                        receipt_queued=True)
+                for tenant_id, amount in amounts.items() if not sheet[tenant_id]['already_paid']]
+    db.session.add_all(payments)
+    db.session.commit()
+    return payments, len(amounts) - len(payments)
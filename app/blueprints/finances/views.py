@@ -1,42 +1,18 @@
-from flask import current_app, render_template, redirect, url_for, flash, make_response, request, abort
+from flask import render_template, redirect, url_for, flash, make_response, request, abort
 from flask_login import login_required, current_user
-from app import db
+from app import db, periods
 from app.blueprints.finances import finances_bp
-from app.blueprints.finances.forms import PaymentForm
-from app.models import Tenant, Payment
+from app.blueprints.finances.forms import BulkPaymentForm, CampaignForm, PaymentForm
+from app.blueprints.finances.archive import ReceiptUnavailable, ensure_archived, send_archived_receipt
+from app.ratelimit import Overloaded
+from app.models import Property, Tenant, Payment
+from app.decorators import feature_required, heavy_job, rate_limited, read_only
 import uuid
-import os
 import logging
 from urllib.parse import quote
 
-# Configuration du logging
 logger = logging.getLogger(__name__)
 
-# Gestion de l'erreur si WeasyPrint n'est pas installé
-try:
-    from weasyprint import HTML
-    WEASYPRINT_AVAILABLE = True
-except ImportError:
-    HTML = None
-    WEASYPRINT_AVAILABLE = False
-    logger.warning("WeasyPrint n'est pas installé. La génération de PDF sera désactivée.")
-
-
-def _check_payment_access(payment):
-    """
-    Fonction utilitaire pour vérifier l'accès à un paiement.
-
-    Args:
-        payment: Instance de Payment
-
-    Returns:
-        bool: True si l'utilisateur a accès, False sinon
-    """
-    try:
-        return payment.tenant.unit.property.owner == current_user
-    except AttributeError:
-        logger.error(f"Erreur lors de la vérification d'accès pour le paiement {payment.id}")
-        return False
 
 
 def _sanitize_phone_number(phone):
@@ -68,13 +44,8 @@ def add_payment(tenant_id):
     Returns:
         Template ou redirection
     """
-    tenant = Tenant.query.get_or_404(tenant_id)
-
-    # Sécurité : Vérifier que le locataire appartient à un immeuble du user
-    if tenant.unit.property.owner != current_user:
-        logger.warning(f"Tentative d'accès non autorisé au locataire {tenant_id} par l'utilisateur {current_user.id}")
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('main.index'))
+    # Sécurité : le locataire doit appartenir au user ou à un immeuble partagé (404 sinon)
+    tenant = Tenant.get_accessible_or_404(tenant_id, current_user)
 
     form = PaymentForm()
 
@@ -84,17 +55,18 @@ def add_payment(tenant_id):
 
     if form.validate_on_submit():
         try:
-            # Création du paiement avec token unique
+            # Création du paiement avec token unique ; quittance générée hors requête (flask receipts work)
             payment = Payment(
                 amount=form.amount.data,
                 period=form.period.data,
                 tenant=tenant,
-                receipt_token=str(uuid.uuid4())
+                receipt_token=str(uuid.uuid4()),
+                receipt_queued=True
             )
             db.session.add(payment)
             db.session.commit()
 
-            logger.info(f"Paiement créé: ID={payment.id}, Montant={payment.amount}, Locataire={tenant.full_name}")
+            logger.info("Paiement créé: ID=%s, Montant=%s, Locataire=%s", payment.id, payment.amount, tenant.full_name)
             flash('Paiement enregistré avec succès !', 'success')
 
             # Redirection vers la page de succès avec options WhatsApp et PDF
@@ -102,13 +74,74 @@ def add_payment(tenant_id):
 
         except Exception as e:
             db.session.rollback()
-            logger.error(f"Erreur lors de l'enregistrement du paiement: {str(e)}")
+            logger.error("Erreur lors de l'enregistrement du paiement: %s", e)
             flash("Une erreur est survenue lors de l'enregistrement du paiement.", "danger")
             return redirect(url_for('finances.add_payment', tenant_id=tenant_id))
 
     return render_template('finances/add_payment.html', form=form, tenant=tenant)
 
 
+@finances_bp.route('/property/<int:property_id>/collect', methods=['GET', 'POST'])
+@login_required
+def bulk_payments(property_id):
+    """
+    Saisie groupée des loyers d'un immeuble pour un mois (jour d'encaissement).
+
+    Args:
+        property_id: ID de l'immeuble
+
+    Returns:
+        Template ou redirection
+    """
+    from app.blueprints.finances.services import get_collection_sheet, record_bulk_payments
+
+    # Sécurité : l'immeuble doit appartenir au user ou lui être partagé (404 sinon)
+    property = Property.get_accessible_or_404(property_id, current_user)
+
+    form = BulkPaymentForm()
+    if request.method == 'GET':
+        period = request.args.get('period')
+        form.period.data = period if period in dict(form.period.choices) else form.period.choices[0][0]
+
+    if form.validate_on_submit():
+        # Lignes cochées : montant saisi (pré-rempli avec le loyer)
+        amounts = {}
+        for tenant_id in request.form.getlist('tenant_ids', type=int):
+            amount = request.form.get(f'amount_{tenant_id}', type=float)
+            if amount is None or amount <= 0:
+                flash("Montant invalide pour un des locataires cochés.", "danger")
+                return redirect(url_for('finances.bulk_payments', property_id=property.id,
+                                        period=form.period.data))
+            amounts[tenant_id] = amount
+
+        if not amounts:
+            flash("Aucun locataire coché.", "warning")
+            return redirect(url_for('finances.bulk_payments', property_id=property.id, period=form.period.data))
+
+        try:
+            payments, skipped = record_bulk_payments(property, form.period.data, amounts)
+        except ValueError:
+            abort(400)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Erreur lors de la saisie groupée: %s", e)
+            flash("Une erreur est survenue : aucun paiement n'a été enregistré.", "danger")
+            return redirect(url_for('finances.bulk_payments', property_id=property.id, period=form.period.data))
+
+        logger.info("Saisie groupée immeuble %s période %s: %s créé(s), %s ignoré(s)",
+                    property.id, form.period.data, len(payments), skipped)
+        message = f"{len(payments)} paiement(s) enregistré(s) pour {form.period.data}."
+        if skipped:
+            message += f" {skipped} déjà payé(s), ignoré(s)."
+        flash(message + " Les quittances sont en cours de préparation.", "success")
+        return redirect(url_for('properties.details', property_id=property.id))
+
+    if form.period.data not in dict(form.period.choices):
+        form.period.data = form.period.choices[0][0]
+    sheet = get_collection_sheet(property, form.period.data)
+    return render_template('finances/bulk_payments.html', form=form, property=property, sheet=sheet)
+
+
 @finances_bp.route('/success/<int:payment_id>')
 @login_required
 def payment_success(payment_id):
@@ -122,16 +155,11 @@ def payment_success(payment_id):
     Returns:
         Template de succès
     """
-    payment = Payment.query.get_or_404(payment_id)
-
-    # Sécurité : Vérifier l'accès
-    if not _check_payment_access(payment):
-        logger.warning(f"Accès non autorisé au paiement {payment_id} par l'utilisateur {current_user.id}")
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('main.index'))
+    # Sécurité : le paiement doit appartenir au user ou à un immeuble partagé (404 sinon)
+    payment = Payment.get_accessible_or_404(payment_id, current_user)
 
-    # Génération du lien de téléchargement PDF
-    pdf_url = url_for('finances.download_receipt', payment_id=payment.id, _external=True)
+    # Lien public de la quittance (accessible au locataire sans compte)
+    pdf_url = url_for('main.public_receipt', token=payment.receipt_token, _external=True)
 
     # Préparation du message WhatsApp
     month_label = payment.period  # Ex: "2023-11" ou "Novembre 2023"
@@ -161,9 +189,10 @@ def payment_success(payment_id):
 
 @finances_bp.route('/receipt/download/<int:payment_id>')
 @login_required
+@rate_limited('receipt')
 def download_receipt(payment_id):
     """
-    Génération et téléchargement du reçu PDF pour un paiement.
+    Téléchargement du reçu PDF d'un paiement (généré et archivé au premier appel).
 
     Args:
         payment_id: ID du paiement
@@ -171,95 +200,33 @@ def download_receipt(payment_id):
     Returns:
         Réponse PDF ou redirection avec message d'erreur
     """
-    payment = Payment.query.get_or_404(payment_id)
-
-    # Sécurité : Vérifier l'accès
-    if not _check_payment_access(payment):
-        logger.warning(f"Tentative de téléchargement non autorisé du reçu {payment_id}")
-        abort(403)
-
-    # Vérifier que WeasyPrint est disponible
-    if not WEASYPRINT_AVAILABLE or HTML is None:
-        flash("Le module PDF (WeasyPrint) n'est pas installé sur le serveur.", "danger")
-        return redirect(url_for('properties.tenant_details', tenant_id=payment.tenant.id))
+    # Sécurité : le paiement doit appartenir au user ou à un immeuble partagé (404 sinon)
+    payment = Payment.get_accessible_or_404(payment_id, current_user)
 
     try:
-        # 1. Génération du HTML à partir du template
-       # Préparer les données pour le PDF
-        owner = payment.tenant.unit.property.owner
-
-        # Gestion du logo et de la couleur (Premium)
-        logo_path = None
-        brand_color = '#333333' # Couleur par défaut
-
-        if owner.has_feature('custom_branding'):
-            if owner.brand_color:
-                brand_color = owner.brand_color
-
-            if owner.logo_filename:
-                # Chemin absolu pour WeasyPrint
-                logo_path = os.path.join(current_app.root_path, 'static/uploads/logos', owner.logo_filename)
-                # Vérifier si le fichier existe
-                if not os.path.exists(logo_path):
-                    logo_path = None
-
-        rendered_html = render_template('pdf/receipt_template.html',
-                              payment=payment,
-                              property=payment.tenant.unit.property,
-                              tenant=payment.tenant,
-                              owner=owner,
-                              logo_path=logo_path,
-                              brand_color=brand_color)
-
-        # 2. Transformation en PDF avec WeasyPrint
-        pdf = HTML(string=rendered_html).write_pdf()
-        try:
-            logger.info(f"Début génération PDF pour paiement {payment_id}")
-            if logo_path:
-                logger.info(f"Logo path: {logo_path}")
-
-            pdf = HTML(string=rendered_html).write_pdf()
-            logger.info("PDF généré avec succès")
-        except Exception as e:
-            logger.error(f"Erreur WeasyPrint: {str(e)}")
-            # Fallback sans logo si erreur
-            if logo_path:
-                logger.warning("Tentative de régénération sans logo")
-                rendered_html = render_template('pdf/receipt_template.html',
-                                      payment=payment,
-                                      property=payment.tenant.unit.property,
-                                      tenant=payment.tenant,
-                                      owner=owner,
-                                      logo_path=None,
-                                      brand_color=brand_color)
-                pdf = HTML(string=rendered_html).write_pdf()
-            else:
-                raise e
-
-        # 3. Création de la réponse
-        safe_name = payment.tenant.full_name.replace(' ', '_').replace('/', '-')
-        filename = f"Quittance_{payment.period}_{safe_name}.pdf"
-
-        response = make_response(pdf)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
-
-        logger.info(f"Reçu PDF généré pour le paiement {payment_id}")
-        return response
-
-    except Exception as e:
-        logger.error(f"Erreur génération PDF: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
+        path = ensure_archived(payment)
+    except ReceiptUnavailable as e:
+        flash(str(e), "danger")
+        return redirect(url_for('properties.tenant_details', tenant_id=payment.tenant.id))
+    except Overloaded:
+        raise
+    except Exception:
+        # Trace rendue par le thread de journalisation (voir app/logs.py)
+        logger.exception("Erreur génération PDF pour le paiement %s", payment.id)
         flash("Une erreur est survenue lors de la génération du PDF.", "danger")
         return redirect(url_for('properties.tenant_details', tenant_id=payment.tenant.id))
 
+    safe_name = payment.tenant.full_name.replace(' ', '_').replace('/', '-')
+    filename = f"Quittance_{payment.period}_{safe_name}.pdf"
+    return send_archived_receipt(path, filename, public=False)
+
 
 @finances_bp.route('/payment/<int:payment_id>/delete', methods=['POST'])
 @login_required
 def delete_payment(payment_id):
     """
-    Supprimer un paiement (en cas d'erreur de saisie).
+    Supprimer un paiement (en cas d'erreur de saisie). Sa quittance numérotée est
+    conservée au registre des annulations (voided_receipts).
 
     Args:
         payment_id: ID du paiement à supprimer
@@ -267,28 +234,27 @@ def delete_payment(payment_id):
     Returns:
         Redirection vers la page du locataire
     """
-    payment = Payment.query.get_or_404(payment_id)
-
-    # Sécurité : Vérifier l'accès
-    if not _check_payment_access(payment):
-        logger.warning(f"Tentative de suppression non autorisée du paiement {payment_id}")
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('properties.index'))
+    # Sécurité : propriétaire ou gestionnaire de l'immeuble (404 sinon)
+    payment = Payment.get_accessible_or_404(payment_id, current_user, manage=True)
 
     tenant_id = payment.tenant.id
     payment_period = payment.period
     payment_amount = payment.amount
+    receipt_label = payment.receipt_label
 
     try:
         db.session.delete(payment)
         db.session.commit()
 
-        logger.info(f"Paiement supprimé: ID={payment_id}, Période={payment_period}, Montant={payment_amount}")
-        flash(f'Paiement de {payment_amount} FCFA pour "{payment_period}" supprimé.', 'warning')
+        logger.info("Paiement supprimé: ID=%s, Période=%s, Montant=%s", payment_id, payment_period, payment_amount)
+        message = f'Paiement de {payment_amount} FCFA pour "{payment_period}" supprimé.'
+        if receipt_label:
+            message += f' La quittance N° {receipt_label} est annulée.'
+        flash(message, 'warning')
 
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Erreur lors de la suppression du paiement {payment_id}: {str(e)}")
+        logger.error("Erreur lors de la suppression du paiement %s: %s", payment_id, e)
         flash("Une erreur est survenue lors de la suppression du paiement.", "danger")
 
     return redirect(url_for('properties.tenant_details', tenant_id=tenant_id))
@@ -298,6 +264,9 @@ def delete_payment(payment_id):
 
 @finances_bp.route('/export/excel')
 @login_required
+@rate_limited('export')
+@heavy_job
+@read_only
 def export_excel():
     """
     Exporte tous les paiements de l'utilisateur vers un fichier Excel.
@@ -313,9 +282,19 @@ def export_excel():
         flash("🚀 Export Excel : fonctionnalité réservée au plan Premium !", "info")
         return redirect(url_for('main.pricing'))
 
+    # Plage de périodes optionnelle (?start=2024-01&end=2024-12)
+    start, end = request.args.get('start') or None, request.args.get('end') or None
+    try:
+        for period in (start, end):
+            if period:
+                periods.to_index(period)
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(url_for('main.index'))
+
     try:
         # Générer le fichier Excel (retourne un BytesIO)
-        excel_file = export_payments_to_excel(current_user)
+        excel_file = export_payments_to_excel(current_user, start=start, end=end)
 
         # Réinitialiser le pointeur au début du fichier
         excel_file.seek(0)
@@ -324,7 +303,7 @@ def export_excel():
         # Nom du fichier avec date
         filename = f"ImmoGest_Paiements_{datetime.now().strftime('%Y%m%d')}.xlsx"
 
-        logger.info(f"Export Excel généré pour l'utilisateur {current_user.id} - Taille: {len(file_content)} bytes")
+        logger.info("Export Excel généré pour l'utilisateur %s - Taille: %s bytes", current_user.id, len(file_content))
 
         # Créer la réponse manuellement pour un contrôle total des headers
         response = make_response(file_content)
@@ -342,22 +321,46 @@ def export_excel():
         return response
 
     except ImportError as e:
-        logger.error(f"Erreur d'import lors de l'export Excel: {str(e)}")
+        logger.error("Erreur d'import lors de l'export Excel: %s", e)
         flash("Le module Excel n'est pas installé sur le serveur. Contactez le support.", "danger")
         return redirect(url_for('main.index'))
         flash("Une erreur est survenue lors de la génération du fichier Excel.", "danger")
         return redirect(url_for('main.index'))
 
 
+@finances_bp.route('/forecast')
+@login_required
+@feature_required('analytics_dashboard')
+@rate_limited('dashboard')
+@read_only
+def forecast():
+    """
+    Prévision des encaissements des prochains mois (?months=3 à 12), en JSON.
+    Fonctionnalité réservée au plan Premium.
+    """
+    from flask import current_app, jsonify
+    from app.blueprints.finances.forecast import get_cash_forecast
+
+    months = request.args.get('months', default=current_app.config['FORECAST_MONTHS'], type=int)
+    try:
+        return jsonify(get_cash_forecast(current_user, months))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except ImportError as e:
+        logger.error("Prévision indisponible: %s", e)
+        return jsonify(error="La prévision n'est pas disponible sur le serveur."), 503
+
+
 @finances_bp.route('/reminders')
 @login_required
+@read_only
 def reminders():
     """
     Affiche la liste des locataires en retard de paiement pour le mois en cours.
     Fonctionnalité Premium.
     """
-    from app.decorators import feature_required
     from app.blueprints.finances.services import get_late_tenants
+    from app.models import ReminderCampaign, ReminderJob
     from datetime import datetime
 
     # Vérifier que l'utilisateur a accès à cette fonctionnalité
@@ -369,9 +372,50 @@ def reminders():
     late_tenants = get_late_tenants(current_user)
     current_period = datetime.now().strftime('%Y-%m')
 
+    # Campagne du mois et répartition des envois par statut
+    campaign = ReminderCampaign.query.filter_by(owner_id=current_user.id, period=current_period).first()
+    campaign_stats = {}
+    if campaign:
+        campaign_stats = dict(db.session.query(ReminderJob.status, db.func.count(ReminderJob.id))
+                              .filter(ReminderJob.campaign_id == campaign.id)
+                              .group_by(ReminderJob.status).all())
+
     return render_template('finances/reminders.html',
                           late_tenants=late_tenants,
-                          current_period=current_period)
+                          current_period=current_period,
+                          campaign=campaign,
+                          campaign_stats=campaign_stats,
+                          campaign_form=CampaignForm())
+
+
+@finances_bp.route('/reminders/campaign', methods=['POST'])
+@login_required
+def launch_campaign():
+    """
+    Lance (ou complète) la campagne de relances du mois en cours.
+    Tous les messages sont générés en une passe et mis en file d'envoi ; les
+    envois sont faits hors requête par `flask reminders work`.
+    """
+    from app.blueprints.finances.campaigns import create_campaign
+
+    if not CampaignForm().validate_on_submit():
+        abort(400)
+
+    if not current_user.has_feature('payment_reminders'):
+        flash("🚀 Rappels automatiques : fonctionnalité réservée au plan Premium !", "info")
+        return redirect(url_for('main.pricing'))
+
+    try:
+        campaign, added = create_campaign(current_user)
+        logger.info("Campagne %s lancée par l'utilisateur %s: %s envois ajoutés",
+                    campaign.period, current_user.id, added)
+        flash(f"Campagne lancée : {added} relance(s) mise(s) en file d'envoi.", "success")
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Erreur lors du lancement de la campagne: %s", e)
+        flash("Une erreur est survenue lors du lancement de la campagne.", "danger")
+
+    return redirect(url_for('finances.reminders'))
 
 
 @finances_bp.route('/reminders/send/<int:tenant_id>')
@@ -381,19 +425,18 @@ def send_reminder(tenant_id):
     Redirige vers WhatsApp pour envoyer un rappel.
     """
     from app.blueprints.finances.services import send_whatsapp_reminder
+    from app.blueprints.finances.campaigns import mark_manual_sent
     from datetime import datetime
 
-    tenant = Tenant.query.get_or_404(tenant_id)
-
-    # Sécurité
-    if tenant.unit.property.owner != current_user:
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('finances.reminders'))
+    # Sécurité (id + owner_id) : les relances restent propres au propriétaire (voir app/access.py)
+    tenant = Tenant.get_owned_or_404(tenant_id, current_user)
 
     # Générer le lien WhatsApp
     current_period = datetime.now().strftime('%Y-%m')
     whatsapp_url = send_whatsapp_reminder(tenant, tenant.unit.rent_amount, current_period)
 
+    # L'envoi manuel compte comme relance dans la campagne du mois
+    mark_manual_sent(tenant.id, current_period)
+
     # Redirection vers WhatsApp
     return redirect(whatsapp_url)
-
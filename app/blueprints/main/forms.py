@@ -0,0 +1,14 @@
+from flask_wtf import FlaskForm
+from wtforms import SelectField, StringField, SubmitField
+from wtforms.validators import DataRequired, Email
+from app.models import TeamMember
+
+class TeamMemberForm(FlaskForm):
+    """Invitation d'un membre : email et rôle ; la portée et les immeubles cochés sont lus à part."""
+    email = StringField('Email de son compte ImmoGest', validators=[DataRequired(), Email()])
+    role = SelectField('Rôle', validators=[DataRequired()], choices=list(TeamMember.ROLES.items()))
+    submit = SubmitField('Enregistrer')
+
+class RemoveTeamMemberForm(FlaskForm):
+    """Retrait d'un membre : rien à saisir, seulement le jeton CSRF."""
+    submit = SubmitField('Retirer')
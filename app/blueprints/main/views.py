@@ -5,29 +5,36 @@ from flask_login import login_required, current_user
 from app.blueprints.main import main_bp
 from app import db
 from app.models import User
-from app.decorators import admin_required
-from flask import request, redirect, url_for, flash
+from app.decorators import admin_required, feature_required, rate_limited, read_only
+from app.ratelimit import check_rate_limit
+from flask import request, redirect, url_for, flash, abort, current_app
 from datetime import datetime, timedelta # Import important !
+from functools import partial
+import logging
 
+logger = logging.getLogger(__name__)
 
 
 
 @main_bp.route('/')
+@read_only
 def index():
     # CAS 1 : L'utilisateur est connecté -> On affiche ses STATISTIQUES
     if current_user.is_authenticated:
+        # Limite par compte seulement : la page d'accueil anonyme est partagée derrière les NAT d'opérateur
+        check_rate_limit('dashboard')
+
         # 1. Total des immeubles
         total_properties = current_user.properties.count()
 
-        # 2. Total des appartements (on doit boucler ou faire une jointure)
-        # Pour faire simple et efficace en Python :
-        all_units = []
-        for prop in current_user.properties:
-            all_units.extend(prop.units.all())
+        # 2. Total des appartements (filtrés directement par owner_id)
+        all_units = Unit.owned_by(current_user).all()
         total_units = len(all_units)
 
-        # 3. Appartements occupés vs Vacants
-        occupied_units = sum(1 for u in all_units if u.current_tenant)
+        # 3. Appartements occupés vs Vacants (une requête pour tous les locataires actifs)
+        occupied_ids = {unit_id for (unit_id,) in db.session.query(Tenant.unit_id)
+                        .filter(Tenant.owner_id == current_user.id, Tenant.is_active.is_(True))}
+        occupied_units = sum(1 for u in all_units if u.id in occupied_ids)
         vacant_units = total_units - occupied_units
 
         # 4. Taux d'occupation (pour la barre de progression)
@@ -36,13 +43,18 @@ def index():
             occupancy_rate = round((occupied_units / total_units) * 100)
 
         # 5. Revenus mensuels théoriques (Somme des loyers des apparts occupés)
-        monthly_potential = sum(u.rent_amount for u in all_units if u.current_tenant)
+        monthly_potential = sum(u.rent_amount for u in all_units if u.id in occupied_ids)
         
         # 6. Statistiques Premium (si l'utilisateur a la fonctionnalité analytics)
-        premium_stats = None
+        # Calcul différé : le template ne l'appelle que si le graphique n'est pas en cache
+        load_premium_stats = load_forecast = None
         if current_user.has_feature('analytics_dashboard'):
+            from app.blueprints.finances import forecast
             from app.blueprints.finances.services import get_payment_statistics
-            premium_stats = get_payment_statistics(current_user)
+            load_premium_stats = partial(get_payment_statistics, current_user._get_current_object())
+            if forecast.available():
+                load_forecast = partial(forecast.get_cash_forecast, current_user._get_current_object(),
+                                        current_app.config['FORECAST_MONTHS'])
 
         return render_template('index_dashboard.html',
                                total_properties=total_properties,
@@ -51,7 +63,9 @@ def index():
                                vacant_units=vacant_units,
                                occupancy_rate=occupancy_rate,
                                monthly_potential=monthly_potential,
-                               premium_stats=premium_stats)
+                               load_premium_stats=load_premium_stats,
+                               load_forecast=load_forecast,
+                               current_period=datetime.now().strftime('%Y-%m'))
 
     # CAS 2 : Visiteur anonyme -> On affiche la LANDING PAGE
     else:
@@ -70,22 +84,26 @@ def settings():
     from flask import current_app
     
     if request.method == 'POST':
-        # Debug logs
-        print(f"DEBUG: POST settings received. User plan: {current_user.plan}")
-        print(f"DEBUG: Files: {request.files}")
-        print(f"DEBUG: Form: {request.form}")
+        logger.debug("Paramètres reçus (plan %s), fichiers: %s", current_user.plan, request.files)
         
+        # 0. Moteur de génération des quittances (tous les plans)
+        if 'receipt_engine' in request.form:
+            from app.blueprints.finances.receipts import RECEIPT_ENGINES
+            receipt_engine = request.form.get('receipt_engine')
+            if receipt_engine in RECEIPT_ENGINES:
+                current_user.receipt_engine = receipt_engine
+
         # 1. Mise à jour de la couleur (Premium uniquement)
-        if current_user.has_feature('custom_branding'):
+        elif current_user.has_feature('custom_branding'):
             brand_color = request.form.get('brand_color')
             if brand_color:
-                print(f"DEBUG: Updating brand color to {brand_color}")
+                logger.debug("Couleur de marque: %s", brand_color)
                 current_user.brand_color = brand_color
                 
             # 2. Upload du Logo (Premium uniquement)
             if 'logo' in request.files:
                 file = request.files['logo']
-                print(f"DEBUG: Logo file received: {file.filename}")
+                logger.debug("Logo reçu: %s", file.filename)
                 
                 if file and file.filename != '':
                     # Vérifier extension
@@ -94,12 +112,11 @@ def settings():
                         # Créer le dossier s'il n'existe pas
                         upload_folder = os.path.join(current_app.root_path, 'static/uploads/logos')
                         os.makedirs(upload_folder, exist_ok=True)
-                        print(f"DEBUG: Upload folder: {upload_folder}")
                         
                         # Nom sécurisé et unique
                         filename = secure_filename(f"logo_{current_user.id}_{int(datetime.now().timestamp())}.{file.filename.rsplit('.', 1)[1].lower()}")
                         save_path = os.path.join(upload_folder, filename)
-                        print(f"DEBUG: Saving logo to {save_path}")
+                        logger.debug("Enregistrement du logo: %s", save_path)
                         
                         file.save(save_path)
                         
@@ -111,39 +128,240 @@ def settings():
                                 
                         current_user.logo_filename = filename
                     else:
-                        print("DEBUG: Invalid file extension")
+                        logger.debug("Extension de logo invalide: %s", file.filename)
                         flash("Format de logo invalide. Utilisez PNG ou JPG.", "danger")
         else:
-            print("DEBUG: User does not have custom_branding feature")
+            logger.debug("Personnalisation refusée (plan %s)", current_user.plan)
             flash("Fonctionnalité réservée au plan Premium.", "warning")
         
         # Sauvegarder les changements
         try:
             db.session.commit()
-            print("DEBUG: Changes committed to DB")
             flash("Vos paramètres ont été mis à jour avec succès ! ✨", "success")
-        except Exception as e:
+        except Exception:
             db.session.rollback()
-            print(f"DEBUG: Error saving to DB: {e}")
+            logger.exception("Erreur lors de la sauvegarde des paramètres")
             flash("Une erreur est survenue lors de la sauvegarde.", "danger")
             
         return redirect(url_for('main.settings'))
-        
-    return render_template('settings.html')
+
+    from app.blueprints.finances.receipts import RECEIPT_ENGINES
+    return render_template('settings.html', receipt_engines=RECEIPT_ENGINES)
+
+@main_bp.route('/team', methods=['GET', 'POST'])
+@login_required
+@feature_required('multi_users')
+def team():
+    """
+    Équipe du propriétaire (Premium) : gestionnaires et gardiens invités sur
+    tous ses immeubles ou sur certains (voir app/access.py).
+    """
+    from app import access
+    from app.blueprints.main.forms import RemoveTeamMemberForm, TeamMemberForm
+    from app.models import TeamMember
+
+    form = TeamMemberForm()
+    if request.method == 'POST':
+        # Jeton CSRF compris : une page tierce ne peut pas donner des accès à la place du propriétaire
+        if not form.validate_on_submit():
+            flash("Formulaire invalide ou expiré : vérifiez l'email et réessayez.", "danger")
+            return redirect(url_for('main.team'))
+
+        member = User.query.filter_by(email=form.email.data.strip()).first()
+        if member is None:
+            flash("Aucun compte ImmoGest avec cet email : la personne doit d'abord s'inscrire.", "warning")
+            return redirect(url_for('main.team'))
+
+        property_ids = None
+        if request.form.get('scope') == 'some':
+            property_ids = request.form.getlist('property_ids', type=int)
+            if not property_ids:
+                flash("Choisissez au moins un immeuble.", "warning")
+                return redirect(url_for('main.team'))
+
+        try:
+            access.grant(current_user, member, form.role.data, property_ids)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), "danger")
+            return redirect(url_for('main.team'))
+
+        logger.info("Équipe du propriétaire %s: accès de %s mis à jour", current_user.id, member.id)
+        flash(f"Accès de {member.email} enregistré.", "success")
+        return redirect(url_for('main.team'))
+
+    members = TeamMember.query.filter_by(owner_id=current_user.id).order_by(TeamMember.created_at).all()
+    shared = {membership.id: access.member_property_ids(membership)
+              for membership in members if not membership.all_properties}
+    properties = current_user.properties.order_by(Property.name).all()
+    return render_template('team.html', form=form, remove_form=RemoveTeamMemberForm(), members=members,
+                           shared=shared, properties=properties, roles=TeamMember.ROLES)
+
+
+@main_bp.route('/team/<int:membership_id>/remove', methods=['POST'])
+@login_required
+@feature_required('multi_users')
+def remove_team_member(membership_id):
+    """Retire un membre de l'équipe (ses accès disparaissent immédiatement)."""
+    from app import access
+    from app.blueprints.main.forms import RemoveTeamMemberForm
+    from app.models import TeamMember
+
+    if not RemoveTeamMemberForm().validate_on_submit():
+        abort(400)
+
+    membership = TeamMember.query.filter_by(id=membership_id, owner_id=current_user.id).first_or_404()
+    email = membership.member.email
+    access.revoke(membership)
+    db.session.commit()
+    flash(f"{email} ne fait plus partie de votre équipe.", "info")
+    return redirect(url_for('main.team'))
+
 
 @main_bp.route('/pricing')
 def pricing():
     return render_template('pricing.html')
 
 
+@main_bp.route('/search')
+@login_required
+def search():
+    """
+    Recherche globale (locataires, appartements, immeubles).
+    Les requêtes HTMX de la barre de recherche ne reçoivent que la liste des résultats.
+    """
+    from app.search import search as search_entries
+
+    query = request.args.get('q', '').strip()
+    results = search_entries(current_user, query) if query else []
+
+    if request.headers.get('HX-Request') and not request.headers.get('HX-Boosted'):
+        return render_template('search_results.html', query=query, results=results)
+    return render_template('search.html', query=query, results=results)
+
+
+@main_bp.route('/r/<token>')
+def public_receipt(token):
+    """
+    Quittance publique (lien envoyé au locataire par WhatsApp), sans connexion.
+    Sert uniquement le fichier généré par `flask receipts work` : ni requête SQL, ni PDF.
+    """
+    import os
+    from app import metrics
+    from app.blueprints.finances.archive import PENDING_RETRY_AFTER, archive_path, send_archived_receipt
+
+    path = archive_path(token)
+    if path is None:
+        abort(404)
+    exists = os.path.exists(path)
+    metrics.observe_cache('receipt_archive', exists)
+    if not exists:
+        # Quittance encore en file (ou annulée) : le locataire réessaie plus tard
+        response = current_app.response_class(
+            "Quittance en cours de préparation : réessayez dans quelques minutes.", status=503,
+            mimetype='text/plain')
+        response.headers['Retry-After'] = str(PENDING_RETRY_AFTER)
+        return response
+
+    return send_archived_receipt(path, f"Quittance_{token[:8]}.pdf")
+
+
+@main_bp.route('/sync')
+@login_required
+@rate_limited('sync')
+def sync():
+    """
+    Changements depuis un curseur (?since=), pour les clients hors ligne.
+    Le client rappelle avec le `cursor` reçu tant que `has_more` est vrai.
+    """
+    import gzip
+    import json
+    from flask import jsonify, make_response
+    from app.sync import StaleCursor, changes_since
+
+    since = request.args.get('since', '0')
+    if not since.isdigit():
+        return jsonify(error="Curseur invalide."), 400
+    try:
+        payload = changes_since(current_user, int(since), limit=current_app.config['SYNC_BATCH_SIZE'])
+    except StaleCursor:
+        return jsonify(error="Curseur expiré : resynchronisation complète requise.", resync=True), 410
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode()
+    response = make_response(body)
+    response.mimetype = 'application/json'
+    response.headers['Cache-Control'] = 'private, no-store'
+    response.vary.add('Accept-Encoding')
+    if len(body) > 1024 and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@main_bp.route('/ready')
+def ready():
+    """
+    Sonde de disponibilité (health check Render / load balancer).
+    Répond 200 quand la base répond, 503 sinon.
+    """
+    from flask import current_app, jsonify
+    from sqlalchemy import text
+
+    try:
+        db.session.execute(text('SELECT 1'))
+        database_ok = True
+    except Exception:
+        db.session.rollback()
+        database_ok = False
+
+    payload = {
+        'status': 'ready' if database_ok else 'unavailable',
+        'database': database_ok,
+        'warm': current_app.extensions.get('immogest_warm', False),
+    }
+
+    from app.fragment_cache import get_cache
+    payload['fragment_cache'] = get_cache().stats()
+
+    from app import ratelimit
+    if ratelimit.enabled():
+        try:
+            payload['rate_limit'] = ratelimit.stats()
+        except Exception:
+            payload['rate_limit'] = None
+
+    # Réplique : signalée mais non bloquante, le primaire suffit à servir l'application
+    from app.replica import REPLICA_BIND_KEY, replica_available
+    if replica_available():
+        try:
+            with db.engines[REPLICA_BIND_KEY].connect() as connection:
+                connection.execute(text('SELECT 1'))
+            payload['replica'] = True
+        except Exception:
+            payload['replica'] = False
+    return jsonify(payload), (200 if database_ok else 503)
+
+
 # 1. Tableau de bord Super Admin
 @main_bp.route('/admin/users')
 @login_required
 @admin_required
 def admin_dashboard():
-    # On récupère tous les utilisateurs, du plus récent au plus ancien
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin/users.html', users=users, now=datetime.utcnow())
+    # Répartition par plan effectif, calculée en base (un abonnement expiré compte en 'free')
+    plan_counts = User.count_by_plan()
+
+    # On récupère les utilisateurs, du plus récent au plus ancien (filtre optionnel ?plan=)
+    plan_filter = request.args.get('plan')
+    query = User.query
+    if plan_filter:
+        query = query.filter(User.effective_plan == plan_filter)
+    users = query.order_by(User.created_at.desc()).all()
+
+    return render_template('admin/users.html', users=users, now=datetime.utcnow(),
+                           plan_counts=plan_counts, plan_filter=plan_filter)
 
 # 2. Action pour changer le plan d'un utilisateur
 
@@ -1,11 +1,13 @@
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, abort
 from flask_login import login_required, current_user
 from app import db
 from app.blueprints.properties import properties_bp
 from app.blueprints.properties.forms import PropertyForm
 from app.models import Property
 from app.blueprints.properties.forms import UnitForm, TenantForm
-from app.models import Unit, Tenant, Payment # Importez le modèle Unit
+from app.models import Unit, Tenant, TenantScore # Importez le modèle Unit
+from app import access
+from app.blueprints.finances.services import get_payment_page, get_tenant_payment_summary
 
 
 @properties_bp.route('/')
@@ -13,7 +15,11 @@ from app.models import Unit, Tenant, Payment # Importez le modèle Unit
 def index():
     # On récupère uniquement les immeubles du propriétaire connecté
     properties = current_user.properties.all()
-    return render_template('properties/index.html', properties=properties)
+    # Immeubles partagés par d'autres propriétaires (équipe, voir app/access.py)
+    shared_ids = access.shared_property_ids(current_user)
+    shared_properties = (Property.query.filter(Property.in_properties(shared_ids)).order_by(Property.name).all()
+                         if shared_ids else [])
+    return render_template('properties/index.html', properties=properties, shared_properties=shared_properties)
 
 @properties_bp.route('/add', methods=['GET', 'POST'])
 @login_required
@@ -43,22 +49,24 @@ def add():
 @properties_bp.route('/<int:property_id>')
 @login_required
 def details(property_id):
-    # On récupère l'immeuble, mais on s'assure qu'il appartient bien au user connecté (Sécurité !)
-    property = current_user.properties.filter_by(id=property_id).first_or_404()
+    # On récupère l'immeuble, mais on s'assure qu'il appartient au user connecté ou à son équipe (Sécurité !)
+    property = Property.get_accessible_or_404(property_id, current_user)
 
     # On récupère les appartements de cet immeuble
     units = property.units.all()
 
-    return render_template('properties/details.html', property=property, units=units)
+    return render_template('properties/details.html', property=property, units=units,
+                           can_manage=access.can_manage(current_user, property))
 
 @properties_bp.route('/<int:property_id>/add_unit', methods=['GET', 'POST'])
 @login_required
 def add_unit(property_id):
-    # Vérification de sécurité (toujours !)
-    property = current_user.properties.filter_by(id=property_id).first_or_404()
+    # Vérification de sécurité (toujours !) : propriétaire ou gestionnaire de l'immeuble
+    property = Property.get_accessible_or_404(property_id, current_user, manage=True)
 
-    if not current_user.can_add_unit():
-        flash(f"Limite atteinte pour le plan {current_user.plan_display_name}. Passez à la version supérieure !", "warning")
+    # La limite du plan est celle du propriétaire de l'immeuble
+    if not property.owner.can_add_unit():
+        flash(f"Limite atteinte pour le plan {property.owner.plan_display_name}. Passez à la version supérieure !", "warning")
         return redirect(url_for('main.pricing'))
 
     form = UnitForm()
@@ -80,12 +88,8 @@ def add_unit(property_id):
 @login_required
 def new_tenant(unit_id):
     # 1. Récupération de l'appartement
-    unit = Unit.query.get_or_404(unit_id)
-
-    # 2. Sécurité : Vérifier que cet appartement appartient bien au user connecté
-    if unit.property.owner != current_user:
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('properties.index'))
+    # 2. Sécurité : une seule requête id + owner_id ou immeuble géré (404 sinon)
+    unit = Unit.get_accessible_or_404(unit_id, current_user, manage=True)
 
     # 3. Règle Métier : Vérifier si l'appart est déjà occupé
     if unit.current_tenant:
@@ -117,17 +121,33 @@ def new_tenant(unit_id):
 @properties_bp.route('/tenant/<int:tenant_id>')
 @login_required
 def tenant_details(tenant_id):
-    tenant = Tenant.query.get_or_404(tenant_id)
+    # Sécurité : le locataire doit appartenir au user ou à un immeuble partagé (404 sinon)
+    tenant = Tenant.get_accessible_or_404(tenant_id, current_user)
 
-    # Sécurité : Vérifier que le locataire est bien dans un immeuble du user
-    if tenant.unit.property.owner != current_user:
-        flash("Vous n'avez pas accès à ce dossier.", "danger")
-        return redirect(url_for('properties.index'))
+    # Première page de l'historique (le plus récent en haut) + résumé agrégé
+    payments, next_cursor = get_payment_page(tenant)
+    summary = get_tenant_payment_summary(tenant)
+    # Score de fiabilité calculé la nuit (flask data score-tenants), lu par clé primaire
+    score = db.session.get(TenantScore, tenant.id)
+
+    return render_template('properties/tenant_details.html', tenant=tenant, payments=payments,
+                           next_cursor=next_cursor, summary=summary, score=score,
+                           can_manage=access.can_manage(current_user, tenant.unit.property))
 
-    # On trie les paiements par date décroissante (le plus récent en haut)
-    payments = tenant.payments.order_by(Payment.date_paid.desc()).all()
 
-    return render_template('properties/tenant_details.html', tenant=tenant, payments=payments)
+@properties_bp.route('/tenant/<int:tenant_id>/payments')
+@login_required
+def tenant_payments(tenant_id):
+    """Page suivante de l'historique (défilement infini) : seulement les lignes du tableau."""
+    tenant = Tenant.get_accessible_or_404(tenant_id, current_user)
+
+    try:
+        payments, next_cursor = get_payment_page(tenant, cursor=request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+    return render_template('properties/payment_rows.html', tenant=tenant, payments=payments,
+                           next_cursor=next_cursor, can_manage=access.can_manage(current_user, tenant.unit.property))
 
 
 # === EDIT ROUTES ===
@@ -136,7 +156,7 @@ def tenant_details(tenant_id):
 @login_required
 def edit_property(property_id):
     """Edit existing property"""
-    property = current_user.properties.filter_by(id=property_id).first_or_404()
+    property = Property.get_owned_or_404(property_id, current_user)
     
     form = PropertyForm(obj=property)
     
@@ -154,12 +174,8 @@ def edit_property(property_id):
 @login_required
 def edit_unit(unit_id):
     """Edit existing unit"""
-    unit = Unit.query.get_or_404(unit_id)
-    
-    # Security check
-    if unit.property.owner != current_user:
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('properties.index'))
+    # Security check (id + owner_id, or managed property)
+    unit = Unit.get_accessible_or_404(unit_id, current_user, manage=True)
     
     form = UnitForm(obj=unit)
     
@@ -177,12 +193,8 @@ def edit_unit(unit_id):
 @login_required
 def edit_tenant(tenant_id):
     """Edit existing tenant"""
-    tenant = Tenant.query.get_or_404(tenant_id)
-    
-    # Security check
-    if tenant.unit.property.owner != current_user:
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('properties.index'))
+    # Security check (id + owner_id, or managed property)
+    tenant = Tenant.get_accessible_or_404(tenant_id, current_user, manage=True)
     
     form = TenantForm(obj=tenant)
     
@@ -203,7 +215,7 @@ def edit_tenant(tenant_id):
 @properties_bp.route('/property/<int:property_id>/delete', methods=['POST'])
 @login_required
 def delete_property(property_id):
-    property = current_user.properties.filter_by(id=property_id).first_or_404()
+    property = Property.get_owned_or_404(property_id, current_user)
     
     property_name = property.name
     db.session.delete(property)
@@ -216,12 +228,8 @@ def delete_property(property_id):
 @properties_bp.route('/unit/<int:unit_id>/delete', methods=['POST'])
 @login_required
 def delete_unit(unit_id):
-    unit = Unit.query.get_or_404(unit_id)
-    
-    # Security check
-    if unit.property.owner != current_user:
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('properties.index'))
+    # Security check (id + owner_id, or managed property)
+    unit = Unit.get_accessible_or_404(unit_id, current_user, manage=True)
     
     property_id = unit.property.id
     unit_number = unit.door_number
@@ -236,12 +244,8 @@ def delete_unit(unit_id):
 @properties_bp.route('/tenant/<int:tenant_id>/delete', methods=['POST'])
 @login_required
 def delete_tenant(tenant_id):
-    tenant = Tenant.query.get_or_404(tenant_id)
-    
-    # Security check
-    if tenant.unit.property.owner != current_user:
-        flash("Accès interdit.", "danger")
-        return redirect(url_for('properties.index'))
+    # Security check (id + owner_id, or managed property)
+    tenant = Tenant.get_accessible_or_404(tenant_id, current_user, manage=True)
     
     property_id = tenant.unit.property.id
     tenant_name = tenant.full_name
@@ -0,0 +1,696 @@
+"""
+Commandes CLI de l'application (flask <commande>).
+"""
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+
+# Script exécuté dans un process Python neuf pour mesurer un démarrage à froid
+_STARTUP_SCRIPT = '''
+import json, sys, time
+t0 = time.perf_counter()
+from app import create_app
+app = create_app({config_name!r})
+t1 = time.perf_counter()
+if {warm}:
+    from app.lazy import warm_up
+    warm_up(app)
+t2 = time.perf_counter()
+with app.app_context():
+    app.test_client().get('/auth/login')
+t3 = time.perf_counter()
+print(json.dumps({{
+    'create_app': t1 - t0,
+    'warm_up': t2 - t1,
+    'first_request': t3 - t2,
+    'total': t3 - t0,
+    'modules': len(sys.modules),
+}}))
+'''
+
+# Base du test de charge remplie dans un process neuf (DATABASE_URL de l'environnement)
+_SEED_SCRIPT = '''
+import json
+from app import create_app
+app = create_app('production')
+with app.app_context():
+    from app.loadtest import seed
+    print(json.dumps(seed({owners}, properties={properties}, units={units}, months={months})))
+'''
+
+_IMPORT_SCRIPT = '''
+import json, time
+t0 = time.perf_counter()
+try:
+    import {module}
+    ok = True
+except (ImportError, OSError):
+    ok = False
+print(json.dumps({{'seconds': time.perf_counter() - t0, 'ok': ok}}))
+'''
+
+
+def _run_python(script, cwd, env=None):
+    """Exécute un script dans un interpréteur neuf et décode sa dernière ligne JSON."""
+    result = subprocess.run([sys.executable, '-c', script], cwd=cwd, capture_output=True,
+                            text=True, env={**os.environ, 'WARMUP': '0', **(env or {})})
+    if result.returncode != 0:
+        raise click.ClickException(result.stderr.strip().splitlines()[-1] if result.stderr else 'échec')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _free_port():
+    """Port TCP libre sur la boucle locale."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_gunicorn(project_dir, port, env):
+    """Démarre gunicorn (gunicorn.conf.py, run:app) sur la boucle locale, sortie ignorée."""
+    conf = os.path.join(project_dir, 'gunicorn.conf.py')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', conf, '-b', f'127.0.0.1:{port}', 'run:app'],
+        cwd=project_dir, env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _wait_ready(base_url, timeout=30):
+    """Attend que /ready réponde (démarrage de gunicorn)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/ready', timeout=2):
+                return True
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    return False
+
+
+def _timed_get(url):
+    """GET chronométré : (secondes, succès)."""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            response.read()
+            ok = response.status < 500
+    except urllib.error.HTTPError as e:
+        ok = e.code < 500
+    except (urllib.error.URLError, ConnectionError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _drop_bench_owner(owner_id):
+    """Supprime le propriétaire jetable d'un bench et ce que ses suppressions ont laissé (son parc déjà supprimé)."""
+    from app.extensions import db
+    from app.models import SyncTombstone, User, VoidedReceipt
+
+    tombstones, voided, users = SyncTombstone.__table__, VoidedReceipt.__table__, User.__table__
+    db.session.execute(tombstones.delete().where(tombstones.c.owner_id == owner_id))
+    db.session.execute(voided.delete().where(voided.c.owner_id == owner_id))
+    db.session.execute(users.delete().where(users.c.id == owner_id))
+    db.session.commit()
+
+
+def register_commands(app):
+    """Enregistre les commandes CLI sur l'application."""
+
+    @app.cli.command('warmup')
+    def warmup():
+        """Précharge les dépendances lourdes et compile les templates."""
+        from app.lazy import warm_up
+        status = warm_up(app)
+        for module_name, available in status.items():
+            click.echo(f"{module_name:<28} {'ok' if available else 'indisponible'}")
+
+    @app.cli.group('bench')
+    def bench():
+        """Benchmarks de performance."""
+
+    @bench.command('startup')
+    @click.option('--runs', default=5, show_default=True, help="Nombre de démarrages à froid mesurés.")
+    @click.option('--config', 'config_name', default='default', show_default=True)
+    def bench_startup(runs, config_name):
+        """Mesure le coût d'import et le démarrage à froid d'un worker."""
+        project_dir = os.path.dirname(app.root_path)
+
+        click.echo("Import isolé des dépendances lourdes :")
+        from app.lazy import HEAVY_MODULES
+        for module_name in HEAVY_MODULES:
+            result = _run_python(_IMPORT_SCRIPT.format(module=module_name), project_dir)
+            state = f"{result['seconds'] * 1000:8.1f} ms" if result['ok'] else '   indisponible'
+            click.echo(f"  {module_name:<28} {state}")
+
+        for warm in (False, True):
+            samples = [_run_python(_STARTUP_SCRIPT.format(config_name=config_name, warm=warm), project_dir)
+                       for _ in range(runs)]
+            label = "avec warm-up (--preload)" if warm else "paresseux (défaut)"
+            click.echo(f"\nDémarrage à froid, {label}, médiane sur {runs} runs :")
+            for key in ('create_app', 'warm_up', 'first_request', 'total'):
+                median = statistics.median(sample[key] for sample in samples)
+                click.echo(f"  {key:<28} {median * 1000:8.1f} ms")
+            click.echo(f"  {'modules chargés':<28} {int(statistics.median(s['modules'] for s in samples)):8d}")
+
+    @bench.command('workers')
+    @click.option('--modes', default='sync,gthread,gevent', show_default=True,
+                  help="Modes gunicorn à comparer (GUNICORN_MODE).")
+    @click.option('--workers', default=1, show_default=True)
+    @click.option('--threads', default=4, show_default=True)
+    @click.option('--concurrency', default=8, show_default=True, help="Clients simultanés.")
+    @click.option('--requests', 'total', default=400, show_default=True)
+    @click.option('--path', 'paths', multiple=True, default=('/ready', '/auth/login'), show_default=True)
+    def bench_workers(modes, workers, threads, concurrency, total, paths):
+        """Compare le débit des modes de worker gunicorn sur un serveur local."""
+        project_dir = os.path.dirname(app.root_path)
+
+        click.echo(f"{'mode':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'erreurs':>8}")
+        for mode in modes.split(','):
+            if mode == 'gevent':
+                try:
+                    import gevent  # noqa: F401
+                except ImportError:
+                    click.echo(f"{mode:<10} ignoré (gevent non installé)")
+                    continue
+
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            server = _start_gunicorn(project_dir, port, {'GUNICORN_MODE': mode, 'WEB_CONCURRENCY': str(workers),
+                                                         'GUNICORN_THREADS': str(threads), 'WARMUP': '0'})
+            try:
+                if not _wait_ready(base_url):
+                    click.echo(f"{mode:<10} échec du démarrage")
+                    continue
+                urls = [base_url + paths[i % len(paths)] for i in range(total)]
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    results = list(pool.map(_timed_get, urls))
+                elapsed = time.perf_counter() - start
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+            latencies = [seconds for seconds, _ in results]
+            errors = sum(1 for _, ok in results if not ok)
+            click.echo(f"{mode:<10} {total / elapsed:8.1f} {_percentile(latencies, 50) * 1000:8.1f} "
+                       f"{_percentile(latencies, 95) * 1000:8.1f} {errors:8d}")
+
+    @bench.command('load')
+    @click.option('--mode', default='gthread', show_default=True, help="Mode de worker (GUNICORN_MODE).")
+    @click.option('--workers', default=2, show_default=True)
+    @click.option('--threads', default=4, show_default=True)
+    @click.option('--concurrency', default=16, show_default=True, help="Propriétaires virtuels simultanés.")
+    @click.option('--duration', default=30.0, show_default=True, help="Durée mesurée (secondes).")
+    @click.option('--warmup', default=5.0, show_default=True, help="Durée de chauffe non mesurée (secondes).")
+    @click.option('--owners', type=int, default=None, help="Propriétaires créés (défaut : --concurrency).")
+    @click.option('--properties', default=2, show_default=True, help="Immeubles par propriétaire.")
+    @click.option('--units', default=10, show_default=True, help="Appartements par immeuble.")
+    @click.option('--months', default=12, show_default=True, help="Mois d'historique de paiements.")
+    @click.option('--seed', default=0, show_default=True, help="Graine des parcours (rapports comparables).")
+    @click.option('--sql-latency-ms', default=0.0, show_default=True,
+                  help="Latence ajoutée à chaque requête SQL (base distante simulée).")
+    @click.option('--database-url', default=None,
+                  help="Base de test existante (défaut : SQLite temporaire). Les comptes créés y restent.")
+    @click.option('--output', type=click.Path(dir_okay=False), default=None, help="Rapport JSON à écrire.")
+    @click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None,
+                  help="Rapport de référence : code de sortie 1 en cas de régression.")
+    @click.option('--max-regression', default=20, show_default=True,
+                  help="Dégradation tolérée du p95 par route et du débit (%).")
+    def bench_load(mode, workers, threads, concurrency, duration, warmup, owners, properties, units, months,
+                   seed, sql_latency_ms, database_url, output, baseline, max_regression):
+        """Test de charge de bout en bout : gunicorn local, base remplie, parcours de propriétaires."""
+        import platform
+        import tempfile
+        from datetime import datetime
+        from app.loadtest import WORKLOAD_SETTINGS, compare, run
+
+        project_dir = os.path.dirname(app.root_path)
+        owners = owners or concurrency
+        settings = {'mode': mode, 'workers': workers, 'threads': threads, 'concurrency': concurrency,
+                    'duration': duration, 'warmup': warmup, 'owners': owners, 'properties': properties,
+                    'units': units, 'months': months, 'seed': seed, 'sql_latency_ms': sql_latency_ms}
+
+        with tempfile.TemporaryDirectory(prefix='immogest-load-') as scratch:
+            database_url = database_url or 'sqlite:///' + os.path.join(scratch, 'load.sqlite')
+            # Tout reste local : quittances et métriques dans le dossier temporaire, pas de limitation de débit
+            env = {'DATABASE_URL': database_url, 'FLASK_CONFIG': 'production', 'WARMUP': '0',
+                   'GUNICORN_MODE': mode, 'WEB_CONCURRENCY': str(workers), 'GUNICORN_THREADS': str(threads),
+                   'RATE_LIMIT_ENABLED': '0', 'RATE_LIMIT_DB': os.path.join(scratch, 'ratelimit.sqlite'),
+                   'RECEIPT_ARCHIVE_DIR': os.path.join(scratch, 'receipts'),
+                   'PROMETHEUS_MULTIPROC_DIR': os.path.join(scratch, 'prometheus'),
+                   'REMINDER_SENDER': 'manual', 'LOG_LEVELS': 'app=WARNING',
+                   'BENCH_SQL_LATENCY_MS': str(sql_latency_ms)}
+            os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+
+            click.echo(f"Préparation de {owners} propriétaire(s) ({properties} x {units} appartements, "
+                       f"{months} mois)...")
+            accounts = _run_python(_SEED_SCRIPT.format(owners=owners, properties=properties, units=units,
+                                                       months=months), project_dir, env)
+
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            server = _start_gunicorn(project_dir, port, env)
+            try:
+                if not _wait_ready(base_url):
+                    raise click.ClickException("gunicorn n'a pas démarré.")
+                click.echo(f"{concurrency} client(s), {mode} {workers} x {threads}, "
+                           f"{warmup:.0f} s de chauffe + {duration:.0f} s mesurées...")
+                report = run(base_url, accounts, concurrency, duration, warmup=warmup, seed=seed)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+        report['settings'] = settings
+        report['environment'] = {'date': datetime.now().isoformat(timespec='seconds'),
+                                 'python': platform.python_version(), 'cpu_count': os.cpu_count(),
+                                 'database': database_url.split(':', 1)[0]}
+
+        reference = None
+        if baseline:
+            with open(baseline) as f:
+                reference = json.load(f)
+            changed = [key for key in WORKLOAD_SETTINGS
+                       if reference.get('settings', {}).get(key) != settings[key]]
+            if changed:
+                click.echo(f"Attention : parcours différent de la référence ({', '.join(changed)}).", err=True)
+
+        click.echo(f"\n{'route':<36} {'req':>6} {'req/s':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} "
+                   f"{'erreurs':>8}" + (f" {'p95 réf.':>9}" if reference else ''))
+        rows = list(report['routes'].items()) + [('total', report)]
+        for route, stats in rows:
+            line = (f"{route:<36} {stats['requests']:6d} {stats['throughput']:7.1f} {stats['p50_ms']:7.0f} "
+                    f"{stats['p95_ms']:7.0f} {stats['p99_ms']:7.0f} {stats['error_rate']:8.1%}")
+            if reference:
+                before = reference if route == 'total' else reference['routes'].get(route)
+                line += f" {before['p95_ms']:9.0f}" if before else f" {'-':>9}"
+            click.echo(line)
+        failed = {route: stats['statuses'] for route, stats in report['routes'].items() if stats['errors']}
+        for route, statuses in failed.items():
+            click.echo(f"  {route} : statuts {statuses}")
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+            click.echo(f"Rapport écrit dans {output}")
+
+        if reference:
+            regressions = compare(report, reference, max_regression=max_regression / 100)
+            for message in regressions:
+                click.echo(f"Régression : {message}", err=True)
+            if regressions:
+                sys.exit(1)
+            click.echo("Aucune régression par rapport à la référence.")
+
+    @bench.command('passwords')
+    @click.option('--methods', default=None,
+                  help="Méthodes à comparer, séparées par des virgules (défaut : PASSWORD_HASH_METHOD "
+                       "et quelques coûts de référence).")
+    @click.option('--threads', type=int, default=lambda: int(os.environ.get('GUNICORN_THREADS', 4)),
+                  show_default='GUNICORN_THREADS ou 4', help="Threads d'un worker gthread.")
+    @click.option('--seconds', default=1.0, show_default=True, help="Durée de mesure par méthode.")
+    def bench_passwords(methods, threads, seconds):
+        """Mesure le débit de connexions (vérifications de mot de passe) par worker."""
+        from werkzeug.security import check_password_hash
+        from app.passwords import benchmark, current_method, normalize_method
+
+        configured = current_method()
+        if methods:
+            candidates = [normalize_method(method) for method in methods.split(',')]
+        else:
+            candidates = [configured, 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:210000']
+        candidates = list(dict.fromkeys(candidates))
+
+        click.echo(f"{'méthode':<24} {'ms/connexion':>13} {'1 thread/s':>11} "
+                   f"{f'{threads} threads/s':>13} {'mémoire':>9}")
+        for method in candidates:
+            result = benchmark(method, seconds=seconds)
+
+            # Débit d'un worker gthread : hashlib libère le GIL pendant le calcul
+            total = max(threads * 4, int(result['per_second'] * seconds))
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(lambda _: check_password_hash(result['hash'], 'mot-de-passe-de-test'),
+                              range(total)))
+            threaded = total / (time.perf_counter() - start)
+
+            name, *args = method.split(':')
+            memory = f"{128 * int(args[0]) * int(args[1]) // 1024 ** 2} Mo" if name == 'scrypt' else '-'
+            marker = ' *' if method == configured else ''
+            click.echo(f"{method:<24} {result['median'] * 1000:13.1f} {result['per_second']:11.1f} "
+                       f"{threaded:13.1f} {memory:>9}{marker}")
+        click.echo("* méthode configurée (PASSWORD_HASH_METHOD)")
+
+    @bench.command('delete')
+    @click.option('--units', default=100, show_default=True, help="Appartements de l'immeuble.")
+    @click.option('--months', default=36, show_default=True, help="Paiements par locataire.")
+    def bench_delete(units, months):
+        """Mesure la suppression d'un immeuble complet (compte jetable créé dans la base courante)."""
+        import uuid
+        from datetime import datetime
+        from app import periods
+        from app.extensions import db
+        from app.models import Payment, Property, Tenant, Unit, User
+
+        owner = User(email=f"bench-{uuid.uuid4().hex[:12]}@example.invalid")
+        owner.set_password(uuid.uuid4().hex)
+        db.session.add(owner)
+        db.session.flush()
+        building = Property(name="Immeuble de test", owner_id=owner.id)
+        db.session.add(building)
+        db.session.commit()
+        owner_id, property_id = owner.id, building.id
+
+        # Descendance insérée en Core : le coût mesuré est celui de la suppression seule
+        current = periods.current_index()
+        unit_ids = db.session.scalars(Unit.__table__.insert().returning(Unit.__table__.c.id), [
+            {'property_id': property_id, 'owner_id': owner_id, 'door_number': str(i), 'rent_amount': 100000}
+            for i in range(units)]).all()
+        tenant_ids = db.session.scalars(Tenant.__table__.insert().returning(Tenant.__table__.c.id), [
+            {'unit_id': unit_id, 'owner_id': owner_id, 'full_name': "Locataire", 'phone': '770000000',
+             'is_active': True} for unit_id in unit_ids]).all()
+        db.session.execute(Payment.__table__.insert(), [
+            {'tenant_id': tenant_id, 'owner_id': owner_id, 'amount': 100000, 'period': periods.from_index(index),
+             'period_index': index, 'date_paid': datetime.utcnow(), 'receipt_token': str(uuid.uuid4())}
+            for tenant_id in tenant_ids for index in range(current - months, current)])
+        db.session.commit()
+        db.session.expunge_all()
+
+        start = time.perf_counter()
+        db.session.delete(db.session.get(Property, property_id))
+        db.session.commit()
+        elapsed = time.perf_counter() - start
+        remaining = db.session.scalar(db.select(db.func.count(Payment.id)).where(Payment.owner_id == owner_id))
+
+        _drop_bench_owner(owner_id)
+        click.echo(f"{units} appartement(s), {units * months} paiement(s) : {elapsed * 1000:.0f} ms "
+                   f"({remaining} paiement(s) restant(s))")
+
+    @bench.command('receipts')
+    @click.option('--threads', default=16, show_default=True, help="Saisies de paiement simultanées.")
+    @click.option('--payments', default=50, show_default=True, help="Paiements saisis par thread.")
+    def bench_receipts(threads, payments):
+        """Saisit des paiements en parallèle pour un même propriétaire et vérifie leurs numéros de quittance."""
+        import uuid
+        from sqlalchemy.exc import OperationalError
+        from app import periods
+        from app.extensions import db
+        from app.models import Payment, Property, Tenant, Unit, User
+
+        if db.engine.url.database in (None, '', ':memory:'):
+            raise click.ClickException("Base en mémoire : chaque thread aurait sa propre base.")
+        owner = User(email=f"bench-{uuid.uuid4().hex[:12]}@example.invalid")
+        owner.set_password(uuid.uuid4().hex)
+        building = Property(name="Immeuble de test", owner=owner)
+        tenants = [Tenant(unit=Unit(property=building, door_number=str(i), rent_amount=100000),
+                          full_name="Locataire", phone='770000000') for i in range(threads)]
+        db.session.add_all([owner, building, *tenants])
+        db.session.commit()
+        owner_id, property_id, tenant_ids = owner.id, building.id, [tenant.id for tenant in tenants]
+        db.session.remove()
+
+        current = periods.current_index()
+        errors = []
+
+        def work(tenant_id):
+            # Une session par thread, comme un thread gunicorn qui traite des requêtes
+            with app.app_context():
+                for index in range(current - payments, current):
+                    db.session.add(Payment(tenant_id=tenant_id, amount=100000, period=periods.from_index(index)))
+                    try:
+                        db.session.commit()
+                    except OperationalError as e:
+                        db.session.rollback()
+                        errors.append(e)
+                db.session.remove()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(work, tenant_ids))
+        elapsed = time.perf_counter() - start
+
+        numbers = db.session.scalars(db.select(Payment.receipt_number).where(Payment.owner_id == owner_id)
+                                     .order_by(Payment.receipt_number)).all()
+        last = db.session.scalar(db.select(User.receipt_seq).where(User.id == owner_id))
+        contiguous = numbers == list(range(1, len(numbers) + 1)) and last == len(numbers)
+
+        db.session.delete(db.session.get(Property, property_id))
+        db.session.commit()
+        _drop_bench_owner(owner_id)
+
+        click.echo(f"{len(numbers)} paiement(s) en {elapsed:.2f} s ({len(numbers) / elapsed:.0f}/s), "
+                   f"{threads} thread(s), {len(errors)} erreur(s) de verrou")
+        click.echo(f"Numéros 1..{last} : {'continus, sans doublon' if contiguous else 'TROUS OU DOUBLONS'}")
+        if errors or not contiguous:
+            for error in errors[:3]:
+                click.echo(f"  {error.orig}", err=True)
+            sys.exit(1)
+
+    @app.cli.group('reminders')
+    def reminders():
+        """Campagnes de relances WhatsApp."""
+
+    @reminders.command('schedule')
+    def reminders_schedule():
+        """Lance les campagnes du mois (à exécuter chaque jour via cron) puis traite la file."""
+        from app.blueprints.finances.campaigns import process_jobs, run_scheduled_campaigns
+
+        # Contexte de requête factice : les liens des messages doivent être absolus
+        with app.test_request_context(base_url=app.config['PUBLIC_BASE_URL']):
+            for owner, added in run_scheduled_campaigns():
+                click.echo(f"{owner.email:<40} {added} envoi(s) ajouté(s)")
+            counts = process_jobs()
+        click.echo(f"Envoyés: {counts['sent']}, échecs: {counts['failed']}")
+
+    @reminders.command('work')
+    @click.option('--batch-size', default=100, show_default=True)
+    def reminders_work(batch_size):
+        """Traite les envois en attente de la file."""
+        from app.blueprints.finances.campaigns import process_jobs
+
+        with app.app_context():
+            counts = process_jobs(batch_size=batch_size)
+        click.echo(f"Envoyés: {counts['sent']}, échecs: {counts['failed']}")
+
+    @app.cli.group('receipts')
+    def receipts():
+        """Archive des quittances PDF."""
+
+    @receipts.command('work')
+    @click.option('--batch-size', default=50, show_default=True)
+    def receipts_work(batch_size):
+        """Génère les quittances mises en file à la saisie des paiements."""
+        from app.blueprints.finances.archive import process_receipt_queue
+
+        # Contexte de requête factice : le template PDF construit des URL
+        with app.test_request_context(base_url=app.config['PUBLIC_BASE_URL']):
+            counts = process_receipt_queue(batch_size=batch_size)
+        click.echo(f"Archivées: {counts['archived']}, échecs: {counts['failed']}")
+
+    @receipts.command('backfill')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def receipts_backfill(batch_size):
+        """Met en file les quittances pas encore générées (paiements saisis avant la mise en file)."""
+        from app.blueprints.finances.archive import queue_missing_receipts
+
+        click.echo(f"{queue_missing_receipts(batch_size=batch_size)} quittance(s) mise(s) en file")
+
+    @app.cli.group('data')
+    def data():
+        """Maintenance et reprise des données."""
+
+    @data.command('backfill-owners')
+    def data_backfill_owners():
+        """Renseigne owner_id sur units, tenants et payments (après flask db upgrade)."""
+        from app.extensions import db
+        from app.models import Property, Unit, Tenant, Payment
+
+        # Trois UPDATE ensemblistes, du parent vers l'enfant
+        steps = (
+            (Unit, db.select(Property.owner_id).where(Property.id == Unit.property_id).scalar_subquery()),
+            (Tenant, db.select(Unit.owner_id).where(Unit.id == Tenant.unit_id).scalar_subquery()),
+            (Payment, db.select(Tenant.owner_id).where(Tenant.id == Payment.tenant_id).scalar_subquery()),
+        )
+        for model, owner_subquery in steps:
+            result = db.session.execute(db.update(model).where(model.owner_id.is_(None))
+                                        .values(owner_id=owner_subquery)
+                                        .execution_options(synchronize_session=False))
+            db.session.commit()
+            click.echo(f"{model.__tablename__:<10} {result.rowcount} ligne(s) mise(s) à jour")
+
+    @data.command('backfill-periods')
+    @click.option('--batch-size', default=5000, show_default=True, help="Paiements par transaction.")
+    def data_backfill_periods(batch_size):
+        """Renseigne payments.period_index (après flask db upgrade), par lots d'id."""
+        from app.extensions import db
+        from app.models import Payment
+        from app.periods import sql_index
+
+        max_id = db.session.query(db.func.max(Payment.id)).scalar() or 0
+        total = 0
+        # Lots par plage d'id : transactions courtes, pas de verrou long sur la table
+        for first_id in range(1, max_id + 1, batch_size):
+            result = db.session.execute(
+                db.update(Payment)
+                .where(Payment.id >= first_id, Payment.id < first_id + batch_size,
+                       Payment.period_index.is_(None))
+                .values(period_index=sql_index(Payment.period))
+                .execution_options(synchronize_session=False))
+            db.session.commit()
+            total += result.rowcount
+        click.echo(f"payments   {total} ligne(s) mise(s) à jour")
+
+    @data.command('archive')
+    @click.option('--batch-size', default=1000, show_default=True, help="Lignes par transaction.")
+    @click.option('--payments-after', type=int, default=None,
+                  help="Horizon des paiements en mois (défaut : ARCHIVE_PAYMENTS_AFTER_MONTHS).")
+    @click.option('--tenants-after', type=int, default=None,
+                  help="Horizon des locataires partis en mois (défaut : ARCHIVE_TENANTS_AFTER_MONTHS).")
+    def data_archive(batch_size, payments_after, tenants_after):
+        """Déplace les paiements anciens et les locataires partis vers les tables d'archive."""
+        from app.archival import run_archival
+
+        try:
+            counts = run_archival(payments_after or app.config['ARCHIVE_PAYMENTS_AFTER_MONTHS'],
+                                  tenants_after or app.config['ARCHIVE_TENANTS_AFTER_MONTHS'],
+                                  batch_size=batch_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"payments   {counts['payments']} ligne(s) archivée(s)")
+        click.echo(f"tenants    {counts['tenants']} ligne(s) archivée(s)")
+
+    @data.command('score-tenants')
+    @click.option('--batch-size', default=500, show_default=True, help="Locataires par transaction.")
+    def data_score_tenants(batch_size):
+        """Recalcule les scores de fiabilité de paiement (à planifier chaque nuit)."""
+        from app.scoring import compute_scores
+
+        # Un loyer est en retard à partir du jour de lancement des relances
+        total = compute_scores(batch_size=batch_size, due_day=app.config['REMINDER_CAMPAIGN_DAY'])
+        click.echo(f"{total} score(s) recalculé(s)")
+
+    @data.command('backfill-sync')
+    @click.option('--batch-size', default=5000, show_default=True, help="Lignes par transaction.")
+    def data_backfill_sync(batch_size):
+        """Numérote les lignes existantes pour /sync (après flask db upgrade)."""
+        from app.sync import backfill
+
+        click.echo(f"{backfill(batch_size=batch_size)} ligne(s) numérotée(s)")
+
+    @data.command('backfill-receipt-numbers')
+    def data_backfill_receipt_numbers():
+        """
+        Numérote les quittances existantes par propriétaire, par date de paiement.
+
+        À lancer juste après `flask db upgrade`, avant de rouvrir le trafic : les anciens
+        paiements sont numérotés après les numéros déjà attribués à la saisie.
+        """
+        from datetime import datetime
+        from app.extensions import db
+        from app.models import ArchivedPayment, Payment, User
+
+        users, total = User.__table__, 0
+        tables = [model.__table__ for model in (Payment, ArchivedPayment)]
+        owner_ids = sorted({owner_id for table in tables for owner_id in db.session.scalars(
+            db.select(table.c.owner_id).where(table.c.receipt_number.is_(None), table.c.owner_id.isnot(None))
+            .distinct())})
+        started = db.session.scalar(db.select(db.func.count()).select_from(users)
+                                    .where(users.c.id.in_(owner_ids), users.c.receipt_seq > 0)) if owner_ids else 0
+        if started:
+            click.echo(f"Attention : {started} propriétaire(s) ont déjà des quittances numérotées depuis la "
+                       f"migration ; leurs anciens paiements recevront des numéros plus grands.", err=True)
+
+        # Une transaction par propriétaire ; l'UPDATE du compteur bloque ses saisies le temps de la reprise
+        for owner_id in owner_ids:
+            db.session.execute(users.update().where(users.c.id == owner_id)
+                               .values(receipt_seq=users.c.receipt_seq))
+            last = db.session.scalar(db.select(users.c.receipt_seq).where(users.c.id == owner_id))
+            rows = sorted(((date_paid or datetime.min, payment_id, table)
+                           for table in tables
+                           for date_paid, payment_id in db.session.execute(
+                               db.select(table.c.date_paid, table.c.id)
+                               .where(table.c.owner_id == owner_id, table.c.receipt_number.is_(None)))),
+                          key=lambda row: row[:2])
+            for table in tables:
+                numbered = [{'payment_id': payment_id, 'number': number}
+                            for number, (_, payment_id, row_table) in enumerate(rows, start=last + 1)
+                            if row_table is table]
+                if numbered:
+                    db.session.execute(table.update().where(table.c.id == db.bindparam('payment_id'))
+                                       .values(receipt_number=db.bindparam('number')), numbered)
+            db.session.execute(users.update().where(users.c.id == owner_id)
+                               .values(receipt_seq=last + len(rows)))
+            db.session.commit()
+            total += len(rows)
+        click.echo(f"{total} quittance(s) numérotée(s) pour {len(owner_ids)} propriétaire(s)")
+
+    @data.command('purge-tombstones')
+    @click.option('--days', type=int, default=None,
+                  help="Âge minimal en jours (défaut : SYNC_TOMBSTONE_DAYS).")
+    def data_purge_tombstones(days):
+        """Supprime les anciennes suppressions à synchroniser (curseurs plus anciens : 410)."""
+        from app.sync import purge_tombstones
+
+        click.echo(f"{purge_tombstones(days or app.config['SYNC_TOMBSTONE_DAYS'])} tombstone(s) supprimé(s)")
+
+    @data.command('sync-replica')
+    def data_sync_replica():
+        """Copie la base SQLite primaire vers la réplique (test local du routage des lectures)."""
+        import sqlite3
+        from app.extensions import db
+        from app.replica import REPLICA_BIND_KEY
+
+        if REPLICA_BIND_KEY not in db.engines:
+            raise click.ClickException("Aucune réplique configurée (DATABASE_REPLICA_URL).")
+        primary, replica = db.engines[None].url, db.engines[REPLICA_BIND_KEY].url
+        if primary.get_backend_name() != 'sqlite' or replica.get_backend_name() != 'sqlite':
+            raise click.ClickException("Sous PostgreSQL la réplique est alimentée par la réplication du serveur.")
+
+        db.session.remove()
+        with sqlite3.connect(primary.database) as source, sqlite3.connect(replica.database) as target:
+            source.backup(target)
+        click.echo(f"{primary.database} -> {replica.database}")
+
+    @app.cli.group('search')
+    def search_group():
+        """Index de recherche globale."""
+
+    @search_group.command('rebuild')
+    def search_rebuild():
+        """Installe l'index plein texte (FTS5 / pg_trgm) et reconstruit toutes les lignes."""
+        from app.extensions import db
+        from app import search
+
+        connection = db.session.connection()
+        count = search.rebuild(connection)
+        dialect = search.install_index(connection)
+        db.session.commit()
+        click.echo(f"{count} ligne(s) indexée(s), index {dialect or 'LIKE (aucun index plein texte)'}")
+
+    @app.cli.group('subscriptions')
+    def subscriptions():
+        """Abonnements payants."""
+
+    @subscriptions.command('expire')
+    def subscriptions_expire():
+        """Rétrograde en 'free' les abonnements expirés (à exécuter chaque jour via cron)."""
+        from app.models import User
+
+        count = User.expire_subscriptions()
+        click.echo(f"{count} abonnement(s) expiré(s) repassé(s) en Gratuit")
@@ -22,6 +22,50 @@ def admin_required(f):
     return decorated_function
 
 
+def read_only(f):
+    """
+    Décorateur pour les routes en lecture seule : leurs requêtes partent vers
+    la réplique si elle est configurée (voir app/replica.py).
+    Usage: @read_only (sous @login_required)
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from app.replica import use_replica
+        use_replica()
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def rate_limited(name):
+    """
+    Décorateur de limitation de débit par utilisateur (seau à jetons RATE_LIMITS[name],
+    partagé entre les workers). Seau vide : 429 avec Retry-After (voir app/ratelimit.py).
+    Usage: @rate_limited('export') (sous @login_required)
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from app.ratelimit import check_rate_limit
+            check_rate_limit(name)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def heavy_job(f):
+    """
+    Décorateur des routes très coûteuses en CPU : au plus HEAVY_JOBS_MAX_CONCURRENT
+    en cours sur tous les workers, 503 avec Retry-After au-delà.
+    Usage: @heavy_job (sous @rate_limited)
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from app.ratelimit import job_slot
+        with job_slot():
+            return f(*args, **kwargs)
+    return decorated_function
+
+
 def plan_required(min_plan):
     """
     Décorateur pour restreindre l'accès selon le plan d'abonnement.
@@ -43,14 +87,8 @@ def plan_required(min_plan):
             # Hiérarchie des plans
             plan_hierarchy = {'free': 0, 'standard': 1, 'premium': 2}
             
-            # Vérifier si l'abonnement est expiré
-            user_plan = current_user.plan
-            if current_user.plan in ['standard', 'premium'] and current_user.subscription_end:
-                from datetime import datetime
-                if datetime.utcnow() > current_user.subscription_end:
-                    user_plan = 'free'  # Abonnement expiré
-            
-            current_level = plan_hierarchy.get(user_plan, 0)
+            # Plan effectif (un abonnement expiré vaut 'free')
+            current_level = plan_hierarchy.get(current_user.effective_plan, 0)
             required_level = plan_hierarchy.get(min_plan, 0)
             
             if current_level < required_level:
@@ -1,8 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
+from app.replica import RoutingSession
 
-db = SQLAlchemy()
+# Session routée : lectures des routes @read_only vers la réplique si configurée
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 login_manager = LoginManager()
 
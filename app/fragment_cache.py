@@ -0,0 +1,211 @@
+"""
+Cache de fragments de templates, versionné par propriétaire.
+
+Dans un template :
+
+    {% cache 'property_cards' %} ... {% endcache %}
+    {% cache 'unit_grid', property.id %} ... {% endcache %}
+
+La clé combine le nom du fragment, les arguments supplémentaires, l'id du
+propriétaire connecté et son `data_version`, incrémenté à chaque écriture sur
+ses immeubles, appartements, locataires ou paiements (voir models.py). Aucune
+invalidation explicite : une écriture change la clé, les anciennes entrées
+sortent du cache par éviction.
+
+Backends (config FRAGMENT_CACHE_BACKEND) :
+  - 'memory' (défaut) : LRU en mémoire, borné à FRAGMENT_CACHE_MAX_ENTRIES par process
+  - 'filesystem' : fichiers dans FRAGMENT_CACHE_DIR, partagés entre les workers
+  - 'null' : désactivé
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from app import metrics
+
+
+# ====== BACKENDS ======
+
+class MemoryBackend:
+    """LRU en mémoire (un par process)."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileSystemBackend:
+    """Un fichier par fragment, partagé entre les workers d'une même machine."""
+
+    # Nettoyage des fichiers les plus anciens toutes les N écritures
+    PRUNE_EVERY = 100
+
+    def __init__(self, directory, max_entries=2000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        # Écriture atomique : un autre worker ne lit jamais un fichier à moitié écrit
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(key))
+
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """Supprime les fragments les plus anciens au-delà de max_entries."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.tmp'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if not name.startswith('.tmp'))
+
+
+class NullBackend:
+    """Cache désactivé."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+# ====== CACHE ======
+
+class FragmentCache:
+    """Cache de fragments avec compteurs de hits / misses (par process)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(name, *args):
+        """Clé du fragment pour le propriétaire connecté, ou None si personne n'est connecté."""
+        if not current_user.is_authenticated:
+            return None
+        parts = [str(name), str(current_user.id), str(current_user.data_version or 0)]
+        parts.extend(str(arg) for arg in args)
+        return '|'.join(parts)
+
+    def get_or_render(self, key, render):
+        value = self.backend.get(key)
+        metrics.observe_cache('fragment', value is not None)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = render()
+        self.backend.set(key, value)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+def _create_backend(config):
+    name = config.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    max_entries = config.get('FRAGMENT_CACHE_MAX_ENTRIES', 512)
+    if name == 'filesystem':
+        return FileSystemBackend(config['FRAGMENT_CACHE_DIR'], max_entries=max_entries)
+    if name == 'null':
+        return NullBackend()
+    return MemoryBackend(max_entries=max_entries)
+
+
+def init_app(app):
+    """Installe le cache et le tag {% cache %} (à appeler avant la création de jinja_env)."""
+    app.extensions['fragment_cache'] = FragmentCache(_create_backend(app.config))
+    extensions = list(app.jinja_options.get('extensions', ()))
+    app.jinja_options = {**app.jinja_options,
+                         'extensions': extensions + [FragmentCacheExtension]}
+
+
+def get_cache():
+    return current_app.extensions['fragment_cache']
+
+
+# ====== TAG JINJA ======
+
+class FragmentCacheExtension(Extension):
+    """Tag {% cache 'nom', arg1, ... %} ... {% endcache %}."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', args), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, name, *args, caller):
+        key = FragmentCache.make_key(name, *args)
+        if key is None:
+            return caller()
+        return Markup(get_cache().get_or_render(key, lambda: str(caller())))
@@ -0,0 +1,86 @@
+"""
+Chargement paresseux des dépendances lourdes (WeasyPrint, openpyxl, dateutil).
+
+Ces modules ne sont importés qu'au premier besoin, pour que les workers
+gunicorn démarrent vite alors que la plupart des requêtes ne génèrent ni PDF
+ni Excel. `warm_up()` permet au contraire de tout précharger une seule fois
+dans le process maître (`gunicorn --preload`).
+"""
+import importlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = ('weasyprint', 'openpyxl', 'dateutil.relativedelta')
+
+_modules = {}
+_lock = threading.Lock()
+
+
+def load(module_name):
+    """
+    Importe un module au premier appel puis le garde en cache.
+
+    Args:
+        module_name: Nom complet du module (ex: 'weasyprint')
+
+    Returns:
+        module ou None si la dépendance n'est pas disponible
+    """
+    try:
+        return _modules[module_name]
+    except KeyError:
+        pass
+
+    with _lock:
+        if module_name not in _modules:
+            try:
+                _modules[module_name] = importlib.import_module(module_name)
+            except (ImportError, OSError) as e:
+                # WeasyPrint lève OSError si pango/cairo manquent sur le serveur
+                logger.warning("Module %s indisponible: %s", module_name, e)
+                _modules[module_name] = None
+    return _modules[module_name]
+
+
+def weasyprint_html():
+    """Retourne la classe `weasyprint.HTML`, ou None si WeasyPrint n'est pas installé."""
+    module = load('weasyprint')
+    return module.HTML if module is not None else None
+
+
+def relativedelta(*args, **kwargs):
+    """Façade vers `dateutil.relativedelta.relativedelta`."""
+    module = load('dateutil.relativedelta')
+    if module is None:
+        raise ImportError("python-dateutil n'est pas installé. Installez-le avec: pip install python-dateutil")
+    return module.relativedelta(*args, **kwargs)
+
+
+def warm_up(app):
+    """
+    Précharge les dépendances lourdes et compile tous les templates.
+
+    À appeler une fois dans le process maître avec `gunicorn --preload`
+    (variable WARMUP=1) : les workers forkés héritent alors des modules et
+    du cache de templates déjà prêts.
+
+    Args:
+        app: Application Flask
+
+    Returns:
+        dict: Disponibilité de chaque module lourd
+    """
+    status = {name: load(name) is not None for name in HEAVY_MODULES}
+
+    with app.app_context():
+        for template_name in app.jinja_env.list_templates():
+            try:
+                app.jinja_env.get_template(template_name)
+            except Exception as e:
+                logger.warning("Template %s non compilé: %s", template_name, e)
+
+    app.extensions['immogest_warm'] = True
+    logger.info("Warm-up terminé: %s", status)
+    return status
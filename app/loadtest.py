@@ -0,0 +1,279 @@
+"""
+Test de charge de bout en bout (`flask bench load`).
+
+La commande démarre gunicorn en local sur une base dédiée, remplie de
+propriétaires Premium fictifs (immeubles, appartements, locataires, historique
+de paiements). Des propriétaires virtuels, un par client simultané, enchaînent
+sans temps de pause des actions tirées au hasard selon WORKLOAD : tableau de
+bord, fiche d'immeuble, saisie de paiement (formulaire et jeton CSRF compris),
+téléchargement de quittance, export Excel et nouvelle connexion.
+
+Chaque réponse est comparée au statut attendu : une redirection vers la page
+de connexion ou un 503 de délestage comptent comme erreurs. Le rapport JSON
+(débit, p50/p95/p99 et taux d'erreur par route) est comparable d'un run à
+l'autre : à graine égale, chaque propriétaire virtuel tire la même séquence
+d'actions.
+
+Tout reste local : quittances par le moteur natif, relances manuelles,
+limitation de débit désactivée (tous les clients ont la même adresse). Les
+clients tournent dans le process de la commande : sur une petite machine, ils
+prennent une part du CPU mesuré.
+"""
+import http.cookiejar
+import random
+import re
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app import periods
+from app.blueprints.finances.receipts import ENGINE_NATIVE
+from app.extensions import db
+from app.models import Payment, Property, Tenant, Unit, User
+
+PASSWORD = 'charge-de-test'
+RENT = 150000
+
+# Action -> poids dans le mélange (chaque propriétaire virtuel commence par se connecter)
+WORKLOAD = {
+    'dashboard': 30,
+    'property': 25,
+    'payment': 15,
+    'receipt': 15,
+    'login': 10,
+    'export': 5,
+}
+
+# Paramètres qui doivent être identiques pour comparer deux rapports
+WORKLOAD_SETTINGS = ('owners', 'properties', 'units', 'months', 'concurrency', 'seed', 'sql_latency_ms')
+
+_CSRF_TOKEN = re.compile(rb'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+# ====== DONNÉES ======
+
+def seed(owners, properties=2, units=10, months=12):
+    """
+    Crée les propriétaires du test (Premium, moteur de quittance natif) et leur parc.
+
+    Les emails portent un identifiant de run : plusieurs runs peuvent partager une base.
+    Domaine example.com : le formulaire de connexion refuse les domaines réservés (.invalid).
+
+    Returns:
+        list: Par propriétaire, email et id des immeubles, locataires et derniers paiements
+    """
+    run_id = uuid.uuid4().hex[:8]
+    db.create_all()
+    current = periods.current_index()
+    accounts = []
+    for i in range(owners):
+        owner = User(email=f"load-{run_id}-{i}@example.com", plan='premium',
+                     subscription_end=datetime.utcnow() + timedelta(days=30), receipt_engine=ENGINE_NATIVE)
+        owner.set_password(PASSWORD)
+        buildings = [Property(name=f"Immeuble {p + 1}", address="Dakar", owner=owner) for p in range(properties)]
+        tenants = [Tenant(unit=Unit(property=building, door_number=str(u + 1), rent_amount=RENT),
+                          full_name=f"Locataire {p + 1}-{u + 1}", phone='770000000')
+                   for p, building in enumerate(buildings) for u in range(units)]
+        db.session.add_all([owner, *buildings, *tenants])
+        db.session.commit()
+
+        # Historique en Core : assez de lignes pour le tableau de bord et l'export
+        history = [(tenant.id, index) for index in range(current - months, current) for tenant in tenants]
+        db.session.execute(Payment.__table__.insert(), [
+            {'tenant_id': tenant_id, 'owner_id': owner.id, 'amount': RENT, 'period': periods.from_index(index),
+             'period_index': index, 'date_paid': datetime.strptime(periods.from_index(index), '%Y-%m'),
+             'receipt_token': str(uuid.uuid4()), 'receipt_number': number}
+            for number, (tenant_id, index) in enumerate(history, start=1)])
+        db.session.execute(User.__table__.update().where(User.__table__.c.id == owner.id)
+                           .values(receipt_seq=len(history)))
+        db.session.commit()
+
+        payment_ids = db.session.scalars(db.select(Payment.id).where(Payment.owner_id == owner.id)
+                                         .order_by(Payment.id.desc()).limit(50)).all()
+        accounts.append({'email': owner.email, 'properties': [building.id for building in buildings],
+                         'tenants': [tenant.id for tenant in tenants], 'payments': payment_ids})
+    return accounts
+
+
+# ====== CLIENTS ======
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Les redirections remontent en HTTPError : leur cible fait partie du contrôle."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class VirtualOwner:
+    """Un propriétaire connecté (ses propres cookies) qui chronomètre chacune de ses requêtes."""
+
+    def __init__(self, base_url, account, rng, records):
+        self.base_url = base_url
+        self.account = account
+        self.rng = rng
+        self.records = records
+        self.opener = None
+
+    def request(self, route, path, data=None, expect=200, redirect_to=None):
+        """
+        Requête chronométrée, enregistrée sous `route`.
+
+        Returns:
+            tuple: (statut, en-tête Location, corps) ; statut 0 si la connexion a échoué
+        """
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        start = time.perf_counter()
+        location = None
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=120) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, location, content = e.code, e.headers.get('Location'), e.read()
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            status, content = 0, b''
+        finished = time.perf_counter()
+        ok = status == expect and (redirect_to is None or redirect_to in (location or ''))
+        self.records.append((finished, route, finished - start, status, ok))
+        return status, location, content
+
+    def _csrf(self, page):
+        match = _CSRF_TOKEN.search(page)
+        return match.group(1).decode() if match else ''
+
+    def login(self):
+        # Nouvelle session de navigateur : cookies vides
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+        _, _, page = self.request('GET /auth/login', '/auth/login')
+        self.request('POST /auth/login', '/auth/login', {
+            'csrf_token': self._csrf(page), 'email': self.account['email'], 'password': PASSWORD}, expect=302)
+
+    def dashboard(self):
+        self.request('GET /', '/')
+
+    def property(self):
+        self.request('GET /properties/<id>', f"/properties/{self.rng.choice(self.account['properties'])}")
+
+    def payment(self):
+        tenant_id = self.rng.choice(self.account['tenants'])
+        _, _, page = self.request('GET /finances/pay/<id>', f'/finances/pay/{tenant_id}')
+        period = periods.from_index(periods.current_index() - self.rng.randrange(6))
+        status, location, _ = self.request('POST /finances/pay/<id>', f'/finances/pay/{tenant_id}', {
+            'csrf_token': self._csrf(page), 'amount': RENT, 'period': period},
+            expect=302, redirect_to='/finances/success/')
+        if status == 302 and location and '/finances/success/' in location:
+            path = urllib.parse.urlsplit(location).path
+            self.request('GET /finances/success/<id>', path)
+            self.account['payments'].append(int(path.rsplit('/', 1)[1]))
+
+    def receipt(self):
+        payment_id = self.rng.choice(self.account['payments'])
+        self.request('GET /finances/receipt/download/<id>', f'/finances/receipt/download/{payment_id}')
+
+    def export(self):
+        self.request('GET /finances/export/excel', '/finances/export/excel')
+
+
+def run(base_url, accounts, concurrency, duration, warmup=0, seed=0):
+    """
+    Lance `concurrency` propriétaires virtuels pendant warmup + duration secondes.
+
+    Returns:
+        dict: Rapport (voir summarize), sur la seule fenêtre de mesure
+    """
+    records = []
+    actions, weights = list(WORKLOAD), list(WORKLOAD.values())
+    started = time.perf_counter()
+    deadline = started + warmup + duration
+
+    def drive(i):
+        # Copie du compte : les paiements créés restent propres à ce client
+        account = dict(accounts[i % len(accounts)])
+        account['payments'] = list(account['payments'])
+        owner = VirtualOwner(base_url, account, random.Random(seed * 10007 + i), records)
+        owner.login()
+        while time.perf_counter() < deadline:
+            getattr(owner, owner.rng.choices(actions, weights)[0])()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(drive, range(concurrency)))
+    measured_from = started + warmup
+    return summarize([record for record in records if record[0] >= measured_from],
+                     time.perf_counter() - measured_from)
+
+
+# ====== RAPPORT ======
+
+def _quantiles(latencies):
+    if len(latencies) < 2:
+        return [latencies[0] if latencies else 0.0] * 99
+    return statistics.quantiles(latencies, n=100, method='inclusive')
+
+
+def summarize(records, elapsed):
+    """
+    Débit, latences et erreurs, au total et par route.
+
+    Args:
+        records: Tuples (fin, route, secondes, statut, succès)
+        elapsed: Durée de la fenêtre de mesure (secondes)
+    """
+    by_route = {}
+    for _, route, seconds, status, ok in records:
+        by_route.setdefault(route, []).append((seconds, status, ok))
+
+    def stats(samples):
+        latencies = [seconds for seconds, _, _ in samples]
+        quantiles = _quantiles(latencies)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        statuses = {}
+        for _, status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'requests': len(samples),
+            'throughput': len(samples) / elapsed if elapsed else 0.0,
+            'p50_ms': quantiles[49] * 1000,
+            'p95_ms': quantiles[94] * 1000,
+            'p99_ms': quantiles[98] * 1000,
+            'max_ms': max(latencies, default=0.0) * 1000,
+            'errors': errors,
+            'error_rate': errors / len(samples) if samples else 0.0,
+            'statuses': statuses,
+        }
+
+    report = {'elapsed': elapsed, **stats([sample for samples in by_route.values() for sample in samples])}
+    report['routes'] = {route: stats(samples) for route, samples in sorted(by_route.items())}
+    return report
+
+
+def compare(report, baseline, max_regression=0.2, min_requests=50):
+    """
+    Régressions du rapport par rapport à une référence.
+
+    Une route régresse si son p95 dépasse celui de la référence de plus de
+    `max_regression` (fraction) ou si son taux d'erreur augmente de plus d'un
+    point ; le débit total régresse s'il baisse de plus de `max_regression`.
+    Le p95 des routes de moins de `min_requests` requêtes (trop bruité) n'est
+    pas comparé.
+
+    Returns:
+        list: Messages, vide si aucune régression
+    """
+    regressions = []
+    if report['throughput'] < baseline['throughput'] * (1 - max_regression):
+        regressions.append(f"débit total : {baseline['throughput']:.1f} -> {report['throughput']:.1f} req/s")
+    for route, current in report['routes'].items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+        sampled = min(current['requests'], before['requests']) >= min_requests
+        if sampled and current['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{route} p95 : {before['p95_ms']:.0f} -> {current['p95_ms']:.0f} ms")
+        if current['error_rate'] > before['error_rate'] + 0.01:
+            regressions.append(f"{route} erreurs : {before['error_rate']:.1%} -> {current['error_rate']:.1%}")
+    return regressions
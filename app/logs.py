@@ -0,0 +1,204 @@
+"""
+Journalisation structurée et non bloquante.
+
+Les loggers de l'application ne font qu'empiler l'enregistrement dans une file
+(`QueueHandler`) ; un thread (`QueueListener`) le formate en JSON et l'écrit sur
+stderr. La requête HTTP ne paie ni le formatage ni l'écriture.
+
+Chaque ligne porte l'identifiant de requête (en-tête X-Request-ID, renvoyé au
+client), l'utilisateur, la route et, pour `app.access`, la durée. Les champs
+passés par `extra={...}` sont ajoutés tels quels.
+
+Configuration :
+  - LOG_LEVELS : niveau par logger ({'app': 'INFO', 'app.search': 'DEBUG'}) ;
+  - LOG_SAMPLING : fraction conservée des messages INFO / DEBUG d'un logger
+    ({'app.access': 0.1}) ; avertissements et erreurs sont toujours gardés ;
+  - LOG_FORMAT : 'json' (défaut) ou 'text' en développement.
+
+Utiliser le formatage paresseux (`logger.info("Paiement %s", payment.id)`) :
+un niveau désactivé ne coûte alors qu'une comparaison.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+# Attributs standard d'un LogRecord : tout le reste vient de `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+_CONTEXT_ATTRS = ('request_id', 'user_id', 'route')
+_SCALARS = (str, int, float, bool, type(None))
+
+_handler = None
+_listener = None
+
+
+class RequestContextFilter(logging.Filter):
+    """Ajoute request_id, user_id et route, lus dans le thread de la requête."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.route = request.endpoint
+            # Utilisateur déjà chargé par Flask-Login : jamais de requête SQL depuis un log
+            user = g.get('_login_user')
+            if user is not None and user.is_authenticated:
+                record.user_id = user.id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Ne garde qu'une fraction des messages INFO / DEBUG des loggers configurés."""
+
+    def __init__(self, rates):
+        super().__init__()
+        # Préfixe le plus long d'abord : 'app.access.pdf' avant 'app.access'
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        for name, rate in self.rates:
+            if record.name == name or record.name.startswith(name + '.'):
+                return rate >= 1 or random.random() < rate
+        return True
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    QueueHandler qui ne formate pas dans le thread appelant.
+
+    Le message et la trace sont rendus par le thread d'écriture ; seuls les
+    arguments non scalaires (objets ORM, formulaires...) sont convertis en texte
+    ici, pour ne pas les lire depuis un autre thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.args, tuple):
+            record.args = tuple(arg if isinstance(arg, _SCALARS) else str(arg) for arg in record.args)
+        elif isinstance(record.args, dict):
+            record.args = {key: value if isinstance(value, _SCALARS) else str(value)
+                           for key, value in record.args.items()}
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for name in _CONTEXT_ATTRS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and name not in _CONTEXT_ATTRS and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exc'] = ''.join(traceback.format_exception(*record.exc_info))
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Format lisible pour le développement, avec l'identifiant de requête."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = '-'
+        return super().format(record)
+
+
+def _start_listener(handler, formatter):
+    global _listener
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+    _listener = QueueListener(handler.queue, output, respect_handler_level=False)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # Le thread d'écriture ne survit pas au fork (gunicorn --preload) : nouvelle file, nouveau thread
+    if _handler is not None and _listener is not None:
+        formatter = _listener.handlers[0].formatter
+        _handler.queue = queue.SimpleQueue()
+        _start_listener(_handler, formatter)
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def configure(config):
+    """
+    Installe la file de journalisation sur le logger racine (une fois par process).
+    """
+    global _handler
+
+    for name, level in config.get('LOG_LEVELS', {}).items():
+        logging.getLogger(None if name == 'root' else name).setLevel(level.upper())
+    if _handler is not None:
+        return
+
+    formatter = TextFormatter() if config.get('LOG_FORMAT') == 'text' else JsonFormatter()
+    _handler = AsyncQueueHandler(queue.SimpleQueue())
+    _handler.addFilter(SamplingFilter(config.get('LOG_SAMPLING', {})))
+    _handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    _start_listener(_handler, formatter)
+
+    atexit.register(_stop_listener)
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def init_app(app):
+    """Journalisation en file et journal d'accès (`app.access`) avec identifiant de requête."""
+    if not app.config.get('LOG_QUEUE', True):
+        return
+    configure(app.config)
+    access_logger = logging.getLogger('app.access')
+    slow_ms = app.config.get('LOG_SLOW_REQUEST_MS', 1000)
+
+    @app.before_request
+    def _start_request_log():
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+        g.log_started_at = time.perf_counter()
+
+    @app.after_request
+    def _log_request(response):
+        started_at = g.pop('log_started_at', None)
+        if started_at is None:
+            return response
+        duration_ms = round((time.perf_counter() - started_at) * 1000, 1)
+        # Les requêtes lentes échappent à l'échantillonnage (niveau WARNING)
+        level = logging.WARNING if duration_ms >= slow_ms else logging.INFO
+        access_logger.log(level, "%s %s %s", request.method, request.path, response.status_code,
+                          extra={'method': request.method, 'status': response.status_code,
+                                 'duration_ms': duration_ms})
+        response.headers['X-Request-ID'] = g.request_id
+        return response
@@ -0,0 +1,188 @@
+"""
+Métriques Prometheus (`/metrics`), agrégées entre les workers gunicorn.
+
+Avec gunicorn, gunicorn.conf.py fixe PROMETHEUS_MULTIPROC_DIR avant le
+chargement de l'application : chaque worker écrit ses compteurs dans des
+fichiers mmap de ce dossier, et `/metrics` (servi par n'importe quel worker)
+les additionne. Sans cette variable (flask run), le registre du process suffit.
+
+Les points de mesure ne coûtent qu'un incrément en mémoire partagée :
+  - latence et nombre de requêtes par endpoint, requêtes SQL par requête HTTP
+  - connexions du pool SQLAlchemy en cours d'utilisation
+  - durée et taille des quittances PDF, lignes et durée des exports Excel
+  - hits / misses du cache de fragments et de l'archive de quittances
+  - abonnements actifs par plan (calculé à chaque collecte, une requête GROUP BY)
+
+prometheus_client est optionnel : absent, les mesures sont ignorées et
+`/metrics` répond 404.
+"""
+import hmac
+import os
+import time
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from app import lazy
+
+# Seaux de latence (secondes) : pages rapides jusqu'aux PDF et exports lents
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (5_000, 20_000, 50_000, 100_000, 250_000, 500_000, 1_000_000)
+ROWS_BUCKETS = (10, 100, 500, 1_000, 5_000, 10_000, 50_000)
+
+_metrics = None
+
+
+def _create_metrics(prometheus):
+    Counter, Gauge, Histogram = prometheus.Counter, prometheus.Gauge, prometheus.Histogram
+    return {
+        'requests': Counter('immogest_http_requests_total', "Requêtes HTTP",
+                            ['endpoint', 'method', 'status']),
+        'latency': Histogram('immogest_http_request_duration_seconds', "Durée des requêtes HTTP",
+                             ['endpoint', 'method'], buckets=LATENCY_BUCKETS),
+        'queries': Histogram('immogest_db_queries_per_request', "Requêtes SQL par requête HTTP",
+                             ['endpoint'], buckets=QUERY_BUCKETS),
+        'pool_checked_out': Gauge('immogest_db_pool_checked_out', "Connexions du pool en cours d'utilisation",
+                                  multiprocess_mode='livesum'),
+        'pdf_seconds': Histogram('immogest_pdf_render_seconds', "Durée de génération des quittances PDF",
+                                 ['engine'], buckets=LATENCY_BUCKETS),
+        'pdf_bytes': Histogram('immogest_pdf_render_bytes', "Taille des quittances PDF générées",
+                               ['engine'], buckets=BYTES_BUCKETS),
+        'export_seconds': Histogram('immogest_excel_export_seconds', "Durée des exports Excel",
+                                    buckets=LATENCY_BUCKETS),
+        'export_rows': Histogram('immogest_excel_export_rows', "Lignes par export Excel",
+                                 buckets=ROWS_BUCKETS),
+        'cache': Counter('immogest_cache_requests_total', "Lectures de cache",
+                         ['cache', 'result']),
+    }
+
+
+class SubscriptionCollector:
+    """Abonnements par plan effectif, lus en base à chaque collecte."""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _family():
+        from prometheus_client.core import GaugeMetricFamily
+        return GaugeMetricFamily('immogest_subscriptions', "Comptes par plan effectif", labels=['plan'])
+
+    def describe(self):
+        # Évite une requête SQL à l'enregistrement (appelé avant db.init_app)
+        return [self._family()]
+
+    def collect(self):
+        from app.models import User
+
+        family = self._family()
+        with self.app.app_context():
+            for plan, count in sorted(User.count_by_plan().items()):
+                family.add_metric([plan], count)
+        yield family
+
+
+def enabled():
+    return _metrics is not None
+
+
+# ====== POINTS DE MESURE ======
+
+def observe_cache(cache, hit):
+    if _metrics is not None:
+        _metrics['cache'].labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def observe_pdf(engine, seconds, size):
+    if _metrics is not None:
+        _metrics['pdf_seconds'].labels(engine).observe(seconds)
+        _metrics['pdf_bytes'].labels(engine).observe(size)
+
+
+def observe_export(seconds, rows):
+    if _metrics is not None:
+        _metrics['export_seconds'].observe(seconds)
+        _metrics['export_rows'].observe(rows)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if _metrics is not None and has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+
+
+@event.listens_for(Pool, 'checkout')
+def _pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    if _metrics is not None:
+        _metrics['pool_checked_out'].inc()
+
+
+@event.listens_for(Pool, 'checkin')
+def _pool_checkin(dbapi_connection, connection_record):
+    if _metrics is not None:
+        _metrics['pool_checked_out'].dec()
+
+
+# ====== APPLICATION ======
+
+def _registry(prometheus, app):
+    """Registre de collecte : fichiers des workers (multiprocess) ou registre du process."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = prometheus.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus.REGISTRY
+    if app.config.get('METRICS_SUBSCRIPTIONS', True):
+        try:
+            registry.register(SubscriptionCollector(app))
+        except ValueError:
+            pass  # Déjà enregistré (plusieurs create_app dans le même process)
+    return registry
+
+
+def init_app(app):
+    """Installe les points de mesure des requêtes et la route /metrics."""
+    global _metrics
+
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    prometheus = lazy.load('prometheus_client')
+    if prometheus is None:
+        return
+
+    if _metrics is None:
+        _metrics = _create_metrics(prometheus)
+    registry = _registry(prometheus, app)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started_at = g.pop('metrics_started_at', None)
+        if started_at is None:
+            return response
+        # Endpoint Flask (jamais l'URL brute) : nombre de séries borné
+        endpoint = request.endpoint or 'unmatched'
+        _metrics['latency'].labels(endpoint, request.method).observe(time.perf_counter() - started_at)
+        _metrics['requests'].labels(endpoint, request.method, str(response.status_code)).inc()
+        _metrics['queries'].labels(endpoint).observe(g.pop('db_queries', 0))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        token = current_app.config.get('METRICS_TOKEN')
+        if not token:
+            # Sans jeton, la route n'existe qu'en développement
+            if not current_app.debug:
+                abort(404)
+        else:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not hmac.compare_digest(supplied, token):
+                abort(401)
+        return Response(prometheus.generate_latest(registry), mimetype=prometheus.CONTENT_TYPE_LATEST)
@@ -1,8 +1,30 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import sqlite3
 import uuid
+from itertools import chain
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, object_session, validates
+from app import periods
 from app.extensions import db, login_manager
+from app.passwords import hash_password, needs_rehash, verify_password
+
+# Plans payants (soumis à subscription_end) et fonctionnalités par plan
+PAID_PLANS = ('standard', 'premium')
+
+PLAN_FEATURES = {
+    'free': ['basic_stats', 'pdf_receipts', 'tenant_management'],
+    'standard': ['basic_stats', 'pdf_receipts', 'tenant_management',
+                'advanced_stats', 'multi_properties', 'whatsapp_support'],
+    'premium': ['basic_stats', 'pdf_receipts', 'tenant_management',
+               'advanced_stats', 'multi_properties', 'whatsapp_support',
+               'auto_whatsapp', 'payment_reminders', 'export_excel',
+               'analytics_dashboard', 'custom_branding', 'multi_users',
+               'priority_support']
+}
+
 
 # 1. Gestionnaire de chargement utilisateur pour Flask-Login
 @login_manager.user_loader
@@ -31,27 +53,80 @@ class User(UserMixin, db.Model):
     logo_filename = db.Column(db.String(255), nullable=True)
     brand_color = db.Column(db.String(7), default='#4F46E5') # Couleur par défaut (Indigo)
 
+    # Moteur de génération des quittances : 'weasyprint' (HTML/CSS) ou 'native' (pydyf, rapide)
+    receipt_engine = db.Column(db.String(20), default='weasyprint')
+
+    # Version des données du propriétaire : incrémentée à chaque écriture (clé du cache de fragments)
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Synchronisation hors ligne (voir app/sync.py) : dernier numéro de changement attribué,
+    # et plus petit curseur encore valide (tombstones plus anciens purgés)
+    sync_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    sync_floor = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+
+    # Dernier numéro de quittance attribué (voir _assign_receipt_number)
+    receipt_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     def get_total_units(self):
         """Retourne le nombre total d'appartements possédés"""
-        count = 0
-        for prop in self.properties:
-            count += prop.units.count()
-        return count
+        return Unit.owned_by(self).count()
     
+    @hybrid_property
+    def effective_plan(self):
+        """
+        Plan réellement applicable : un plan payant dont `subscription_end` est
+        passé vaut 'free'. Utilisable aussi en SQL (User.effective_plan == 'premium').
+        """
+        if self.plan in PAID_PLANS and self.subscription_end and datetime.utcnow() > self.subscription_end:
+            return 'free'
+        return self.plan or 'free'
+
+    @effective_plan.expression
+    def effective_plan(cls):
+        expired = db.and_(cls.plan.in_(PAID_PLANS),
+                          cls.subscription_end.isnot(None),
+                          cls.subscription_end < datetime.utcnow())
+        return db.case((expired, 'free'), else_=db.func.coalesce(cls.plan, 'free'))
+
+    @classmethod
+    def count_by_plan(cls):
+        """
+        Nombre de comptes par plan effectif, calculé en base (un abonnement expiré compte en 'free').
+
+        Returns:
+            dict: {plan: nombre}
+        """
+        # Sous-requête : PostgreSQL refuse un GROUP BY sur un CASE dont les paramètres diffèrent du SELECT
+        plans = db.session.query(cls.effective_plan.label('plan')).subquery()
+        return dict(db.session.query(plans.c.plan, db.func.count()).group_by(plans.c.plan).all())
+
+    @classmethod
+    def expire_subscriptions(cls, now=None):
+        """
+        Repasse en 'free' tous les abonnements payants expirés, en un seul UPDATE
+        (commande planifiée `flask subscriptions expire`).
+
+        Returns:
+            int: Nombre de comptes rétrogradés
+        """
+        now = now or datetime.utcnow()
+        users = cls.__table__
+        result = db.session.execute(
+            users.update()
+            .where(users.c.plan.in_(PAID_PLANS), users.c.subscription_end < now)
+            .values(plan='free', data_version=db.func.coalesce(users.c.data_version, 0) + 1))
+        db.session.commit()
+        return result.rowcount
+
     def get_unit_limit(self):
         """Retourne la limite d'appartements selon le plan actif"""
-        # Vérifier si l'abonnement est expiré
-        if self.plan in ['standard', 'premium'] and self.subscription_end:
-            if datetime.utcnow() > self.subscription_end:
-                return 2  # Retour au plan Free si expiré
-        
         # Limites par plan
         limits = {
             'free': 2,
             'standard': 10,
             'premium': float('inf')  # Illimité
         }
-        return limits.get(self.plan, 2)
+        return limits.get(self.effective_plan, 2)
     
     def can_add_unit(self):
         """Vérifie si l'utilisateur peut ajouter un appartement"""
@@ -62,50 +137,32 @@ class User(UserMixin, db.Model):
     
     def can_add_property(self):
         """Vérifie si l'utilisateur peut ajouter un immeuble (Free = 1 seul immeuble)"""
-        # Vérifier si l'abonnement est expiré
-        if self.plan in ['standard', 'premium'] and self.subscription_end:
-            if datetime.utcnow() > self.subscription_end:
-                return self.properties.count() < 1  # Free = 1 immeuble max
-        
-        if self.plan == 'free':
+        if self.effective_plan == 'free':
             return self.properties.count() < 1
         return True  # Standard et Premium = illimité
     
     def has_feature(self, feature_name):
         """Vérifie si une fonctionnalité est disponible pour le plan de l'utilisateur"""
-        # Vérifier si l'abonnement est expiré pour les plans payants
-        active_plan = self.plan
-        if self.plan in ['standard', 'premium'] and self.subscription_end:
-            if datetime.utcnow() > self.subscription_end:
-                active_plan = 'free'  # Retour au plan Free
-        
-        # Définition des fonctionnalités par plan
-        features = {
-            'free': ['basic_stats', 'pdf_receipts', 'tenant_management'],
-            'standard': ['basic_stats', 'pdf_receipts', 'tenant_management', 
-                        'advanced_stats', 'multi_properties', 'whatsapp_support'],
-            'premium': ['basic_stats', 'pdf_receipts', 'tenant_management',
-                       'advanced_stats', 'multi_properties', 'whatsapp_support',
-                       'auto_whatsapp', 'payment_reminders', 'export_excel',
-                       'analytics_dashboard', 'custom_branding', 'multi_users',
-                       'priority_support']
-        }
-        
-        plan_features = features.get(active_plan, [])
-        return feature_name in plan_features
+        return feature_name in PLAN_FEATURES.get(self.effective_plan, [])
 
     @property
     def is_subscription_active(self):
         """Petite aide pour l'affichage dans le template"""
         if self.plan == 'free': return True # Le plan gratuit est toujours actif
-        if not self.subscription_end: return False
-        return datetime.utcnow() < self.subscription_end
+        return self.subscription_end is not None and self.effective_plan != 'free'
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    def rehash_password_if_needed(self, password):
+        """Recalcule le hash avec les paramètres courants (mot de passe déjà vérifié)."""
+        if needs_rehash(self.password_hash):
+            self.set_password(password)
+            return True
+        return False
 
     def __repr__(self):
         return f'<User {self.email}>'
@@ -118,8 +175,55 @@ class User(UserMixin, db.Model):
         return 'Gratuit (Découverte)'
 
 
+# 2bis. Accès restreint au propriétaire (une seule requête indexée)
+class OwnedMixin:
+    """
+    Modèles portant un `owner_id` : l'autorisation et la recherche se font en
+    une requête `WHERE id = ? AND owner_id = ?` au lieu de remonter
+    tenant.unit.property.owner en Python.
+    """
+
+    @classmethod
+    def owned_by(cls, owner):
+        """Requête limitée aux lignes du propriétaire."""
+        owner_id = owner if isinstance(owner, int) else owner.id
+        return cls.query.filter(cls.owner_id == owner_id)
+
+    @classmethod
+    def get_owned_or_404(cls, object_id, owner):
+        """Charge un objet du propriétaire, 404 s'il n'existe pas ou appartient à un autre."""
+        return cls.owned_by(owner).filter(cls.id == object_id).first_or_404()
+
+    @classmethod
+    def accessible_by(cls, user, manage=False):
+        """
+        Requête limitée aux lignes du propriétaire et des immeubles partagés avec lui
+        par une équipe (voir app/access.py). `manage=True` : gestionnaire exigé.
+        """
+        from app.access import shared_property_ids
+        property_ids = shared_property_ids(user, manage=manage)
+        if not property_ids:
+            return cls.owned_by(user)
+        return cls.query.filter(db.or_(cls.owner_id == user.id, cls.in_properties(property_ids)))
+
+    @classmethod
+    def get_accessible_or_404(cls, object_id, user, manage=False):
+        """Comme get_owned_or_404, immeubles partagés compris."""
+        return cls.accessible_by(user, manage=manage).filter(cls.id == object_id).first_or_404()
+
+
+# 2ter. Suivi des changements pour la synchronisation hors ligne (maintenu par app/sync.py)
+class SyncedMixin:
+    """
+    `change_seq` : numéro de changement du propriétaire lors de la dernière écriture
+    de la ligne (croissant par propriétaire) ; `/sync?since=` lit les lignes au-delà.
+    """
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    change_seq = db.Column(db.BigInteger, nullable=True)
+
+
 # 3. Modèle Immeuble (Property)
-class Property(db.Model):
+class Property(OwnedMixin, SyncedMixin, db.Model):
     __tablename__ = 'properties'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -130,13 +234,19 @@ class Property(db.Model):
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
     # Relation : Un immeuble a plusieurs appartements
-    units = db.relationship('Unit', backref='property', lazy='dynamic', cascade="all, delete-orphan")
+    # CASCADE DELETE: fait par la base (ON DELETE CASCADE), sans charger la descendance
+    units = db.relationship('Unit', backref='property', lazy='dynamic', cascade="all, delete-orphan",
+                            passive_deletes=True)
+
+    @classmethod
+    def in_properties(cls, property_ids):
+        return cls.id.in_(property_ids)
 
     def __repr__(self):
         return f'<Property {self.name}>'
 
 # 4. Modèle Appartement (Unit)
-class Unit(db.Model):
+class Unit(OwnedMixin, SyncedMixin, db.Model):
     __tablename__ = 'units'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -144,22 +254,30 @@ class Unit(db.Model):
     rent_amount = db.Column(db.Float, nullable=False) # Montant du loyer en CFA
 
     # Clé étrangère vers l'immeuble
-    property_id = db.Column(db.Integer, db.ForeignKey('properties.id'), nullable=False)
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    # Propriétaire dénormalisé (maintenu automatiquement, voir _owner_listener)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
 
     # Relation : Un appartement peut avoir un historique de locataires
-    # CASCADE DELETE: quand on supprime un appartement, on supprime aussi ses locataires
-    tenants = db.relationship('Tenant', backref='unit', lazy='dynamic', cascade="all, delete-orphan")
+    # CASCADE DELETE: quand on supprime un appartement, on supprime aussi ses locataires (ON DELETE CASCADE)
+    tenants = db.relationship('Tenant', backref='unit', lazy='dynamic', cascade="all, delete-orphan",
+                              passive_deletes=True)
 
     @property
     def current_tenant(self):
         """Retourne le locataire actif (celui qui n'est pas parti)"""
         return self.tenants.filter_by(is_active=True).first()
 
+    @classmethod
+    def in_properties(cls, property_ids):
+        return cls.property_id.in_(property_ids)
+
     def __repr__(self):
         return f'<Unit {self.door_number} - {self.rent_amount} CFA>'
 
 # 5. Modèle Locataire (Tenant)
-class Tenant(db.Model):
+class Tenant(OwnedMixin, SyncedMixin, db.Model):
     __tablename__ = 'tenants'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -171,46 +289,551 @@ class Tenant(db.Model):
     entry_date = db.Column(db.Date, default=datetime.utcnow)
 
     # Clé étrangère vers l'appartement
-    unit_id = db.Column(db.Integer, db.ForeignKey('units.id'), nullable=False)
+    unit_id = db.Column(db.Integer, db.ForeignKey('units.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    # Propriétaire dénormalisé (maintenu automatiquement, voir _owner_listener)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
 
     # Relation : Un locataire effectue plusieurs paiements
-    # CASCADE DELETE: quand on supprime un locataire, on supprime aussi ses paiements
-    payments = db.relationship('Payment', backref='tenant', lazy='dynamic', cascade="all, delete-orphan")
+    # CASCADE DELETE: quand on supprime un locataire, on supprime aussi ses paiements (ON DELETE CASCADE)
+    payments = db.relationship('Payment', backref='tenant', lazy='dynamic', cascade="all, delete-orphan",
+                               passive_deletes=True)
+
+    @classmethod
+    def in_properties(cls, property_ids):
+        # Sous-requêtes indexées (units.property_id, tenants.unit_id)
+        return cls.unit_id.in_(db.select(Unit.id).where(Unit.in_properties(property_ids)))
 
     def __repr__(self):
         return f'<Tenant {self.full_name}>'
 
 
 # 6. Modèle Paiement (Payment)
-class Payment(db.Model):
+class Payment(OwnedMixin, SyncedMixin, db.Model):
     __tablename__ = 'payments'
 
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float, nullable=False)
     date_paid = db.Column(db.DateTime, default=datetime.utcnow)
     period = db.Column(db.String(7), nullable=False) # Format "YYYY-MM"
+    period_index = db.Column(db.Integer, nullable=True) # année * 12 + mois, maintenu avec period (voir app/periods.py)
     receipt_token = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
+    receipt_number = db.Column(db.Integer, nullable=True) # Séquentiel par propriétaire, sans trou (mention légale)
     
     # Nouveaux champs pour fonctionnalités Premium
     whatsapp_sent = db.Column(db.Boolean, default=False)  # Quittance envoyée via WhatsApp auto
     reminder_sent = db.Column(db.Boolean, default=False)  # Rappel envoyé
+    receipt_queued = db.Column(db.Boolean, default=False, index=True)  # Quittance à archiver par `flask receipts work`
 
     # Clé étrangère vers le locataire
-    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False)
-    
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id', ondelete='CASCADE'), nullable=False)
+
+    # Propriétaire dénormalisé (maintenu automatiquement, voir _owner_listener)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
+
+    # Index composites : pagination par clé de l'historique d'un locataire,
+    # requêtes par plage de mois (statistiques, relances, export)
+    __table_args__ = (
+        db.Index('ix_payments_tenant_date_paid_id', 'tenant_id', 'date_paid', 'id'),
+        db.Index('ix_payments_owner_period_index', 'owner_id', 'period_index'),
+        db.Index('ix_payments_tenant_period_index', 'tenant_id', 'period_index'),
+    )
+
+    # Distingue les lignes chaudes des lignes d'archive dans l'historique et l'export
+    archived = False
+
+    @validates('period')
+    def _sync_period_index(self, key, period):
+        # Une période mal formée est refusée avant d'atteindre la base
+        self.period_index = periods.to_index(period)
+        return period
+
+    @classmethod
+    def in_periods(cls, start=None, end=None):
+        """
+        Filtre sur une plage de mois, bornes incluses (index ou "YYYY-MM", None = ouverte).
+
+        Usage: Payment.query.filter(Payment.in_periods('2024-01', '2024-12'))
+        """
+        return periods.range_filter(cls.period_index, start, end)
+
+    @classmethod
+    def in_properties(cls, property_ids):
+        return cls.tenant_id.in_(db.select(Tenant.id).where(Tenant.in_properties(property_ids)))
+
+    @property
+    def receipt_label(self):
+        """Numéro de quittance affiché (ex: '000123'), None avant la reprise des anciens paiements."""
+        return f"{self.receipt_number:06d}" if self.receipt_number else None
+
     def is_overdue(self, days=5):
         """Détermine si un paiement est en retard (par défaut 5 jours après la période)"""
-        from dateutil.relativedelta import relativedelta
-        
-        # Convertir la période ("2023-11") en date
         try:
-            year, month = map(int, self.period.split('-'))
-            period_date = datetime(year, month, 1)
-            # Ajouter 1 mois + X jours de grâce
-            due_date = period_date + relativedelta(months=1, days=days)
-            return datetime.utcnow() > due_date
-        except:
+            index = self.period_index or periods.to_index(self.period)
+        except ValueError:
             return False
+        # Premier jour du mois suivant + X jours de grâce
+        due_date = datetime.combine(periods.first_day(index + 1), datetime.min.time()) + timedelta(days=days)
+        return datetime.utcnow() > due_date
 
     def __repr__(self):
         return f'<Payment {self.amount} CFA - {self.period}>'
+
+
+# 7. Campagne de relances (Premium)
+class ReminderCampaign(db.Model):
+    __tablename__ = 'reminder_campaigns'
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    period = db.Column(db.String(7), nullable=False) # Format "YYYY-MM"
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    total_jobs = db.Column(db.Integer, default=0)
+
+    # Relation : Une campagne génère plusieurs envois
+    jobs = db.relationship('ReminderJob', backref='campaign', lazy='dynamic', cascade="all, delete-orphan")
+
+    # Une seule campagne par propriétaire et par mois (relancer la complète)
+    __table_args__ = (db.UniqueConstraint('owner_id', 'period', name='uq_reminder_campaign_owner_period'),)
+
+    def __repr__(self):
+        return f'<ReminderCampaign {self.owner_id} - {self.period}>'
+
+
+# 8. File d'envoi WhatsApp (une ligne = un message à envoyer)
+class ReminderJob(db.Model):
+    __tablename__ = 'reminder_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('reminder_campaigns.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id', ondelete='CASCADE'), nullable=False)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payments.id', ondelete='CASCADE'), nullable=True,
+                           index=True) # Quittances uniquement
+
+    kind = db.Column(db.String(20), nullable=False, default='reminder') # 'reminder' ou 'receipt'
+    period = db.Column(db.String(7), nullable=False)
+    phone = db.Column(db.String(20), nullable=True)
+    message = db.Column(db.Text, nullable=False)
+    whatsapp_url = db.Column(db.Text, nullable=False)
+
+    # 'pending' -> 'processing' -> 'sent' / 'failed' ('manual' si envoyé à la main via wa.me)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.String(255), nullable=True)
+    claim_token = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    # CASCADE DELETE: supprimer un locataire ou un paiement supprime ses envois
+    tenant = db.relationship('Tenant', backref=db.backref('reminder_jobs', lazy='dynamic', cascade="all, delete-orphan",
+                                                          passive_deletes=True))
+    payment = db.relationship('Payment', backref=db.backref('reminder_jobs', lazy='dynamic', cascade="all, delete-orphan",
+                                                            passive_deletes=True))
+
+    __table_args__ = (
+        db.UniqueConstraint('tenant_id', 'period', 'kind', name='uq_reminder_job_tenant_period_kind'),
+        db.Index('ix_reminder_jobs_status_id', 'status', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<ReminderJob {self.kind} {self.tenant_id} - {self.period} ({self.status})>'
+
+
+# 9. Maintien du propriétaire dénormalisé (owner_id)
+# (classe, relation vers le parent, classe parent, clé étrangère), du parent vers l'enfant
+_OWNER_CHAIN = (
+    (Unit, 'property', Property, 'property_id'),
+    (Tenant, 'unit', Unit, 'unit_id'),
+    (Payment, 'tenant', Tenant, 'tenant_id'),
+)
+
+
+def _has_changed(obj, attribute):
+    return sa_inspect(obj).attrs[attribute].history.has_changes()
+
+
+def _resolve_owner_id(connection, target, relation, parent_cls, foreign_key):
+    """Propriétaire du parent : objet déjà chargé en mémoire, sinon lecture par clé étrangère."""
+    parent = target.__dict__.get(relation)
+    if parent is not None and parent.owner_id is not None:
+        return parent.owner_id
+    parent_id = getattr(target, foreign_key)
+    if parent_id is None:
+        return None
+    return connection.scalar(db.select(parent_cls.owner_id).where(parent_cls.id == parent_id))
+
+
+def _owner_listener(relation, parent_cls, foreign_key):
+    def set_owner_id(mapper, connection, target):
+        """Renseigne owner_id à l'insertion et lors d'un changement de parent."""
+        if sa_inspect(target).persistent and not _has_changed(target, foreign_key):
+            return
+        target.owner_id = _resolve_owner_id(connection, target, relation, parent_cls, foreign_key)
+    return set_owner_id
+
+
+# Le parent est toujours écrit avant l'enfant dans un flush : son owner_id est déjà connu
+for _model, _relation, _parent_cls, _foreign_key in _OWNER_CHAIN:
+    _listener = _owner_listener(_relation, _parent_cls, _foreign_key)
+    event.listen(_model, 'before_insert', _listener)
+    event.listen(_model, 'before_update', _listener)
+
+
+@event.listens_for(Session, 'after_flush')
+def _propagate_owner_ids(session, flush_context):
+    """Répercute un changement de propriétaire sur toute la descendance (UPDATE ensemblistes)."""
+    units, tenants, payments = Unit.__table__, Tenant.__table__, Payment.__table__
+    connection = session.connection()
+
+    for obj in session.dirty:
+        if not isinstance(obj, (Property, Unit, Tenant)) or not _has_changed(obj, 'owner_id'):
+            continue
+        owner_id = obj.owner_id
+        if isinstance(obj, Property):
+            connection.execute(units.update().where(units.c.property_id == obj.id).values(owner_id=owner_id))
+            tenant_filter = tenants.c.unit_id.in_(db.select(units.c.id).where(units.c.property_id == obj.id))
+        elif isinstance(obj, Unit):
+            tenant_filter = tenants.c.unit_id == obj.id
+        else:
+            tenant_filter = None
+
+        if tenant_filter is not None:
+            connection.execute(tenants.update().where(tenant_filter).values(owner_id=owner_id))
+            payment_filter = payments.c.tenant_id.in_(db.select(tenants.c.id).where(tenant_filter))
+        else:
+            payment_filter = payments.c.tenant_id == obj.id
+        connection.execute(payments.update().where(payment_filter).values(owner_id=owner_id))
+
+
+# 9bis. Version des données par propriétaire (clé du cache de fragments)
+_VERSIONED_MODELS = (Property, Unit, Tenant, Payment)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_data_versions(session, flush_context):
+    """
+    Incrémente `users.data_version` des propriétaires touchés par le flush
+    (ancien et nouveau propriétaire lors d'un transfert), en un seul UPDATE.
+    """
+    owner_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, _VERSIONED_MODELS):
+            state = sa_inspect(obj)
+            owner_ids.add(state.dict.get('owner_id'))
+            owner_ids.update(state.attrs['owner_id'].history.deleted)
+        elif isinstance(obj, User) and session.is_modified(obj):
+            owner_ids.add(obj.id)
+    owner_ids.discard(None)
+    if not owner_ids:
+        return
+
+    users = User.__table__
+    session.connection().execute(
+        users.update().where(users.c.id.in_(owner_ids))
+        .values(data_version=db.func.coalesce(users.c.data_version, 0) + 1))
+
+
+# 9ter. Lignes modifiées depuis un curseur de synchronisation, par propriétaire
+for _model in (Property, Unit, Tenant, Payment):
+    db.Index(f'ix_{_model.__tablename__}_owner_change_seq', _model.owner_id, _model.change_seq)
+
+
+# 9quater. Suppressions en cascade par la base (ON DELETE CASCADE, passive_deletes)
+# La descendance d'un immeuble, appartement ou locataire n'est jamais chargée : ses id
+# sont relevés juste avant le DELETE pour les traitements qui lisent session.deleted
+# (index de recherche, archives froides, fichiers de quittances).
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite n'applique les clés étrangères (et leurs cascades) que sur demande, par connexion
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def _empty_cascade():
+    return {'unit': set(), 'tenant': set(), 'receipt_tokens': []}
+
+
+@event.listens_for(Session, 'before_flush')
+def _reset_cascaded_deletes(session, flush_context, instances):
+    session.info['cascaded_deletes'] = _empty_cascade()
+
+
+def cascaded_deletes(session):
+    """Descendance supprimée par la base pendant le flush : {'unit': ids, 'tenant': ids, 'receipt_tokens': [...]}."""
+    return session.info.get('cascaded_deletes') or _empty_cascade()
+
+
+def _collect_descendants(mapper, connection, target):
+    units, tenants, payments = Unit.__table__, Tenant.__table__, Payment.__table__
+    collected = object_session(target).info.setdefault('cascaded_deletes', _empty_cascade())
+
+    if isinstance(target, Property):
+        collected['unit'].update(connection.scalars(db.select(units.c.id).where(units.c.property_id == target.id)))
+        tenant_filter = tenants.c.unit_id.in_(db.select(units.c.id).where(units.c.property_id == target.id))
+    elif isinstance(target, Unit):
+        tenant_filter = tenants.c.unit_id == target.id
+    else:
+        tenant_filter = None
+
+    if tenant_filter is not None:
+        collected['tenant'].update(connection.scalars(db.select(tenants.c.id).where(tenant_filter)))
+        payment_filter = payments.c.tenant_id.in_(db.select(tenants.c.id).where(tenant_filter))
+    else:
+        payment_filter = payments.c.tenant_id == target.id
+    collected['receipt_tokens'].extend(connection.scalars(
+        db.select(payments.c.receipt_token).where(payment_filter, payments.c.receipt_token.is_not(None))))
+    # Quittances émises : conservées au registre des annulations (voir 9quinquies)
+    void_receipts(connection, payments, payment_filter)
+
+
+for _model in (Property, Unit, Tenant):
+    event.listen(_model, 'before_delete', _collect_descendants)
+
+
+# 9quinquies. Numéro de quittance séquentiel par propriétaire
+# Le compteur `users.receipt_seq` est incrémenté dans la transaction de l'insertion ; un
+# rollback rend le numéro (pas de trou). Sous PostgreSQL le verrou de ligne ne retient que
+# les paiements du même propriétaire jusqu'au commit ; sous SQLite toutes les écritures
+# passent de toute façon l'une après l'autre. Enregistré après _owner_listener : owner_id est
+# connu. Pas de contrainte unique (owner_id, receipt_number) : un paiement transféré avec son
+# immeuble garde le numéro de la quittance émise par l'ancien propriétaire.
+# Une quittance émise n'est jamais perdue : un paiement numéroté supprimé (directement ou par
+# la cascade d'un immeuble, appartement ou locataire) est d'abord copié dans `voided_receipts`.
+@event.listens_for(Payment, 'before_insert')
+def _assign_receipt_number(mapper, connection, target):
+    if target.receipt_number is not None or target.owner_id is None:
+        return
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id == target.owner_id)
+                       .values(receipt_seq=users.c.receipt_seq + 1))
+    target.receipt_number = connection.scalar(db.select(users.c.receipt_seq).where(users.c.id == target.owner_id))
+
+
+def void_receipts(connection, table, where):
+    """Copie dans `voided_receipts` les paiements numérotés de `table` (chaude ou archive) avant suppression."""
+    columns = ('owner_id', 'tenant_id', 'receipt_number', 'receipt_token', 'amount', 'period', 'date_paid')
+    connection.execute(VoidedReceipt.__table__.insert().from_select(
+        ['payment_id', *columns, 'voided_at'],
+        db.select(table.c.id, *[table.c[name] for name in columns], db.literal(datetime.utcnow(), db.DateTime))
+        .where(where, table.c.receipt_number.is_not(None))))
+
+
+@event.listens_for(Payment, 'before_delete')
+def _void_deleted_payment(mapper, connection, target):
+    payments = Payment.__table__
+    void_receipts(connection, payments, payments.c.id == target.id)
+
+
+# 10. Index de recherche globale (une ligne par immeuble, appartement ou locataire)
+class SearchEntry(db.Model):
+    __tablename__ = 'search_entries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False) # 'property', 'unit' ou 'tenant'
+    object_id = db.Column(db.Integer, nullable=False)
+    property_id = db.Column(db.Integer, nullable=False) # Immeuble de rattachement (liens des résultats)
+
+    # Affichage des résultats
+    title = db.Column(db.String(200), nullable=False)
+    subtitle = db.Column(db.String(200), nullable=True)
+
+    # Texte normalisé (minuscules, sans accents, téléphone en chiffres), maintenu par app.search
+    content = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('kind', 'object_id', name='uq_search_entry_kind_object'),)
+
+    def __repr__(self):
+        return f'<SearchEntry {self.kind} {self.object_id}>'
+
+
+# 11. Archives froides (voir app/archival.py) : mêmes colonnes et mêmes id que les tables chaudes,
+# sans clé étrangère vers les parents (un appartement peut disparaître après l'archivage)
+class ArchivedTenant(db.Model):
+    __tablename__ = 'tenants_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    full_name = db.Column(db.String(100), nullable=False)
+    phone = db.Column(db.String(20), nullable=False)
+    email = db.Column(db.String(120), nullable=True)
+    is_active = db.Column(db.Boolean, default=False)
+    entry_date = db.Column(db.Date)
+    unit_id = db.Column(db.Integer, nullable=False, index=True)
+    owner_id = db.Column(db.Integer, nullable=True, index=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def unit(self):
+        """Appartement (rendu d'une quittance archivée)."""
+        return db.session.get(Unit, self.unit_id)
+
+    def __repr__(self):
+        return f'<ArchivedTenant {self.full_name}>'
+
+
+class ArchivedPayment(db.Model):
+    __tablename__ = 'payments_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    amount = db.Column(db.Float, nullable=False)
+    date_paid = db.Column(db.DateTime)
+    period = db.Column(db.String(7), nullable=False)
+    period_index = db.Column(db.Integer, nullable=True)
+    receipt_token = db.Column(db.String(36), unique=True)
+    receipt_number = db.Column(db.Integer, nullable=True)
+    whatsapp_sent = db.Column(db.Boolean, default=False)
+    reminder_sent = db.Column(db.Boolean, default=False)
+    receipt_queued = db.Column(db.Boolean, default=False, index=True)
+    tenant_id = db.Column(db.Integer, nullable=False)
+    owner_id = db.Column(db.Integer, nullable=True, index=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Historique d'un locataire (même pagination par clé que payments), export par période
+    __table_args__ = (
+        db.Index('ix_payments_archive_tenant_date_paid_id', 'tenant_id', 'date_paid', 'id'),
+        db.Index('ix_payments_archive_owner_period_index', 'owner_id', 'period_index'),
+    )
+
+    # Lignes d'archive affichées avec les paiements chauds (historique, export)
+    archived = True
+    receipt_label = Payment.receipt_label
+
+    @property
+    def tenant(self):
+        """Locataire, chaud ou archivé (rendu de la quittance au premier accès au lien public)."""
+        return db.session.get(Tenant, self.tenant_id) or db.session.get(ArchivedTenant, self.tenant_id)
+
+    @classmethod
+    def in_periods(cls, start=None, end=None):
+        """Même filtre de plage de mois que Payment.in_periods."""
+        return periods.range_filter(cls.period_index, start, end)
+
+    def __repr__(self):
+        return f'<ArchivedPayment {self.amount} CFA - {self.period}>'
+
+
+# 12. Fiabilité de paiement par locataire, recalculée chaque nuit (voir app/scoring.py)
+class TenantScore(db.Model):
+    __tablename__ = 'tenant_scores'
+
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id', ondelete='CASCADE'), primary_key=True,
+                          autoincrement=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    score = db.Column(db.SmallInteger, nullable=False)          # 0 (risqué) à 100 (fiable)
+    avg_days_late = db.Column(db.Float, nullable=False, default=0.0)
+    p90_days_late = db.Column(db.Float, nullable=False, default=0.0)
+    due_periods = db.Column(db.Integer, nullable=False, default=0)
+    missed_periods = db.Column(db.Integer, nullable=False, default=0)
+    missed_streak = db.Column(db.Integer, nullable=False, default=0)    # Mois impayés consécutifs jusqu'au mois dernier
+    longest_missed_streak = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # CASCADE DELETE: supprimer un locataire supprime son score
+    tenant = db.relationship('Tenant', backref=db.backref('score', uselist=False, cascade="all, delete-orphan",
+                                                          passive_deletes=True))
+
+    # Locataires d'un propriétaire du plus risqué au plus fiable
+    __table_args__ = (db.Index('ix_tenant_scores_owner_score', 'owner_id', 'score'),)
+
+    @classmethod
+    def for_tenants(cls, tenant_ids):
+        """Scores d'une liste de locataires (lecture par clé primaire), {tenant_id: TenantScore}."""
+        if not tenant_ids:
+            return {}
+        return {score.tenant_id: score for score in cls.query.filter(cls.tenant_id.in_(tenant_ids))}
+
+    @property
+    def level(self):
+        """'good', 'watch' ou 'risky' (couleur du badge)."""
+        if self.score >= 80:
+            return 'good'
+        return 'watch' if self.score >= 50 else 'risky'
+
+    def __repr__(self):
+        return f'<TenantScore {self.tenant_id}: {self.score}>'
+
+
+# 13. Suppressions à transmettre aux clients hors ligne (voir app/sync.py)
+class SyncTombstone(db.Model):
+    __tablename__ = 'sync_tombstones'
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False) # 'properties', 'units', 'tenants' ou 'payments'
+    object_id = db.Column(db.Integer, nullable=False)
+    change_seq = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (db.Index('ix_sync_tombstones_owner_change_seq', 'owner_id', 'change_seq'),)
+
+    def __repr__(self):
+        return f'<SyncTombstone {self.kind} {self.object_id}>'
+
+
+# 14. Équipe (Premium, multi_users) : gestionnaires et gardiens invités par un propriétaire
+class TeamMember(db.Model):
+    __tablename__ = 'team_members'
+
+    ROLES = {'manager': 'Gestionnaire', 'caretaker': 'Gardien'}
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    member_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # 'manager' : appartements, locataires et paiements ; 'caretaker' : consultation et encaissements
+    role = db.Column(db.String(20), nullable=False, default='caretaker')
+    all_properties = db.Column(db.Boolean, nullable=False, default=True) # Sinon : immeubles choisis
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    owner = db.relationship('User', foreign_keys=[owner_id])
+    member = db.relationship('User', foreign_keys=[member_id])
+
+    __table_args__ = (db.UniqueConstraint('owner_id', 'member_id', name='uq_team_member_owner_member'),)
+
+    @property
+    def role_label(self):
+        return self.ROLES.get(self.role, self.role)
+
+    def __repr__(self):
+        return f'<TeamMember {self.owner_id} -> {self.member_id} ({self.role})>'
+
+
+# 15. Index d'accès précalculé : une ligne par (membre, immeuble partagé), maintenu par app/access.py
+class PropertyAccess(db.Model):
+    __tablename__ = 'property_access'
+
+    member_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), primary_key=True,
+                            index=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    role = db.Column(db.String(20), nullable=False)
+
+    def __repr__(self):
+        return f'<PropertyAccess {self.member_id} -> {self.property_id} ({self.role})>'
+
+
+# 16. Registre des quittances annulées : un numéro émis reste justifiable après la suppression
+# du paiement (erreur de saisie, suppression d'un locataire, d'un appartement ou d'un immeuble)
+class VoidedReceipt(db.Model):
+    __tablename__ = 'voided_receipts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, nullable=False)
+    owner_id = db.Column(db.Integer, nullable=True)
+    tenant_id = db.Column(db.Integer, nullable=False)
+    receipt_number = db.Column(db.Integer, nullable=False)
+    receipt_token = db.Column(db.String(36), nullable=True)
+    amount = db.Column(db.Float, nullable=False)
+    period = db.Column(db.String(7), nullable=False)
+    date_paid = db.Column(db.DateTime)
+    voided_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_voided_receipts_owner_number', 'owner_id', 'receipt_number'),)
+
+    receipt_label = Payment.receipt_label
+
+    def __repr__(self):
+        return f'<VoidedReceipt {self.owner_id} N° {self.receipt_number}>'
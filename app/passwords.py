@@ -0,0 +1,101 @@
+"""
+Hachage des mots de passe, paramétrable par environnement.
+
+La méthode Werkzeug et son coût viennent de PASSWORD_HASH_METHOD, par exemple :
+  - 'scrypt:32768:8:1' (défaut Werkzeug : n, r, p ; mémoire = 128 * n * r octets)
+  - 'pbkdf2:sha256:600000' (algorithme, itérations)
+
+Un hash stocké avec d'autres paramètres reste vérifiable ; il est recalculé
+avec les paramètres courants à la connexion suivante (voir auth.login).
+`flask bench passwords` mesure le débit de connexions par worker.
+"""
+import hmac
+import time
+
+from flask import current_app, has_app_context
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+DEFAULT_SALT_LENGTH = 16
+
+
+def normalize_method(method):
+    """
+    Forme complète d'une méthode, telle que Werkzeug l'écrit en tête du hash
+    ('scrypt' -> 'scrypt:32768:8:1', 'pbkdf2' -> 'pbkdf2:sha256:<itérations>').
+
+    Raises:
+        ValueError: Méthode inconnue ou paramètres invalides
+    """
+    name, *args = (method or DEFAULT_METHOD).split(':')
+    if name == 'scrypt':
+        if not args:
+            args = ['32768', '8', '1']
+        if len(args) != 3:
+            raise ValueError("'scrypt' attend 3 paramètres (n:r:p).")
+        return 'scrypt:' + ':'.join(str(int(arg)) for arg in args)
+    if name == 'pbkdf2':
+        if len(args) > 2:
+            raise ValueError("'pbkdf2' attend 2 paramètres (algorithme:itérations).")
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"Méthode de hachage inconnue : {name!r}")
+
+
+def current_method():
+    """Méthode configurée pour l'application courante (forme complète)."""
+    method = current_app.config.get('PASSWORD_HASH_METHOD') if has_app_context() else None
+    return normalize_method(method)
+
+
+def _salt_length():
+    if has_app_context():
+        return current_app.config.get('PASSWORD_SALT_LENGTH', DEFAULT_SALT_LENGTH)
+    return DEFAULT_SALT_LENGTH
+
+
+def hash_password(password, method=None):
+    return generate_password_hash(password, method=method or current_method(), salt_length=_salt_length())
+
+
+def verify_password(password_hash, password):
+    if not password_hash:
+        return False
+    return check_password_hash(password_hash, password)
+
+
+def needs_rehash(password_hash, method=None):
+    """True si le hash n'a pas été calculé avec la méthode et le coût configurés."""
+    if not password_hash or '$' not in password_hash:
+        return False
+    stored_method = password_hash.split('$', 1)[0]
+    return not hmac.compare_digest(stored_method, method or current_method())
+
+
+def benchmark(method, seconds=1.0, password='mot-de-passe-de-test'):
+    """
+    Mesure le coût d'une vérification (= une connexion) avec `method`.
+
+    Returns:
+        dict: méthode, vérifications mesurées, durée médiane (s) et vérifications/s sur un cœur
+    """
+    method = normalize_method(method)
+    password_hash = hash_password(password, method=method)
+
+    samples = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline or len(samples) < 3:
+        start = time.perf_counter()
+        check_password_hash(password_hash, password)
+        samples.append(time.perf_counter() - start)
+
+    samples.sort()
+    median = samples[len(samples) // 2]
+    return {
+        'method': method,
+        'samples': len(samples),
+        'median': median,
+        'per_second': 1 / median if median else 0.0,
+        'hash': password_hash,
+    }
@@ -0,0 +1,81 @@
+"""
+Périodes de loyer : texte "YYYY-MM" et index mensuel entier.
+
+`Payment.period_index` = année * 12 + mois, maintenu avec `Payment.period`.
+Un mois suivant vaut index + 1 : fenêtres glissantes, trous et arriérés
+deviennent des comparaisons d'entiers servies par l'index.
+"""
+import re
+from datetime import date, datetime
+
+_PERIOD_PATTERN = re.compile(r'^(\d{4})-(\d{2})$')
+
+
+def to_index(period):
+    """
+    "2024-03" -> 24291.
+
+    Raises:
+        ValueError: Période mal formée
+    """
+    match = _PERIOD_PATTERN.match(period or '')
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f"Période invalide : {period!r} (format attendu YYYY-MM)")
+    return int(match.group(1)) * 12 + int(match.group(2))
+
+
+def from_index(index):
+    """24291 -> "2024-03"."""
+    year, month = divmod(index - 1, 12)
+    return f"{year}-{month + 1:02d}"
+
+
+def index_of(day):
+    """Index du mois d'une date."""
+    return day.year * 12 + day.month
+
+
+def current_index(today=None):
+    return index_of(today or datetime.now())
+
+
+def first_day(index):
+    """Premier jour du mois d'un index."""
+    year, month = divmod(index - 1, 12)
+    return date(year, month + 1, 1)
+
+
+def last_months(count, today=None):
+    """
+    Les `count` derniers index, du plus ancien au mois courant inclus.
+
+    Returns:
+        range: index croissants
+    """
+    end = current_index(today)
+    return range(end - count + 1, end + 1)
+
+
+def range_filter(index_column, start=None, end=None):
+    """
+    Filtre SQL sur une plage de mois, bornes incluses (index ou "YYYY-MM", None = ouverte).
+    """
+    from app.extensions import db
+    if isinstance(start, str):
+        start = to_index(start)
+    if isinstance(end, str):
+        end = to_index(end)
+    clauses = []
+    if start is not None:
+        clauses.append(index_column >= start)
+    if end is not None:
+        clauses.append(index_column <= end)
+    return db.and_(db.true(), *clauses)
+
+
+def sql_index(period_column):
+    """Expression SQL de l'index d'une colonne "YYYY-MM" (backfill en base)."""
+    from app.extensions import db
+    year = db.cast(db.func.substr(period_column, 1, 4), db.Integer)
+    month = db.cast(db.func.substr(period_column, 6, 2), db.Integer)
+    return year * 12 + month
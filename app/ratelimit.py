@@ -0,0 +1,244 @@
+"""
+Limitation de débit et délestage des routes coûteuses (PDF, export, tableau de bord).
+
+Deux mécanismes, partagés entre les workers gunicorn par un fichier SQLite
+local (RATE_LIMIT_DB), sans Redis :
+  - un seau à jetons par utilisateur et par route (`consume`, config RATE_LIMITS) ;
+    seau vide -> 429 immédiat ;
+  - un plafond global de tâches lourdes simultanées (`job_slot`, config
+    HEAVY_JOBS_MAX_CONCURRENT) ; plafond atteint -> 503 immédiat.
+
+Les deux réponses portent `Retry-After` : on refuse vite plutôt que de laisser
+la requête occuper un thread en file d'attente. Si le fichier d'état est
+indisponible, la requête passe (on ne bloque pas l'application pour un compteur).
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+# Une place non libérée (worker tué pendant un PDF) est récupérée après ce délai
+SLOT_TTL_SECONDS = 300
+
+# Les seaux inactifs depuis plus d'une heure sont purgés de temps en temps
+_BUCKET_TTL_SECONDS = 3600
+_PURGE_EVERY = 500
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS slots (id TEXT PRIMARY KEY, name TEXT NOT NULL, pid INTEGER NOT NULL, "
+    "acquired REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_slots_name ON slots (name)",
+)
+
+
+class RateLimitExceeded(Exception):
+    """Seau de l'utilisateur vide (429)."""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    """Plafond de tâches lourdes atteint (503)."""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+# ====== STOCKAGE PARTAGÉ ======
+
+_local = threading.local()
+_calls = 0
+
+
+def _connection():
+    """Connexion SQLite par thread, rouverte après un fork (workers gunicorn --preload)."""
+    path = current_app.config['RATE_LIMIT_DB']
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid() and _local.path == path:
+        return conn
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Attente courte sur le verrou : au pire on laisse passer la requête
+    conn = sqlite3.connect(path, timeout=0.5, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    _local.conn, _local.pid, _local.path = conn, os.getpid(), path
+    return conn
+
+
+@contextmanager
+def _transaction():
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        # COMMIT compris (verrou, disque) : une transaction restée ouverte ferait échouer
+        # tous les BEGIN suivants du thread, et la limitation serait coupée sans bruit
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            # Connexion inutilisable : rouverte au prochain appel
+            conn.close()
+            _local.conn = None
+        raise
+
+
+def enabled():
+    return current_app.config.get('RATE_LIMIT_ENABLED', True)
+
+
+def client_key():
+    """Identité limitée : l'utilisateur connecté, sinon l'adresse IP."""
+    if current_user.is_authenticated:
+        return f'user:{current_user.id}'
+    return f'ip:{request.remote_addr}'
+
+
+# ====== SEAUX À JETONS ======
+
+def consume(key, per_minute, burst, now=None):
+    """
+    Retire un jeton du seau `key` (rempli à `per_minute` jetons/minute, au plus `burst`).
+
+    Returns:
+        float: 0 si la requête passe, sinon secondes avant le prochain jeton
+    """
+    global _calls
+    now = time.time() if now is None else now
+    rate = per_minute / 60.0
+
+    with _transaction() as conn:
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / rate
+        conn.execute("INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                     "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                     (key, tokens, now))
+
+        _calls += 1
+        if _calls % _PURGE_EVERY == 0:
+            conn.execute("DELETE FROM buckets WHERE updated < ?", (now - _BUCKET_TTL_SECONDS,))
+    return retry_after
+
+
+def check_rate_limit(name):
+    """
+    Applique la limite `name` de RATE_LIMITS à la requête courante.
+
+    Raises:
+        RateLimitExceeded: Seau vide
+    """
+    if not enabled():
+        return
+    per_minute, burst = current_app.config['RATE_LIMITS'][name]
+    try:
+        retry_after = consume(f'{name}:{client_key()}', per_minute, burst)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Limitation de débit indisponible: %s", e)
+        return
+    if retry_after:
+        raise RateLimitExceeded(retry_after)
+
+
+# ====== PLAFOND DE TÂCHES LOURDES ======
+
+def _acquire_slot(name, limit, now):
+    with _transaction() as conn:
+        conn.execute("DELETE FROM slots WHERE name = ? AND acquired < ?", (name, now - SLOT_TTL_SECONDS))
+        (running,) = conn.execute("SELECT COUNT(*) FROM slots WHERE name = ?", (name,)).fetchone()
+        if running >= limit:
+            return None
+        slot_id = uuid.uuid4().hex
+        conn.execute("INSERT INTO slots (id, name, pid, acquired) VALUES (?, ?, ?, ?)",
+                     (slot_id, name, os.getpid(), now))
+        return slot_id
+
+
+def _release_slot(slot_id):
+    with _transaction() as conn:
+        conn.execute("DELETE FROM slots WHERE id = ?", (slot_id,))
+
+
+@contextmanager
+def job_slot(name='heavy'):
+    """
+    Réserve une place parmi les HEAVY_JOBS_MAX_CONCURRENT tâches lourdes de tous les workers.
+
+    Raises:
+        Overloaded: Toutes les places sont prises
+    """
+    slot_id = None
+    if enabled():
+        try:
+            slot_id = _acquire_slot(name, current_app.config['HEAVY_JOBS_MAX_CONCURRENT'], time.time())
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Plafond de tâches lourdes indisponible: %s", e)
+            slot_id = ''
+        if slot_id is None:
+            raise Overloaded(current_app.config['HEAVY_JOBS_RETRY_AFTER'])
+    try:
+        yield
+    finally:
+        if slot_id:
+            try:
+                _release_slot(slot_id)
+            except (sqlite3.Error, OSError) as e:
+                # La place expirera après SLOT_TTL_SECONDS
+                logger.warning("Libération de place impossible: %s", e)
+
+
+def stats():
+    """Tâches lourdes en cours et seaux actifs (pour /ready)."""
+    conn = _connection()
+    (running,) = conn.execute("SELECT COUNT(*) FROM slots").fetchone()
+    (buckets,) = conn.execute("SELECT COUNT(*) FROM buckets").fetchone()
+    return {'heavy_jobs_running': running,
+            'heavy_jobs_limit': current_app.config['HEAVY_JOBS_MAX_CONCURRENT'],
+            'buckets': buckets}
+
+
+# ====== RÉPONSES ======
+
+def _refusal(status, message, retry_after):
+    retry_after = max(1, math.ceil(retry_after))
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify(error=message, retry_after=retry_after)
+    else:
+        response = current_app.response_class(message, mimetype='text/plain')
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def init_app(app):
+    """Réponses rapides 429 / 503 avec Retry-After."""
+
+    @app.errorhandler(RateLimitExceeded)
+    def handle_rate_limited(e):
+        return _refusal(429, "Trop de requêtes : réessayez dans quelques instants.", e.retry_after)
+
+    @app.errorhandler(Overloaded)
+    def handle_overloaded(e):
+        return _refusal(503, "Serveur occupé : réessayez dans quelques instants.", e.retry_after)
@@ -0,0 +1,85 @@
+"""
+Routage des lectures vers une réplique (optionnelle).
+
+Quand DATABASE_REPLICA_URL est configurée, elle devient le bind 'replica'.
+Les routes marquées `@read_only` (tableau de bord, relances, export) lisent
+alors sur la réplique ; tout le reste, et toute écriture, va au primaire.
+
+Lecture de ses propres écritures : après une écriture, le navigateur reste
+collé au primaire pendant REPLICA_STICKY_SECONDS (horodatage dans la session
+Flask), le temps que la réplique rattrape son retard.
+"""
+import time
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session as BaseSession
+from sqlalchemy import event
+
+REPLICA_BIND_KEY = 'replica'
+_STICKY_SESSION_KEY = '_db_primary_until'
+
+
+def _replica_requested():
+    return has_request_context() and g.get('db_use_replica', False)
+
+
+class RoutingSession(BaseSession):
+    """Session Flask-SQLAlchemy qui envoie les lectures des routes @read_only à la réplique."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or self._flushing or not _replica_requested():
+            return engine
+        if clause is not None and getattr(clause, 'is_dml', False):
+            return engine
+
+        engines = self._db.engines
+        if REPLICA_BIND_KEY in engines and engine is engines.get(None):
+            return engines[REPLICA_BIND_KEY]
+        return engine
+
+
+def replica_available():
+    """True si une réplique est configurée pour l'application courante."""
+    return REPLICA_BIND_KEY in current_app.config.get('SQLALCHEMY_BINDS', {})
+
+
+def use_replica():
+    """Route les lectures de la requête courante vers la réplique, sauf fenêtre collante."""
+    if not replica_available():
+        return False
+    if session.get(_STICKY_SESSION_KEY, 0) > time.time():
+        return False
+    g.db_use_replica = True
+    return True
+
+
+def _mark_write():
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(db_session, flush_context):
+    _mark_write()
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _after_bulk_write(orm_execute_state):
+    # UPDATE / DELETE ensemblistes (query.update(), db.session.execute(update(...)))
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        _mark_write()
+
+
+def init_app(app):
+    """Déclare le bind 'replica' et la fenêtre de lecture sur le primaire après écriture."""
+    replica_uri = app.config.get('SQLALCHEMY_REPLICA_URI')
+    if replica_uri:
+        app.config['SQLALCHEMY_BINDS'] = {**app.config.get('SQLALCHEMY_BINDS', {}),
+                                          REPLICA_BIND_KEY: replica_uri}
+
+    @app.after_request
+    def stick_to_primary_after_write(response):
+        if g.get('db_wrote') and replica_available():
+            session[_STICKY_SESSION_KEY] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+        return response
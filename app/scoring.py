@@ -0,0 +1,138 @@
+"""
+Score de fiabilité de paiement des locataires (table `tenant_scores`).
+
+`flask data score-tenants`, à planifier chaque nuit, relit tout l'historique
+(paiements chauds et archivés) par lots de locataires et réécrit leurs scores,
+une transaction par lot. Les pages (relances, fiche locataire) lisent ensuite
+le score par clé primaire, sans rien recalculer.
+
+Pour chaque locataire, sur les mois dus (de l'entrée au mois dernier, ou au
+dernier mois payé pour un locataire parti) :
+  - retard moyen et p90 en jours après le jour d'échéance ;
+  - mois impayés, série d'impayés en cours et plus longue série.
+
+score = 100 x part des mois payés - retard moyen (1 point par jour, 30 au plus)
+        - 10 points par mois de la série d'impayés en cours, borné à [0, 100].
+"""
+import logging
+import math
+from datetime import datetime, timedelta
+
+from app import periods
+from app.extensions import db
+from app.models import ArchivedPayment, Payment, Tenant, TenantScore
+
+logger = logging.getLogger(__name__)
+
+MAX_DELAY_PENALTY = 30
+STREAK_PENALTY = 10
+
+
+def percentile(values, pct):
+    """Percentile par rang le plus proche d'une liste triée (0 si vide)."""
+    if not values:
+        return 0.0
+    return float(values[max(0, math.ceil(pct / 100 * len(values)) - 1)])
+
+
+def score_tenant(entry_date, is_active, history, current, due_day=1):
+    """
+    Indicateurs de fiabilité d'un locataire.
+
+    Args:
+        entry_date: Date d'entrée (ou None)
+        is_active: Locataire encore présent
+        history: Liste de (period_index, date_paid) de ses paiements
+        current: Index du mois courant (non compté : le loyer peut encore arriver)
+        due_day: Jour du mois à partir duquel un loyer est en retard
+
+    Returns:
+        dict: Colonnes de TenantScore, ou None si aucun mois n'est encore dû
+    """
+    paid_periods = {period_index for period_index, _ in history}
+    start = periods.index_of(entry_date) if entry_date else min(paid_periods, default=None)
+    end = current - 1 if is_active else max(paid_periods, default=None)
+    if start is None or end is None or end < start:
+        return None
+
+    delays = sorted(max(0, (date_paid.date() - periods.first_day(period_index)
+                            - timedelta(days=due_day - 1)).days)
+                    for period_index, date_paid in history
+                    if start <= period_index <= end and date_paid is not None)
+
+    due_periods = end - start + 1
+    longest_missed_streak = streak = 0
+    for period_index in range(start, end + 1):
+        streak = 0 if period_index in paid_periods else streak + 1
+        longest_missed_streak = max(longest_missed_streak, streak)
+    missed_streak = streak
+    missed_periods = sum(1 for period_index in range(start, end + 1) if period_index not in paid_periods)
+
+    avg_days_late = sum(delays) / len(delays) if delays else 0.0
+    score = (100 * (due_periods - missed_periods) / due_periods
+             - min(avg_days_late, MAX_DELAY_PENALTY)
+             - STREAK_PENALTY * missed_streak)
+    return {
+        'score': int(round(min(100, max(0, score)))),
+        'avg_days_late': round(avg_days_late, 1),
+        'p90_days_late': percentile(delays, 90),
+        'due_periods': due_periods,
+        'missed_periods': missed_periods,
+        'missed_streak': missed_streak,
+        'longest_missed_streak': longest_missed_streak,
+    }
+
+
+def _history_by_tenant(tenant_ids):
+    """Paiements chauds et archivés des locataires, {tenant_id: [(period_index, date_paid)]}."""
+    history = {tenant_id: [] for tenant_id in tenant_ids}
+    rows = db.session.execute(db.union_all(*[
+        db.select(model.tenant_id, model.period_index, model.date_paid).where(model.tenant_id.in_(tenant_ids))
+        for model in (Payment, ArchivedPayment)
+    ])).all()
+    for tenant_id, period_index, date_paid in rows:
+        if period_index is not None:
+            history[tenant_id].append((period_index, date_paid))
+    return history
+
+
+def compute_scores(batch_size=500, due_day=1, today=None):
+    """
+    Recalcule les scores de tous les locataires, par lots d'id croissants.
+
+    Returns:
+        int: Nombre de scores écrits
+    """
+    current = periods.current_index(today)
+    computed_at = datetime.utcnow()
+    scores = TenantScore.__table__
+    last_id, total = 0, 0
+    while True:
+        tenants = db.session.execute(
+            db.select(Tenant.id, Tenant.owner_id, Tenant.entry_date, Tenant.is_active)
+            .where(Tenant.id > last_id)
+            .order_by(Tenant.id)
+            .limit(batch_size)).all()
+        if not tenants:
+            break
+        last_id = tenants[-1].id
+
+        ids = [tenant.id for tenant in tenants]
+        history = _history_by_tenant(ids)
+        rows = []
+        for tenant in tenants:
+            metrics = score_tenant(tenant.entry_date, tenant.is_active, history[tenant.id], current, due_day)
+            if metrics is not None:
+                rows.append({'tenant_id': tenant.id, 'owner_id': tenant.owner_id,
+                             'computed_at': computed_at, **metrics})
+
+        # Réécriture du lot : un locataire sans mois dû perd son ancien score
+        connection = db.session.connection()
+        connection.execute(scores.delete().where(scores.c.tenant_id.in_(ids)))
+        if rows:
+            connection.execute(scores.insert(), rows)
+        db.session.commit()
+        total += len(rows)
+
+    logger.info("Scores de fiabilité recalculés: %s locataire(s)", total)
+    return total
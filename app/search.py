@@ -0,0 +1,274 @@
+"""
+Recherche globale des locataires, appartements et immeubles d'un propriétaire.
+
+Chaque objet recherchable a une ligne dans `search_entries` : texte normalisé
+(minuscules, sans accents, téléphone réduit à ses chiffres), maintenu à chaque
+flush par `_sync_search_entries`. L'index plein texte dépend du moteur :
+  - SQLite : table virtuelle FTS5 `search_entries_fts` (contenu externe, triggers)
+  - PostgreSQL : index GIN pg_trgm sur `search_entries.content`
+
+Les tables sont créées par les migrations ; `flask search rebuild` installe
+l'index propre au moteur et reconstruit toutes les lignes.
+"""
+import logging
+import re
+import unicodedata
+
+from sqlalchemy import DDL, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import Property, SearchEntry, Tenant, Unit, cascaded_deletes
+
+logger = logging.getLogger(__name__)
+
+# Ordre d'affichage des résultats
+KINDS = ('tenant', 'unit', 'property')
+
+# Taille des lots pour les clauses IN (limite de paramètres de SQLite)
+_CHUNK_SIZE = 500
+
+SQLITE_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_entries_fts USING fts5("
+    "content, content='search_entries', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS search_entries_ai AFTER INSERT ON search_entries BEGIN "
+    "INSERT INTO search_entries_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS search_entries_ad AFTER DELETE ON search_entries BEGIN "
+    "INSERT INTO search_entries_fts(search_entries_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS search_entries_au AFTER UPDATE ON search_entries BEGIN "
+    "INSERT INTO search_entries_fts(search_entries_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO search_entries_fts(rowid, content) VALUES (new.id, new.content); END",
+)
+
+POSTGRESQL_INDEX_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_search_entries_content_trgm "
+    "ON search_entries USING gin (content gin_trgm_ops)",
+)
+
+
+# ====== NORMALISATION ======
+
+def normalize(text):
+    """Minuscules sans accents, mots alphanumériques séparés par un espace."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def phone_terms(phone):
+    """Chiffres du numéro, avec et sans l'indicatif 221."""
+    digits = re.sub(r'\D', '', phone or '')
+    terms = [digits] if digits else []
+    if digits.startswith('221') and len(digits) > 9:
+        terms.append(digits[3:])
+    return terms
+
+
+def query_terms(query):
+    """
+    Découpe une saisie en préfixes à rechercher.
+
+    Une saisie qui ressemble à un numéro ("77 123 45") devient un seul préfixe
+    de chiffres, comme le numéro stocké.
+    """
+    if re.fullmatch(r'[\d\s+().-]+', query or '') and re.search(r'\d', query):
+        digits = re.sub(r'\D', '', query)
+        if digits.startswith('221') and len(digits) > 9:
+            digits = digits[3:]
+        return [digits]
+    return normalize(query).split()
+
+
+def _content(*parts):
+    # Espace initial : "% terme%" cherche un début de mot dans la colonne indexée
+    return ' ' + ' '.join(part for part in parts if part)
+
+
+# ====== MAINTIEN DE L'INDEX ======
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), _CHUNK_SIZE):
+        yield ids[start:start + _CHUNK_SIZE]
+
+
+def _build_rows(connection, property_ids, unit_ids, tenant_ids):
+    rows = []
+    for chunk in _chunks(property_ids):
+        for prop in connection.execute(
+                db.select(Property.id, Property.owner_id, Property.name, Property.address)
+                .where(Property.id.in_(chunk))):
+            rows.append({'owner_id': prop.owner_id, 'kind': 'property', 'object_id': prop.id,
+                         'property_id': prop.id,
+                         'title': prop.name, 'subtitle': prop.address or '',
+                         'content': _content(normalize(prop.name), normalize(prop.address))})
+
+    for chunk in _chunks(unit_ids):
+        for unit in connection.execute(
+                db.select(Unit.id, Unit.door_number, Unit.property_id, Property.owner_id, Property.name)
+                .join(Property, Unit.property_id == Property.id)
+                .where(Unit.id.in_(chunk))):
+            rows.append({'owner_id': unit.owner_id, 'kind': 'unit', 'object_id': unit.id,
+                         'property_id': unit.property_id,
+                         'title': f"Appt {unit.door_number}", 'subtitle': unit.name,
+                         'content': _content(normalize(unit.door_number))})
+
+    for chunk in _chunks(tenant_ids):
+        for tenant in connection.execute(
+                db.select(Tenant.id, Tenant.full_name, Tenant.phone, Unit.door_number, Unit.property_id,
+                          Property.owner_id, Property.name)
+                .join(Unit, Tenant.unit_id == Unit.id)
+                .join(Property, Unit.property_id == Property.id)
+                .where(Tenant.id.in_(chunk))):
+            rows.append({'owner_id': tenant.owner_id, 'kind': 'tenant', 'object_id': tenant.id,
+                         'property_id': tenant.property_id,
+                         'title': tenant.full_name, 'subtitle': f"{tenant.name} - Appt {tenant.door_number}",
+                         'content': _content(normalize(tenant.full_name), *phone_terms(tenant.phone))})
+    return rows
+
+
+def _delete_entries(connection, kind, ids):
+    entries = SearchEntry.__table__
+    for chunk in _chunks(ids):
+        connection.execute(entries.delete().where(entries.c.kind == kind, entries.c.object_id.in_(chunk)))
+
+
+def refresh_entries(connection, property_ids=(), unit_ids=(), tenant_ids=()):
+    """
+    Recalcule les lignes d'index des objets donnés et de leurs descendants
+    (le nom d'un immeuble apparaît dans les résultats de ses appartements et locataires).
+    """
+    property_ids, unit_ids, tenant_ids = set(property_ids), set(unit_ids), set(tenant_ids)
+    for chunk in _chunks(property_ids):
+        unit_ids.update(connection.scalars(db.select(Unit.id).where(Unit.property_id.in_(chunk))))
+    for chunk in _chunks(unit_ids):
+        tenant_ids.update(connection.scalars(db.select(Tenant.id).where(Tenant.unit_id.in_(chunk))))
+
+    for kind, ids in (('property', property_ids), ('unit', unit_ids), ('tenant', tenant_ids)):
+        _delete_entries(connection, kind, ids)
+
+    rows = _build_rows(connection, property_ids, unit_ids, tenant_ids)
+    if rows:
+        connection.execute(SearchEntry.__table__.insert(), rows)
+    return len(rows)
+
+
+def rebuild(connection):
+    """Reconstruit tout l'index (après migration ou import en masse)."""
+    connection.execute(SearchEntry.__table__.delete())
+    return refresh_entries(connection,
+                           property_ids=connection.scalars(db.select(Property.id)).all())
+
+
+# Attributs dont la modification change le contenu indexé
+_INDEXED_ATTRIBUTES = {
+    Property: ('name', 'address', 'owner_id'),
+    Unit: ('door_number', 'property_id'),
+    Tenant: ('full_name', 'phone', 'unit_id'),
+}
+_KIND_OF = {Property: 'property', Unit: 'unit', Tenant: 'tenant'}
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_entries(session, flush_context):
+    """Tient `search_entries` à jour dans la même transaction que l'écriture."""
+    changed = {'property': set(), 'unit': set(), 'tenant': set()}
+    removed = {'property': set(), 'unit': set(), 'tenant': set()}
+
+    for obj in session.new:
+        if type(obj) in _KIND_OF:
+            changed[_KIND_OF[type(obj)]].add(obj.id)
+    for obj in session.dirty:
+        attributes = _INDEXED_ATTRIBUTES.get(type(obj))
+        if attributes and any(db.inspect(obj).attrs[name].history.has_changes() for name in attributes):
+            changed[_KIND_OF[type(obj)]].add(obj.id)
+    for obj in session.deleted:
+        if type(obj) in _KIND_OF:
+            removed[_KIND_OF[type(obj)]].add(obj.id)
+    # Descendance supprimée par ON DELETE CASCADE (jamais chargée)
+    cascaded = cascaded_deletes(session)
+    removed['unit'] |= cascaded['unit']
+    removed['tenant'] |= cascaded['tenant']
+
+    if not any(changed.values()) and not any(removed.values()):
+        return
+
+    connection = session.connection()
+    for kind, ids in removed.items():
+        _delete_entries(connection, kind, ids)
+    refresh_entries(connection, changed['property'] - removed['property'],
+                    changed['unit'] - removed['unit'], changed['tenant'] - removed['tenant'])
+
+
+# ====== INDEX PLEIN TEXTE PROPRE AU MOTEUR ======
+
+def install_index(connection):
+    """Crée l'index plein texte du moteur courant (idempotent)."""
+    dialect = connection.dialect.name
+    statements = {'sqlite': SQLITE_INDEX_DDL, 'postgresql': POSTGRESQL_INDEX_DDL}.get(dialect, ())
+    for statement in statements:
+        connection.execute(db.text(statement))
+    if dialect == 'sqlite':
+        connection.execute(db.text("INSERT INTO search_entries_fts(search_entries_fts) VALUES ('rebuild')"))
+    return dialect if statements else None
+
+
+# db.create_all() (développement) crée aussi l'index
+for _statement in SQLITE_INDEX_DDL:
+    event.listen(SearchEntry.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in POSTGRESQL_INDEX_DDL:
+    event.listen(SearchEntry.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+
+# ====== RECHERCHE ======
+
+def _search_fts(owner_id, terms, limit):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    fts = db.table('search_entries_fts', db.column('rowid'), db.column('rank'))
+    return (SearchEntry.query
+            .join(fts, fts.c.rowid == SearchEntry.id)
+            .filter(db.text("search_entries_fts MATCH :match").bindparams(match=match),
+                    SearchEntry.owner_id == owner_id)
+            .order_by(fts.c.rank)
+            .limit(limit)
+            .all())
+
+
+def _search_like(owner_id, terms, limit):
+    # Sous PostgreSQL, LIKE '% terme%' est servi par l'index trigramme
+    query = SearchEntry.query.filter(SearchEntry.owner_id == owner_id)
+    for term in terms:
+        query = query.filter(SearchEntry.content.like(f'% {term}%'))
+    return query.order_by(SearchEntry.title).limit(limit).all()
+
+
+def search(owner, query, limit=20):
+    """
+    Recherche par préfixes dans les objets du propriétaire.
+
+    Args:
+        owner: Instance de User
+        query: Saisie libre (nom, téléphone, porte, immeuble, adresse)
+        limit: Nombre maximum de résultats
+
+    Returns:
+        list: SearchEntry triées locataires, appartements puis immeubles
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    results = None
+    if db.session.get_bind().dialect.name == 'sqlite':
+        try:
+            results = _search_fts(owner.id, terms, limit)
+        except OperationalError as e:
+            # Index FTS5 absent (base créée sans `flask search rebuild`)
+            db.session.rollback()
+            logger.warning("Recherche FTS5 indisponible, repli sur LIKE: %s", e)
+    if results is None:
+        results = _search_like(owner.id, terms, limit)
+
+    return sorted(results, key=lambda entry: KINDS.index(entry.kind))
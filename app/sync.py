@@ -0,0 +1,210 @@
+"""
+Synchronisation incrémentale pour les clients hors ligne (`/sync?since=<curseur>`).
+
+Chaque propriétaire a un compteur `users.sync_seq`. Un flush qui écrit ses
+immeubles, appartements, locataires ou paiements prend le numéro suivant
+(un seul par flush et par propriétaire) et le pose sur les lignes écrites
+(`change_seq`, `updated_at`) ; une suppression laisse un `SyncTombstone` avec
+ce numéro. L'UPDATE du compteur verrouille la ligne du propriétaire jusqu'au
+commit : les numéros deviennent visibles dans l'ordre, sans trou à rattraper.
+
+Le client garde le dernier curseur reçu et ne télécharge que les lignes de
+numéro supérieur, par lots (SYNC_BATCH_SIZE) : le coût d'un rafraîchissement
+suit le volume des changements, pas la taille du parc. `since=0` renvoie tout.
+
+Une suppression d'immeuble, d'appartement ou de locataire ne laisse qu'un
+tombstone : la base supprime la descendance (ON DELETE CASCADE) et le client
+fait de même.
+
+Limites :
+  - les tombstones de plus de SYNC_TOMBSTONE_DAYS jours sont purgés
+    (`flask data purge-tombstones`) ; un curseur plus ancien reçoit 410 et le
+    client repart de 0 ;
+  - l'archivage (app/archival.py) retire des lignes sans tombstone : le client
+    garde l'historique qu'il a déjà ;
+  - le transfert d'un immeuble à un autre propriétaire (UPDATE ensemblistes des
+    enfants) n'est pas suivi : les deux propriétaires doivent repartir de 0.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session, object_session
+
+from app.extensions import db
+from app.models import Payment, Property, SyncTombstone, Tenant, Unit, User
+
+# Type de ligne -> (modèle, champs transmis), dans l'ordre d'application côté client
+SYNCED = {
+    'properties': (Property, ('id', 'name', 'address', 'updated_at')),
+    'units': (Unit, ('id', 'property_id', 'door_number', 'rent_amount', 'updated_at')),
+    'tenants': (Tenant, ('id', 'unit_id', 'full_name', 'phone', 'email', 'is_active', 'entry_date',
+                         'updated_at')),
+    'payments': (Payment, ('id', 'tenant_id', 'amount', 'period', 'date_paid', 'receipt_token',
+                           'receipt_number', 'updated_at')),
+}
+
+
+class StaleCursor(Exception):
+    """Curseur antérieur aux tombstones conservés (410) : resynchronisation complète."""
+
+
+# ====== NUMÉROS DE CHANGEMENT ======
+
+@event.listens_for(Session, 'before_flush')
+def _reset_flush_seqs(session, flush_context, instances):
+    session.info['sync_seqs'] = {}
+
+
+def _next_seq(connection, target, owner_id):
+    """Numéro du flush en cours pour le propriétaire (attribué à la première écriture)."""
+    seqs = object_session(target).info.setdefault('sync_seqs', {})
+    if owner_id not in seqs:
+        users = User.__table__
+        connection.execute(users.update().where(users.c.id == owner_id)
+                           .values(sync_seq=db.func.coalesce(users.c.sync_seq, 0) + 1))
+        seqs[owner_id] = connection.scalar(db.select(users.c.sync_seq).where(users.c.id == owner_id))
+    return seqs[owner_id]
+
+
+def _add_tombstone(connection, target, kind, owner_id):
+    connection.execute(SyncTombstone.__table__.insert().values(
+        owner_id=owner_id, kind=kind, object_id=target.id,
+        change_seq=_next_seq(connection, target, owner_id), deleted_at=datetime.utcnow()))
+
+
+def _tracking_listeners(kind):
+    def stamp(mapper, connection, target):
+        session = object_session(target)
+        state = sa_inspect(target)
+        if state.persistent and not session.is_modified(target, include_collections=False):
+            return
+        # Ligne passée à un autre propriétaire : elle disparaît chez l'ancien
+        previous_owners = state.attrs['owner_id'].history.deleted
+        for previous_owner in previous_owners:
+            if previous_owner is not None and previous_owner != target.owner_id:
+                _add_tombstone(connection, target, kind, previous_owner)
+        if target.owner_id is not None:
+            target.change_seq = _next_seq(connection, target, target.owner_id)
+            target.updated_at = datetime.utcnow()
+
+    def tombstone(mapper, connection, target):
+        if target.owner_id is not None:
+            _add_tombstone(connection, target, kind, target.owner_id)
+
+    return stamp, tombstone
+
+
+# Enregistrés après ceux de models.py : owner_id est déjà renseigné
+for _kind, (_model, _fields) in SYNCED.items():
+    _stamp, _tombstone = _tracking_listeners(_kind)
+    event.listen(_model, 'before_insert', _stamp)
+    event.listen(_model, 'before_update', _stamp)
+    event.listen(_model, 'before_delete', _tombstone)
+
+
+# ====== LECTURE ======
+
+def _serialize(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _window(model, owner_id, since, cursor):
+    return (model.owner_id == owner_id, model.change_seq > since, model.change_seq <= cursor)
+
+
+def changes_since(user, since=0, limit=500):
+    """
+    Lignes et suppressions du propriétaire de numéro > since, par lot d'environ
+    `limit` lignes (un flush n'est jamais coupé entre deux lots).
+
+    Raises:
+        StaleCursor: Curseur antérieur à la dernière purge des tombstones
+        ValueError: Curseur inconnu (supérieur au dernier numéro attribué)
+
+    Returns:
+        dict: cursor, has_more, changes {type: {fields, rows}}, deleted {type: [id]}
+    """
+    latest, floor = db.session.execute(db.select(User.sync_seq, User.sync_floor).where(User.id == user.id)).one()
+    if since > (latest or 0):
+        raise ValueError("Curseur de synchronisation inconnu.")
+    if 0 < since < (floor or 0):
+        raise StaleCursor()
+    # Instantané complet : les lignes supprimées ne sont pas dans la base
+    sources = [model for model, _ in SYNCED.values()] + ([SyncTombstone] if since else [])
+
+    # Numéros des `limit` + 1 premiers changements de chaque table (lecture d'index seule) :
+    # le numéro de trop signale un lot suivant, même quand une seule table a changé
+    seqs = sorted(seq for model in sources for seq in db.session.scalars(
+        db.select(model.change_seq)
+        .where(model.owner_id == user.id, model.change_seq > since)
+        .order_by(model.change_seq)
+        .limit(limit + 1)))
+    has_more = len(seqs) > limit
+    cursor = seqs[limit - 1] if has_more else (latest or 0)
+
+    changes = {}
+    for kind, (model, fields) in SYNCED.items():
+        rows = db.session.execute(db.select(*[getattr(model, field) for field in fields])
+                                  .where(*_window(model, user.id, since, cursor))
+                                  .order_by(model.change_seq, model.id)).all()
+        if rows:
+            changes[kind] = {'fields': list(fields), 'rows': [[_serialize(value) for value in row] for row in rows]}
+
+    deleted = {}
+    if since:
+        for kind, object_id in db.session.execute(db.select(SyncTombstone.kind, SyncTombstone.object_id)
+                                                  .where(*_window(SyncTombstone, user.id, since, cursor))
+                                                  .order_by(SyncTombstone.change_seq)):
+            deleted.setdefault(kind, []).append(object_id)
+
+    return {'cursor': str(cursor), 'has_more': has_more, 'changes': changes, 'deleted': deleted}
+
+
+# ====== MAINTENANCE ======
+
+def backfill(batch_size=5000):
+    """
+    Numérote les lignes antérieures au suivi (change_seq NULL) : id * 4 + rang de la
+    table, distincts par propriétaire, puis place chaque compteur au-delà.
+
+    Returns:
+        int: Nombre de lignes numérotées
+    """
+    total = 0
+    for rank, (model, _) in enumerate(SYNCED.values()):
+        table = model.__table__
+        max_id = db.session.scalar(db.select(db.func.max(table.c.id))) or 0
+        for first_id in range(1, max_id + 1, batch_size):
+            result = db.session.execute(
+                table.update()
+                .where(table.c.id >= first_id, table.c.id < first_id + batch_size, table.c.change_seq.is_(None))
+                .values(change_seq=table.c.id * len(SYNCED) + rank))
+            db.session.commit()
+            total += result.rowcount
+
+    highest = max(db.session.scalar(db.select(db.func.max(model.change_seq))) or 0
+                  for model, _ in SYNCED.values())
+    users = User.__table__
+    db.session.execute(users.update().where(users.c.sync_seq < highest).values(sync_seq=highest))
+    db.session.commit()
+    return total
+
+
+def purge_tombstones(older_than_days):
+    """
+    Supprime les tombstones anciens et relève `sync_floor` des propriétaires concernés.
+
+    Returns:
+        int: Nombre de tombstones supprimés
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    tombstones, users = SyncTombstone.__table__, User.__table__
+    floors = db.session.execute(db.select(tombstones.c.owner_id, db.func.max(tombstones.c.change_seq))
+                                .where(tombstones.c.deleted_at < cutoff)
+                                .group_by(tombstones.c.owner_id)).all()
+    for owner_id, floor in floors:
+        db.session.execute(users.update().where(users.c.id == owner_id, users.c.sync_floor < floor)
+                           .values(sync_floor=floor))
+    result = db.session.execute(tombstones.delete().where(tombstones.c.deleted_at < cutoff))
+    db.session.commit()
+    return result.rowcount
@@ -8,6 +8,85 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'une-cle-secrete-difficile-a-deviner-senegal-2024'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Cache de bytecode Jinja : les templates compilés sont réutilisés entre les workers et les redémarrages
+    JINJA_BYTECODE_CACHE = os.environ.get('JINJA_BYTECODE_CACHE', '1') == '1'
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR') or \
+        os.path.join(basedir, 'instance', 'jinja_cache')
+
+    # Cache de fragments de templates ('memory', 'filesystem' partagé entre workers, ou 'null')
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 512))
+    FRAGMENT_CACHE_DIR = os.environ.get('FRAGMENT_CACHE_DIR') or \
+        os.path.join(basedir, 'instance', 'fragment_cache')
+
+    # Archive des quittances PDF (une par receipt_token, compressée) ; X-Sendfile si un proxy la sert
+    RECEIPT_ARCHIVE_DIR = os.environ.get('RECEIPT_ARCHIVE_DIR') or \
+        os.path.join(basedir, 'instance', 'receipts')
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '0') == '1'
+
+    # URL publique (liens générés hors requête HTTP : campagnes planifiées, CLI)
+    PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL') or 'http://localhost:5000'
+
+    # Campagnes de relances : expéditeur ('manual', 'stub', 'whatsapp_cloud') et jour de lancement
+    REMINDER_SENDER = os.environ.get('REMINDER_SENDER', 'manual')
+    REMINDER_CAMPAIGN_DAY = int(os.environ.get('REMINDER_CAMPAIGN_DAY', 5))
+    WHATSAPP_API_URL = os.environ.get('WHATSAPP_API_URL')
+    WHATSAPP_API_TOKEN = os.environ.get('WHATSAPP_API_TOKEN')
+
+    # Réplique en lecture (optionnelle) pour les routes @read_only, et durée pendant
+    # laquelle un utilisateur qui vient d'écrire reste sur le primaire
+    SQLALCHEMY_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URL')
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+    # Synchronisation hors ligne (/sync) : lignes par réponse, conservation des suppressions (jours)
+    SYNC_BATCH_SIZE = int(os.environ.get('SYNC_BATCH_SIZE', 500))
+    SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 90))
+
+    # Horizon par défaut (mois, 3 à 12) de la prévision d'encaissements du dashboard Premium
+    FORECAST_MONTHS = int(os.environ.get('FORECAST_MONTHS', 6))
+
+    # Archivage chaud / froid (`flask data archive`) : âge en mois au-delà duquel les paiements
+    # et les locataires partis quittent les tables chaudes (12 minimum, fenêtre du tableau de bord)
+    ARCHIVE_PAYMENTS_AFTER_MONTHS = int(os.environ.get('ARCHIVE_PAYMENTS_AFTER_MONTHS', 24))
+    ARCHIVE_TENANTS_AFTER_MONTHS = int(os.environ.get('ARCHIVE_TENANTS_AFTER_MONTHS', 24))
+
+    # Limitation de débit par utilisateur (jetons par minute, rafale) et plafond global de
+    # PDF / exports simultanés, partagés entre les workers via un fichier SQLite local
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB') or os.path.join(basedir, 'instance', 'ratelimit.sqlite')
+    RATE_LIMITS = {
+        'dashboard': (30, 15),
+        'receipt': (12, 6),
+        'export': (4, 2),
+        'sync': (60, 30),
+    }
+    HEAVY_JOBS_MAX_CONCURRENT = int(os.environ.get('HEAVY_JOBS_MAX_CONCURRENT', 2))
+    HEAVY_JOBS_RETRY_AFTER = int(os.environ.get('HEAVY_JOBS_RETRY_AFTER', 5))
+
+    # Journalisation JSON via une file (écriture hors du thread de la requête, voir app/logs.py).
+    # LOG_LEVELS="app=INFO,app.search=DEBUG" ; LOG_ACCESS_SAMPLE_RATE garde une fraction du journal d'accès
+    LOG_QUEUE = os.environ.get('LOG_QUEUE', '1') == '1'
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_LEVELS = dict(item.strip().split('=', 1)
+                      for item in os.environ.get('LOG_LEVELS', 'app=INFO').split(',') if '=' in item)
+    LOG_SAMPLING = {'app.access': float(os.environ.get('LOG_ACCESS_SAMPLE_RATE', 1.0))}
+    LOG_SLOW_REQUEST_MS = int(os.environ.get('LOG_SLOW_REQUEST_MS', 1000))
+
+    # Métriques Prometheus sur /metrics (prometheus_client optionnel), protégées par le jeton
+    # Bearer METRICS_TOKEN. Sans jeton, la route répond 404 hors mode debug.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Jauge des abonnements par plan : une requête GROUP BY par collecte
+    METRICS_SUBSCRIPTIONS = os.environ.get('METRICS_SUBSCRIPTIONS', '1') == '1'
+
+    # Hachage des mots de passe (méthode Werkzeug et coût) ; les anciens hash sont
+    # recalculés à la connexion. Mesurer avec `flask bench passwords`.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+
+    # Préchargement des dépendances lourdes au démarrage (à combiner avec gunicorn --preload)
+    WARMUP_ON_START = os.environ.get('WARMUP', '0') == '1'
+
 class DevelopmentConfig(Config):
     DEBUG = True
     # Utilisation de SQLite par défaut pour le dev rapide, switch vers Postgres plus tard
@@ -18,6 +97,13 @@ class ProductionConfig(Config):
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
+    # Pool de connexions dimensionné sur les threads gunicorn (une connexion par thread + marge)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_pre_ping': True,
+        'pool_size': int(os.environ.get('GUNICORN_THREADS', 4)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 4)),
+    }
+
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
@@ -0,0 +1,134 @@
+"""
+Configuration gunicorn : gunicorn -c gunicorn.conf.py run:app
+
+Modes (variable GUNICORN_MODE) :
+  - gthread (défaut) : N workers x T threads, un rendu WeasyPrint ou un export
+    Excel lent ne bloque plus tout le worker.
+  - gevent : workers asynchrones (pip install gevent psycogreen).
+  - sync : mode historique, une requête à la fois par worker.
+
+Sûreté threads/greenlets : la session SQLAlchemy de Flask-SQLAlchemy est
+scopée au contexte applicatif (une session par requête), et le seul état de
+module de finances.views est le logger ; le cache de `app.lazy` est protégé
+par un verrou et les caches du moteur natif de quittances sont des lru_cache.
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+cpu_count = multiprocessing.cpu_count()
+worker_mode = os.environ.get('GUNICORN_MODE', 'gthread')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Plafond de workers : la mémoire (512 Mo sur Render free) limite plus que le CPU
+max_workers = int(os.environ.get('GUNICORN_MAX_WORKERS', 4))
+
+if worker_mode == 'gevent':
+    worker_class = 'gevent'
+    workers = int(os.environ.get('WEB_CONCURRENCY', min(cpu_count, max_workers)))
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+elif worker_mode == 'gthread':
+    worker_class = 'gthread'
+    workers = int(os.environ.get('WEB_CONCURRENCY', min(cpu_count, max_workers)))
+    # Threads par worker selon le CPU (2 par coeur, 2 à 8) ; exporté pour dimensionner le
+    # pool SQLAlchemy de l'application, chargée après ce fichier
+    threads = int(os.environ.setdefault('GUNICORN_THREADS', str(min(max(2 * cpu_count, 2), 8))))
+else:
+    worker_class = 'sync'
+    workers = int(os.environ.get('WEB_CONCURRENCY', min(2 * cpu_count + 1, max_workers)))
+
+# Recyclage des workers : WeasyPrint fait grossir la mémoire au fil des rendus
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 500))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 50))
+
+# Préchargement (WARMUP=1) ; incompatible avec gevent, qui doit patcher avant l'import de l'app
+preload_app = os.environ.get('WARMUP', '0') == '1' and worker_mode != 'gevent'
+
+# Seuils de requête lente par classe de route (secondes), journalisés après coup.
+# Ce ne sont pas des timeouts : gunicorn n'a qu'un timeout global, qui surveille le
+# worker et non chaque requête (en gthread, un thread bloqué n'est jamais interrompu).
+SLOW_REQUEST_SECONDS = {
+    'pdf': int(os.environ.get('SLOW_PDF_SECONDS', 60)),
+    'export': int(os.environ.get('SLOW_EXPORT_SECONDS', 120)),
+    'default': int(os.environ.get('SLOW_DEFAULT_SECONDS', 30)),
+}
+ROUTE_CLASSES = (
+    ('/finances/receipt/', 'pdf'),
+    ('/finances/export/', 'export'),
+)
+
+# Worker muet plus longtemps que ça : tué et remplacé par le maître
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Latence simulée de chaque requête SQL (`flask bench load --sql-latency-ms`) : une base
+# distante fait attendre le worker à chaque requête, ce qu'un SQLite local ne montre pas
+bench_sql_latency = float(os.environ.get('BENCH_SQL_LATENCY_MS', 0)) / 1000
+
+accesslog = '-'
+errorlog = '-'
+
+# Métriques Prometheus multiprocess : chaque worker écrit dans ce dossier (fixé avant
+# le chargement de l'application, vidé au démarrage du maître), /metrics les agrège
+prometheus_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'prometheus'))
+
+
+def route_class(path):
+    """Classe de route d'un chemin HTTP ('pdf', 'export' ou 'default')."""
+    for prefix, name in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return 'default'
+
+
+def on_starting(server):
+    # Fichiers d'un démarrage précédent : compteurs de workers qui n'existent plus
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Les jauges 'livesum' (connexions du pool) d'un worker mort ne comptent plus
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    if worker_mode == 'gevent':
+        # psycopg2 n'est coopératif sous gevent qu'avec psycogreen
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen absent : les requêtes PostgreSQL bloqueront le worker gevent")
+
+    if bench_sql_latency:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.listen(Engine, 'before_cursor_execute', lambda *args: time.sleep(bench_sql_latency))
+
+    if preload_app and 'run' in sys.modules:
+        # Ne jamais partager les connexions du process maître avec les workers
+        from app.extensions import db
+        with sys.modules['run'].app.app_context():
+            db.engine.dispose(close=False)
+
+
+def pre_request(worker, req):
+    req.started_at = time.monotonic()
+
+
+def post_request(worker, req, environ, resp):
+    elapsed = time.monotonic() - getattr(req, 'started_at', time.monotonic())
+    threshold = SLOW_REQUEST_SECONDS[route_class(req.path)]
+    if elapsed > threshold:
+        worker.log.warning(f"Requête lente {req.method} {req.path}: {elapsed:.1f}s (seuil {threshold}s)")
@@ -4,6 +4,12 @@ from app.models import User, Property, Unit, Tenant, Payment
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 
+# Préchargement optionnel (WARMUP=1) : avec `gunicorn --preload run:app`, le
+# process maître importe WeasyPrint & co une seule fois avant de forker les workers
+if app.config.get('WARMUP_ON_START'):
+    from app.lazy import warm_up
+    warm_up(app)
+
 # Context processor pour le shell flask (pratique pour le debug)
 @app.shell_context_processor
 def make_shell_context():
@@ -0,0 +1,16 @@
+import os
+
+# Base en mémoire : à fixer avant create_app (le moteur est lié à la création de l'app)
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, RATE_LIMIT_ENABLED=False)
+    with app.test_request_context():
+        yield app